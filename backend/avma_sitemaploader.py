@@ -1,5 +1,12 @@
+import asyncio
 import itertools
+import logging
+import multiprocessing
 import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from typing import (
     Any,
     Callable,
@@ -17,6 +24,8 @@ from langchain_core.documents import Document
 
 from langchain_community.document_loaders.web_base import WebBaseLoader
 
+logger = logging.getLogger(__name__)
+
 
 def _default_parsing_function(content: Any) -> str:
     return str(content.get_text())
@@ -45,6 +54,80 @@ def _extract_scheme_and_domain(url: str) -> Tuple[str, str]:
     return parsed_uri.scheme, parsed_uri.netloc
 
 
+@dataclass(frozen=True)
+class _PageParser:
+    """The page parsing settings of a loader, shipped to the parsing worker processes."""
+
+    default_parser: str
+    parsing_function: Callable
+    meta_function: Callable
+    markup_parsing_function: Optional[Callable[[str, str], str]]
+    bs_kwargs: Optional[dict]
+
+    def parse(self, el: dict, html: str) -> Document:
+        from bs4 import BeautifulSoup
+
+        # Same parser selection as WebBaseLoader.scrape_all.
+        parser = "xml" if el["loc"].strip().endswith(".xml") else self.default_parser
+        if (
+            self.markup_parsing_function is not None
+            and not self.bs_kwargs
+            and self.meta_function is _default_meta_function
+        ):
+            return Document(
+                page_content=self.markup_parsing_function(html, parser),
+                metadata=self.meta_function(el, None),
+            )
+        soup = BeautifulSoup(html, parser, **(self.bs_kwargs or {}))
+        return Document(
+            page_content=self.parsing_function(soup),
+            metadata=self.meta_function(el, soup),
+        )
+
+    def parse_chunk(self, pages: List[Tuple[dict, str]]) -> List[Document]:
+        return [self.parse(el, html) for el, html in pages]
+
+
+def _xml_soup(text: str) -> Any:
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(text, "xml")
+
+
+class _AdaptiveHostLimiter:
+    """Limit the concurrent requests to a host, halving the limit when it throttles us.
+
+    The limit grows back by one after every `limit` successful requests.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self._active = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self._successes = 0
+
+    def on_throttled(self) -> None:
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+
 class AVMASitemapLoader(WebBaseLoader):
     """Load a sitemap and its URLs.
 
@@ -86,6 +169,14 @@ class AVMASitemapLoader(WebBaseLoader):
         continue_on_failure: bool = False,
         restrict_to_same_domain: bool = True,
         max_depth: int = 10,
+        async_crawl: bool = True,
+        crawl_concurrency_per_host: int = 8,
+        crawl_max_connections: int = 32,
+        crawl_max_retries: int = 5,
+        crawl_backoff_seconds: float = 1.0,
+        markup_parsing_function: Optional[Callable[[str, str], str]] = None,
+        parse_workers: int = 1,
+        parse_chunksize: int = 8,
         **kwargs: Any,
     ):
         """Initialize with webpage path and optional filter URLs.
@@ -117,6 +208,27 @@ class AVMASitemapLoader(WebBaseLoader):
                 domain as the sitemap. Attention: This is only applied if the sitemap
                 is not a local file!
             max_depth: maximum depth to follow sitemap links. Default: 10
+            async_crawl: whether to crawl the child sitemaps concurrently with
+                `aparse_sitemap` instead of one at a time. Default: True
+            crawl_concurrency_per_host: maximum number of concurrent sitemap
+                requests per host. Lowered automatically while the host answers
+                with 429 or 5xx. Default: 8
+            crawl_max_connections: size of the connection pool shared by the
+                sitemap requests. Default: 32
+            crawl_max_retries: how many times a throttled sitemap request is
+                retried. Default: 5
+            crawl_backoff_seconds: base delay of the exponential backoff between
+                retries, used when the host sends no Retry-After. Default: 1.0
+            markup_parsing_function: Function to parse the raw page markup, given
+                the name of the BeautifulSoup parser the page would be parsed with.
+                When set, `parse_page` uses it instead of building a soup for
+                parsing_function, unless bs_kwargs or meta_function are set.
+            parse_workers: number of worker processes parsing the pages. With 1,
+                the pages are parsed in the calling thread. The parsing and meta
+                functions must be picklable (e.g. module-level functions) when
+                this is more than 1. Default: 1
+            parse_chunksize: number of pages sent to a worker process at once.
+                Default: 8
         """
 
         if blocksize is not None and blocksize < 1:
@@ -142,25 +254,24 @@ class AVMASitemapLoader(WebBaseLoader):
         self.restrict_to_same_domain = restrict_to_same_domain
         self.parsing_function = parsing_function or _default_parsing_function
         self.meta_function = meta_function or _default_meta_function
+        self.markup_parsing_function = markup_parsing_function
         self.blocksize = blocksize
         self.blocknum = blocknum
         self.is_local = is_local
         self.continue_on_failure = continue_on_failure
         self.max_depth = max_depth
-
-    def parse_sitemap(self, soup: Any, *, depth: int = 0) -> List[dict]:
-        """Parse sitemap xml and load into a list of dicts.
-
-        Args:
-            soup: BeautifulSoup object.
-            depth: current depth of the sitemap. Default: 0
-
-        Returns:
-            List of dicts.
-        """
-        if depth >= self.max_depth:
-            return []
-
+        self.async_crawl = async_crawl
+        self.crawl_concurrency_per_host = crawl_concurrency_per_host
+        self.crawl_max_connections = crawl_max_connections
+        self.crawl_max_retries = crawl_max_retries
+        self.crawl_backoff_seconds = crawl_backoff_seconds
+        self.parse_workers = parse_workers
+        self.parse_chunksize = parse_chunksize
+        self._parse_executor: Optional[ProcessPoolExecutor] = None
+        self._parse_executor_lock = threading.Lock()
+
+    def _parse_url_entries(self, soup: Any) -> List[dict]:
+        """Extract the allowed <url> entries of a sitemap."""
         els: List[Dict] = []
 
         for url in soup.find_all("url"):
@@ -190,7 +301,11 @@ class AVMASitemapLoader(WebBaseLoader):
                     if (prop := url.find(tag))
                 }
             )
+        return els
 
+    def _child_sitemap_locs(self, soup: Any) -> List[str]:
+        """Extract the locations of the child sitemaps of a sitemap index."""
+        locs = []
         for sitemap in soup.find_all("sitemap"):
             loc = sitemap.find("loc")
             if not loc:
@@ -206,12 +321,131 @@ class AVMASitemapLoader(WebBaseLoader):
             # if "ARTICLE" not in loc.text or "NEWS_ARTICLE" in loc.text:
             #     continue
 
-            soup_child = self.scrape_all([loc.text], "xml")[0]
+            if (
+                self.restrict_to_same_domain
+                and not self.is_local
+                and _extract_scheme_and_domain(loc.text.strip())
+                != _extract_scheme_and_domain(self.web_path)
+            ):
+                continue
+
+            locs.append(loc.text)
+        return locs
+
+    def parse_sitemap(self, soup: Any, *, depth: int = 0) -> List[dict]:
+        """Parse sitemap xml and load into a list of dicts.
+
+        Child sitemaps are fetched one at a time, see `aparse_sitemap` for the concurrent version.
+
+        Args:
+            soup: BeautifulSoup object.
+            depth: current depth of the sitemap. Default: 0
+
+        Returns:
+            List of dicts.
+        """
+        if depth >= self.max_depth:
+            return []
+
+        els = self._parse_url_entries(soup)
+        for loc in self._child_sitemap_locs(soup):
+            soup_child = self.scrape_all([loc], "xml")[0]
             els.extend(self.parse_sitemap(soup_child, depth=depth + 1))
         return els
 
-    def lazy_load(self) -> Iterator[Document]:
-        """Load sitemap."""
+    async def aparse_sitemap(self, soup: Any) -> List[dict]:
+        """Parse sitemap xml, crawling the child sitemaps concurrently.
+
+        All the child sitemaps share one connection pool. Requests are limited per host, and the
+        limit of a host is lowered when it answers with 429 or 5xx. The entries are returned in
+        the same order as `parse_sitemap`.
+
+        Args:
+            soup: BeautifulSoup object of the root sitemap.
+
+        Returns:
+            List of dicts.
+        """
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.crawl_max_connections,
+            limit_per_host=self.crawl_concurrency_per_host,
+            ssl=None if self.session.verify else False,
+        )
+        async with aiohttp.ClientSession(
+            connector=connector,
+            headers=dict(self.session.headers),
+            cookies=self.session.cookies.get_dict(),
+            trust_env=self.trust_env,
+        ) as session:
+            limiters: Dict[str, _AdaptiveHostLimiter] = {}
+
+            async def crawl(soup: Any, depth: int) -> List[dict]:
+                if depth >= self.max_depth:
+                    return []
+                els = self._parse_url_entries(soup)
+                children = await asyncio.gather(
+                    *(
+                        fetch_and_crawl(loc, depth + 1)
+                        for loc in self._child_sitemap_locs(soup)
+                    )
+                )
+                for child_els in children:
+                    els.extend(child_els)
+                return els
+
+            async def fetch_and_crawl(loc: str, depth: int) -> List[dict]:
+                if depth >= self.max_depth:
+                    return []
+                host = urlparse(loc.strip()).netloc
+                limiter = limiters.setdefault(
+                    host, _AdaptiveHostLimiter(self.crawl_concurrency_per_host)
+                )
+                try:
+                    text = await self._afetch_sitemap(session, loc.strip(), limiter)
+                except Exception:
+                    if not self.continue_on_failure:
+                        raise
+                    logger.warning(
+                        f"Error fetching sitemap {loc}, skipping due to continue_on_failure=True"
+                    )
+                    return []
+                return await crawl(_xml_soup(text), depth)
+
+            return await crawl(soup, 0)
+
+    async def _afetch_sitemap(
+        self, session: Any, url: str, limiter: "_AdaptiveHostLimiter"
+    ) -> str:
+        for attempt in range(self.crawl_max_retries + 1):
+            async with limiter, session.get(url) as response:
+                throttled = response.status == 429 or response.status >= 500
+                if not throttled:
+                    response.raise_for_status()
+                    limiter.on_success()
+                    return await response.text()
+                retry_after = response.headers.get("Retry-After", "")
+            limiter.on_throttled()
+            if attempt == self.crawl_max_retries:
+                break
+            delay = (
+                float(retry_after)
+                if retry_after.isdigit()
+                else self.crawl_backoff_seconds * 2**attempt
+            )
+            logger.warning(
+                f"Sitemap {url} answered {response.status}, retrying in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+        raise ValueError(f"Sitemap {url} still throttled after {attempt + 1} attempts")
+
+    def load_sitemap_entries(self) -> List[dict]:
+        """Load the sitemap and return the entries of the selected block.
+
+        Returns:
+            List of dicts with the loc, lastmod, changefreq, priority and title of the URLs.
+        """
         if self.is_local:
             try:
                 import bs4
@@ -225,7 +459,10 @@ class AVMASitemapLoader(WebBaseLoader):
         else:
             soup = self._scrape(self.web_path, parser="xml")
 
-        els = self.parse_sitemap(soup)
+        if self.async_crawl:
+            els = asyncio.run(self.aparse_sitemap(soup))
+        else:
+            els = self.parse_sitemap(soup)
 
         if self.blocksize is not None:
             elblocks = list(_batch_block(els, self.blocksize))
@@ -237,10 +474,90 @@ class AVMASitemapLoader(WebBaseLoader):
             else:
                 els = elblocks[self.blocknum]
 
-        results = self.scrape_all([el["loc"].strip() for el in els if "loc" in el])
+        return [el for el in els if "loc" in el]
 
-        for i, result in enumerate(results):
-            yield Document(
-                page_content=self.parsing_function(result),
-                metadata=self.meta_function(els[i], result),
-            )
+    def fetch_page(self, url: str) -> str:
+        """Fetch the raw HTML of a page with the loader's session.
+
+        Returns an empty string on failure when continue_on_failure is set.
+        """
+        try:
+            response = self.session.get(url, **self.requests_kwargs)
+            if self.raise_for_status:
+                response.raise_for_status()
+            if self.encoding is not None:
+                response.encoding = self.encoding
+            elif self.autoset_encoding:
+                response.encoding = response.apparent_encoding
+            return response.text
+        except Exception:
+            if self.continue_on_failure:
+                logger.warning(
+                    f"Error fetching {url}, skipping due to continue_on_failure=True"
+                )
+                return ""
+            raise
+
+    def _page_parser(self) -> _PageParser:
+        return _PageParser(
+            default_parser=self.default_parser,
+            parsing_function=self.parsing_function,
+            meta_function=self.meta_function,
+            markup_parsing_function=self.markup_parsing_function,
+            bs_kwargs=self.bs_kwargs,
+        )
+
+    def parse_page(self, el: dict, html: str) -> Document:
+        """Parse the raw HTML of a sitemap entry into a Document."""
+        return self._page_parser().parse(el, html)
+
+    def _get_parse_executor(self) -> ProcessPoolExecutor:
+        with self._parse_executor_lock:
+            if self._parse_executor is None:
+                # Ingestion runs the loader next to other threads, where forking is unsafe.
+                self._parse_executor = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._parse_executor
+
+    def parse_pages(self, pages: Iterable[Tuple[dict, str]]) -> Iterator[Document]:
+        """Parse (sitemap entry, raw HTML) pairs into Documents, in order.
+
+        With more than one parse worker, the raw HTML is shipped to a pool of worker
+        processes, parse_chunksize pages at a time. At most two chunks per worker are in
+        flight, so pages are streamed rather than all parsed before the first is returned.
+        """
+        page_parser = self._page_parser()
+        if self.parse_workers <= 1:
+            for el, html in pages:
+                yield page_parser.parse(el, html)
+            return
+
+        executor = self._get_parse_executor()
+        pending: deque = deque()
+        try:
+            for chunk in _batch_block(pages, self.parse_chunksize):
+                pending.append(executor.submit(page_parser.parse_chunk, chunk))
+                if len(pending) >= 2 * self.parse_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """Shut down the parsing worker processes, if any were started."""
+        with self._parse_executor_lock:
+            if self._parse_executor is not None:
+                self._parse_executor.shutdown()
+                self._parse_executor = None
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Load sitemap."""
+        els = self.load_sitemap_entries()
+
+        htmls = asyncio.run(self.fetch_all([el["loc"].strip() for el in els]))
+
+        yield from self.parse_pages(zip(els, htmls))
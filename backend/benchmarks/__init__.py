@@ -0,0 +1 @@
+"""Offline benchmarks of the ingestion and retrieval code paths."""
@@ -0,0 +1,122 @@
+"""Benchmark merging retrieved documents into the graph state with `reduce_docs`.
+
+Each research query writes its documents to the state, and `reduce_docs` merges them
+into the documents already there. This measures one merge of a batch of retrieved
+documents into states of growing sizes, and filling a state batch by batch, with the
+indexed `DocumentCollection` and with the previous list-scanning reducer:
+
+    python -m backend.benchmarks.documents
+    python -m backend.benchmarks.documents --sizes 10 100 1000 10000 --batch-size 20
+"""
+
+import argparse
+import itertools
+import time
+import uuid
+from typing import Callable, Optional
+
+from langchain_core.documents import Document
+
+from backend.utils import reduce_docs
+
+
+def list_reduce_docs(
+    existing: Optional[list[Document]], new: list[Document]
+) -> list[Document]:
+    """The previous reducer: copies the documents and rebuilds their uuid set per merge."""
+    existing_list = list(existing) if existing else []
+    new_list = []
+    existing_ids = {doc.metadata.get("uuid") for doc in existing_list}
+    for item in new:
+        item_id = item.metadata.get("uuid")
+        if item_id is None:
+            item_id = str(uuid.uuid4())
+            new_item = item.model_copy(deep=True)
+            new_item.metadata["uuid"] = item_id
+        else:
+            new_item = item
+        if item_id not in existing_ids:
+            new_list.append(new_item)
+            existing_ids.add(item_id)
+    return existing_list + new_list
+
+
+def _batches(count: int, batch_size: int, offset: int = 0) -> list[list[Document]]:
+    """Retrieved-like documents, without uuids, with a duplicate of the previous batch."""
+    documents = [
+        Document(
+            page_content=f"Document {offset + i}. " + "Cats and dogs. " * 60,
+            metadata={"source": f"https://example.com/{offset + i}", "title": "Pets"},
+        )
+        for i in range(count)
+    ]
+    batches = [documents[i : i + batch_size] for i in range(0, count, batch_size)]
+    for previous, batch in itertools.pairwise(batches):
+        batch.append(previous[0])
+    return batches
+
+
+Reducer = Callable[[Optional[list[Document]], list[Document]], list[Document]]
+
+
+def _fill(reducer: Reducer, batches: list[list[Document]]) -> list[Document]:
+    state: list[Document] = []
+    for batch in batches:
+        state = reducer(state, batch)
+    return state
+
+
+def _merge_seconds(
+    reducer: Reducer, batches: list[list[Document]], batch: list[Document], repeat: int
+) -> float:
+    """Time merging `batch` into the state filled with `batches`, as the next write does."""
+    total = 0.0
+    for _ in range(repeat):
+        state = _fill(reducer, batches)
+        start = time.perf_counter()
+        reducer(state, batch)
+        total += time.perf_counter() - start
+    return total / repeat
+
+
+def _fill_seconds(
+    reducer: Reducer, batches: list[list[Document]], repeat: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        _fill(reducer, batches)
+    return (time.perf_counter() - start) / repeat
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10,
+        help="Documents per merge, as returned by one retrieval.",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    reducers = {"list": list_reduce_docs, "collection": reduce_docs}
+    print(
+        f"{'documents':>10} {'reducer':>11} {'merge one batch':>16} {'fill by batches':>16}"
+    )
+    for size in args.sizes:
+        batches = _batches(size, args.batch_size)
+        (batch,) = _batches(args.batch_size, args.batch_size, offset=size)
+        baseline = None
+        for name, reducer in reducers.items():
+            merge = _merge_seconds(reducer, batches, batch, args.repeat)
+            fill = _fill_seconds(reducer, batches, args.repeat)
+            baseline = baseline or (merge, fill)
+            print(
+                f"{size:>10} {name:>11} {merge * 1e6:>12.1f} µs {fill * 1e3:>13.2f} ms"
+                f"  ({baseline[0] / merge:.1f}x, {baseline[1] / fill:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
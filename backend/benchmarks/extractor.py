@@ -0,0 +1,122 @@
+"""Benchmark the lxml fast path of the AVMA page extractor against the BeautifulSoup one.
+
+Both extractors run on the same pages, and their outputs are checked to be identical.
+Pages are read from the given files or directories, by default the equivalence test corpus:
+
+    python -m backend.benchmarks.extractor
+    python -m backend.benchmarks.extractor saved_pages/ --parser xml --repeat 20
+
+With `--workers`, the pages are also parsed through the loader's process pool with each
+worker count, to measure how parsing scales with cores:
+
+    python -m backend.benchmarks.extractor --workers 1 2 4 8
+"""
+
+import argparse
+import time
+import warnings
+from pathlib import Path
+from typing import Callable, Optional
+
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+
+from backend.avma_sitemaploader import AVMASitemapLoader
+from backend.parser import avma_docs_extractor, avma_docs_extractor_lxml
+
+DEFAULT_PAGES = Path(__file__).parent.parent / "tests" / "data" / "avma_pages"
+
+
+def _read_pages(paths: list[Path]) -> list[str]:
+    pages = []
+    for path in paths:
+        files = sorted(path.glob("*.*ml")) if path.is_dir() else [path]
+        pages.extend(file.read_text() for file in files)
+    return pages
+
+
+def _pages_per_second(
+    extract: Callable[[str], str], pages: list[str], repeat: int
+) -> tuple[float, list[str]]:
+    outputs = [extract(page) for page in pages]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract(page)
+    return repeat * len(pages) / (time.perf_counter() - start), outputs
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="*", type=Path, default=[DEFAULT_PAGES])
+    parser.add_argument(
+        "--parser",
+        choices=["xml", "lxml"],
+        default="xml",
+        help="The BeautifulSoup parser the pages are parsed with. AVMA articles use 'xml'.",
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Parse worker process counts to measure the loader's parsing pool with.",
+    )
+    parser.add_argument("--chunksize", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    pages = _read_pages(args.paths)
+    if not pages:
+        parser.error("No pages found")
+
+    def bs4_extract(page: str) -> str:
+        return avma_docs_extractor(BeautifulSoup(page, args.parser))
+
+    def lxml_extract(page: str) -> str:
+        return avma_docs_extractor_lxml(page, args.parser)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", XMLParsedAsHTMLWarning)
+        bs4_rate, bs4_outputs = _pages_per_second(bs4_extract, pages, args.repeat)
+    lxml_rate, lxml_outputs = _pages_per_second(lxml_extract, pages, args.repeat)
+
+    mismatches = sum(a != b for a, b in zip(bs4_outputs, lxml_outputs))
+    size_kb = sum(len(page) for page in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {size_kb:.1f} KiB on average, parser={args.parser!r}")
+    print(f"{'BeautifulSoup':>14}: {bs4_rate:10.1f} pages/s")
+    print(f"{'lxml':>14}: {lxml_rate:10.1f} pages/s ({lxml_rate / bs4_rate:.1f}x)")
+    print(f"{'mismatches':>14}: {mismatches}")
+
+    if args.workers:
+        suffix = ".xml" if args.parser == "xml" else ".html"
+        items = [
+            ({"loc": f"https://avmajournals.avma.org/page-{i}{suffix}"}, page)
+            for i, page in enumerate(pages * args.repeat)
+        ]
+        print(f"Loader parsing pool, {len(items)} pages:")
+        baseline = None
+        for workers in args.workers:
+            loader = AVMASitemapLoader(
+                "https://avmajournals.avma.org/sitemap.xml",
+                markup_parsing_function=avma_docs_extractor_lxml,
+                default_parser="lxml",
+                parse_workers=workers,
+                parse_chunksize=args.chunksize,
+            )
+            try:
+                # Start the worker processes before timing.
+                list(loader.parse_pages(items[: workers * args.chunksize]))
+                start = time.perf_counter()
+                for _ in loader.parse_pages(items):
+                    pass
+                rate = len(items) / (time.perf_counter() - start)
+            finally:
+                loader.close()
+            baseline = baseline or rate
+            print(
+                f"{workers:>10} workers: {rate:10.1f} pages/s ({rate / baseline:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,618 @@
+"""Benchmark the latency our code and LangGraph add to a turn of the PetoPeta graph.
+
+The compiled graph runs offline: the chat models are fakes that answer every call with a
+scripted response after a configurable latency (time to first token plus output tokens
+at a configurable rate), the library and web retrievers are fakes with a configurable
+latency, and the pets live in an `InMemoryStore`. Everything that is not a fake provider
+call is our code or the framework, so the time left once the provider time is taken out
+of a node is the overhead of that node:
+
+    python -m backend.benchmarks.graph
+    python -m backend.benchmarks.graph --turns 200 --llm-latency-ms 0 --retriever-latency-ms 0
+
+Every router branch is measured separately. The report has, per branch:
+
+- the wall time, provider time and overhead of a turn (p50/p95/p99), and the framework
+  overhead, the part of a turn spent outside of any node;
+- the wall time and overhead of every node, subgraph nodes included (p50/p95/p99);
+- the memory allocated during a turn (peak and retained, measured with `tracemalloc` in
+  separate turns, since tracing slows everything down).
+
+Provider calls running in parallel are counted once: the provider time of a node is the
+union of the intervals of the fake calls it made.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator, Optional
+from unittest import mock
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable, RunnableLambda
+from langgraph.store.memory import InMemoryStore
+from pydantic import BaseModel
+
+from backend import retrieval
+from backend.model_pool import get_chat_model_pool
+from backend.retrieval_graph import graph as graph_module
+from backend.retrieval_graph.researcher_graph import graph as researcher_module
+
+# The question asked for every branch, and the route the fake router picks for it.
+BRANCHES = {
+    "general": ("general", "What is the best way to introduce two cats?"),
+    "more-info": ("more-info", "Is it bad?"),
+    "research": ("health", "Milo has been vomiting since yesterday, what should I do?"),
+}
+USER_ID = "benchmark-user"
+PET = {
+    "name": "Milo",
+    "species": "cat",
+    "breed": "siamese",
+    "gender": "male",
+    "age": 9,
+    "weight": 5,
+    "extra_condition": "",
+}
+
+
+@dataclass
+class Script:
+    """What the fake models answer, shared by every fake model of a run."""
+
+    route: str = "general"
+    turn: int = 0
+    plan_steps: int = 3
+    queries_per_step: int = 2
+    answer_tokens: int = 300
+
+    def structured(self, schema: Any) -> dict[str, Any]:
+        """Return the structured output of a call with the given schema."""
+        name = getattr(schema, "__name__", "")
+        if name == "Router":
+            return {"type": self.route, "logic": "Scripted by the benchmark."}
+        if name == "Plan":
+            return {"steps": [f"Research step {i}" for i in range(self.plan_steps)]}
+        if name == "Response":
+            # Distinct queries on every turn, so the search cache does not hide the web search.
+            return {
+                "queries": [
+                    f"query {i} of turn {self.turn}"
+                    for i in range(self.queries_per_step)
+                ]
+            }
+        if name == "PetList":
+            return {"pets": [PET]}
+        raise ValueError(f"The benchmark has no scripted output for {name!r}")
+
+    def text(self) -> str:
+        return " ".join(["word"] * self.answer_tokens)
+
+
+class FakeChatModel(BaseChatModel):
+    """A chat model answering from a script after a simulated provider latency.
+
+    A call takes `latency_seconds` plus the output tokens at `tokens_per_second`, and
+    structured outputs are parsed from the JSON the model "generates".
+    """
+
+    script: Script
+    latency_seconds: float = 0.0
+    tokens_per_second: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _respond(self, structured_output: Any) -> tuple[str, float]:
+        if structured_output is not None:
+            content = json.dumps(self.script.structured(structured_output))
+            # About 4 characters per token.
+            tokens = len(content) / 4
+        else:
+            content = self.script.text()
+            tokens = self.script.answer_tokens
+        delay = self.latency_seconds
+        if self.tokens_per_second:
+            delay += tokens / self.tokens_per_second
+        return content, delay
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        structured_output: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content, delay = self._respond(structured_output)
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        structured_output: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content, delay = self._respond(structured_output)
+        await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content))])
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        def parse(message: BaseMessage) -> Any:
+            value = json.loads(message.content)
+            if isinstance(schema, type) and issubclass(schema, BaseModel):
+                return schema.model_validate(value)
+            return value
+
+        def invoke(messages: Any) -> Any:
+            return parse(self.invoke(messages, structured_output=schema))
+
+        async def ainvoke(messages: Any) -> Any:
+            return parse(await self.ainvoke(messages, structured_output=schema))
+
+        return RunnableLambda(invoke, afunc=ainvoke, name="FakeStructuredOutput")
+
+
+class FakeRetriever(BaseRetriever):
+    """A retriever returning `k` deterministic documents after a simulated latency."""
+
+    source: str
+    k: int = 4
+    latency_seconds: float = 0.0
+    document_words: int = 150
+
+    def _documents(self, query: str) -> list[Document]:
+        digest = hashlib.sha1(query.encode()).hexdigest()[:12]
+        return [
+            Document(
+                page_content=f"{self.source} result {i} for {query}: "
+                + " ".join(
+                    # Random words, so that different results are not near-duplicates.
+                    f"word{n}"
+                    for n in random.Random(f"{digest}/{i}").choices(
+                        range(1000), k=self.document_words
+                    )
+                ),
+                metadata={
+                    "source": f"https://{self.source}.example/{digest}/{i}",
+                    "title": f"{self.source} {i}",
+                },
+            )
+            for i in range(self.k)
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: Any
+    ) -> list[Document]:
+        time.sleep(self.latency_seconds)
+        return self._documents(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: Any
+    ) -> list[Document]:
+        await asyncio.sleep(self.latency_seconds)
+        return self._documents(query)
+
+
+@dataclass
+class _Run:
+    name: str
+    parent: Optional[uuid.UUID]
+    start: float
+    end: Optional[float] = None
+    node: Optional[str] = None
+    """Name of the graph node, if the run is one."""
+    provider: bool = False
+
+
+class RunRecorder(BaseCallbackHandler):
+    """Record the start and end of the node runs and of the fake provider calls."""
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.runs: dict[uuid.UUID, _Run] = {}
+
+    def _start(
+        self, run_id: uuid.UUID, parent: Optional[uuid.UUID], **run: Any
+    ) -> None:
+        self.runs[run_id] = _Run(parent=parent, start=time.perf_counter(), **run)
+
+    def _end(self, run_id: uuid.UUID) -> None:
+        if run_id in self.runs:
+            self.runs[run_id].end = time.perf_counter()
+
+    def on_chain_start(
+        self,
+        serialized: Any,
+        inputs: Any,
+        *,
+        run_id: uuid.UUID,
+        parent_run_id: Optional[uuid.UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = kwargs.get("name") or ""
+        is_node = name == (metadata or {}).get("langgraph_node") and any(
+            tag.startswith("graph:step:") for tag in tags or []
+        )
+        self._start(run_id, parent_run_id, name=name, node=name if is_node else None)
+
+    def on_chat_model_start(
+        self,
+        serialized: Any,
+        messages: Any,
+        *,
+        run_id: uuid.UUID,
+        parent_run_id: Optional[uuid.UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start(run_id, parent_run_id, name="chat_model", provider=True)
+
+    def on_retriever_start(
+        self,
+        serialized: Any,
+        query: str,
+        *,
+        run_id: uuid.UUID,
+        parent_run_id: Optional[uuid.UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start(run_id, parent_run_id, name="retriever", provider=True)
+
+    def on_chain_end(self, outputs: Any, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+    def on_retriever_end(
+        self, documents: Any, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+    def _node_path(self, run_id: Optional[uuid.UUID]) -> tuple[str, ...]:
+        """Return the names of the node runs among a run and its ancestors, outermost first."""
+        path = []
+        while run_id is not None and run_id in self.runs:
+            run = self.runs[run_id]
+            if run.node is not None:
+                path.append(run.node)
+            run_id = run.parent
+        return tuple(reversed(path))
+
+    def breakdown(
+        self,
+    ) -> tuple[dict[str, list[tuple[float, float]]], float, float]:
+        """Break the recorded turn down by node.
+
+        Returns:
+            tuple: The (wall seconds, provider seconds) of every run of every node path
+                ("node/subgraph node"), the provider seconds of the turn, and the seconds
+                spent in top-level nodes.
+        """
+        provider: dict[uuid.UUID, list[tuple[float, float]]] = {}
+        all_provider = []
+        for run in self.runs.values():
+            if not run.provider or run.end is None:
+                continue
+            interval = (run.start, run.end)
+            all_provider.append(interval)
+            parent = run.parent
+            while parent is not None and parent in self.runs:
+                if self.runs[parent].node is not None:
+                    provider.setdefault(parent, []).append(interval)
+                parent = self.runs[parent].parent
+
+        nodes: dict[str, list[tuple[float, float]]] = {}
+        top_level = []
+        for run_id, run in self.runs.items():
+            if run.node is None or run.end is None:
+                continue
+            path = self._node_path(run_id)
+            wall = run.end - run.start
+            nodes.setdefault("/".join(path), []).append(
+                (wall, _union_seconds(provider.get(run_id, [])))
+            )
+            if len(path) == 1:
+                top_level.append((run.start, run.end))
+        return nodes, _union_seconds(all_provider), _union_seconds(top_level)
+
+
+def _union_seconds(intervals: list[tuple[float, float]]) -> float:
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+@contextmanager
+def fake_providers(
+    script: Script,
+    *,
+    llm_latency_seconds: float,
+    tokens_per_second: float,
+    retriever_latency_seconds: float,
+    documents_per_source: int,
+) -> Iterator[None]:
+    """Route the chat models and the retrievers of the graph to fakes."""
+    pool = get_chat_model_pool()
+    factory = pool.factory
+    pool.factory = lambda model, model_provider, **kwargs: FakeChatModel(
+        script=script,
+        latency_seconds=llm_latency_seconds,
+        tokens_per_second=tokens_per_second,
+    )
+    pool.clear()
+
+    library = FakeRetriever(
+        source="library",
+        k=documents_per_source,
+        latency_seconds=retriever_latency_seconds,
+    )
+    web = FakeRetriever(
+        source="web", k=documents_per_source, latency_seconds=retriever_latency_seconds
+    )
+
+    @asynccontextmanager
+    async def amake_retriever(config: Any) -> AsyncIterator[BaseRetriever]:
+        yield library
+
+    try:
+        with (
+            mock.patch.object(retrieval, "amake_retriever", amake_retriever),
+            mock.patch.object(researcher_module, "_web_retriever", web),
+        ):
+            yield
+    finally:
+        pool.factory = factory
+        pool.clear()
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def _ms(values: list[float]) -> dict[str, float]:
+    return {key: value * 1000 for key, value in _percentiles(values).items()}
+
+
+async def run_branch(
+    compiled: Any,
+    script: Script,
+    branch: str,
+    turns: int,
+    warmup: int,
+    alloc_turns: int,
+    configurable: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """Run the turns of a branch and return its latency and allocation statistics."""
+    route, question = BRANCHES[branch]
+    script.route = route
+
+    async def turn(callbacks: list[Any]) -> None:
+        script.turn += 1
+        await compiled.ainvoke(
+            {"messages": [HumanMessage(question)]},
+            {
+                "callbacks": callbacks,
+                "metadata": {"user_id": USER_ID},
+                "configurable": {
+                    "thread_id": str(uuid.uuid4()),
+                    **(configurable or {}),
+                },
+            },
+        )
+
+    for _ in range(warmup):
+        await turn([])
+
+    walls, providers, overheads, frameworks = [], [], [], []
+    nodes: dict[str, list[tuple[float, float]]] = {}
+    for _ in range(turns):
+        recorder = RunRecorder()
+        start = time.perf_counter()
+        await turn([recorder])
+        wall = time.perf_counter() - start
+        turn_nodes, provider, in_nodes = recorder.breakdown()
+        walls.append(wall)
+        providers.append(provider)
+        overheads.append(wall - provider)
+        frameworks.append(wall - in_nodes)
+        for path, samples in turn_nodes.items():
+            nodes.setdefault(path, []).extend(samples)
+
+    peaks, retained = [], []
+    for _ in range(alloc_turns):
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            await turn([])
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peaks.append(peak - baseline)
+        retained.append(current - baseline)
+
+    return {
+        "turns": turns,
+        "wall_ms": _ms(walls),
+        "provider_ms": _ms(providers),
+        "overhead_ms": _ms(overheads),
+        "framework_overhead_ms": _ms(frameworks),
+        "allocated_peak_kib": statistics.median(peaks) / 1024 if peaks else None,
+        "allocated_retained_kib": statistics.median(retained) / 1024
+        if retained
+        else None,
+        "nodes": {
+            path: {
+                "calls_per_turn": len(samples) / turns,
+                "wall_ms": _ms([wall for wall, _ in samples]),
+                "overhead_ms": _ms([wall - provider for wall, provider in samples]),
+            }
+            for path, samples in nodes.items()
+        },
+    }
+
+
+def _print_branch(branch: str, result: dict[str, Any]) -> None:
+    def row(values: dict[str, float]) -> str:
+        return " ".join(f"{values[p]:8.2f}" for p in ("p50", "p95", "p99"))
+
+    header = f"{branch}: {result['turns']} turns"
+    print(f"\n{header:<62}p50      p95      p99 (ms)")
+    for label, key in (
+        ("turn wall", "wall_ms"),
+        ("provider", "provider_ms"),
+        ("overhead", "overhead_ms"),
+        ("framework", "framework_overhead_ms"),
+    ):
+        print(f"  {label:<52} {row(result[key])}")
+    if result["allocated_peak_kib"] is not None:
+        print(
+            f"  allocations: {result['allocated_peak_kib']:.0f} KiB peak, "
+            f"{result['allocated_retained_kib']:.0f} KiB retained per turn"
+        )
+    print("  node overhead (calls/turn)")
+    for path, node in result["nodes"].items():
+        label = f"{path} ({node['calls_per_turn']:g})"
+        print(f"    {label:<50} {row(node['overhead_ms'])}")
+
+
+async def _run(args: argparse.Namespace) -> dict[str, Any]:
+    script = Script(
+        plan_steps=args.plan_steps,
+        queries_per_step=args.queries_per_step,
+        answer_tokens=args.answer_tokens,
+    )
+    store = InMemoryStore()
+    await store.aput(("pets", USER_ID), f"pet_{PET['name']}", PET)
+    compiled = graph_module.builder.compile(store=store)
+
+    results = {}
+    with fake_providers(
+        script,
+        llm_latency_seconds=args.llm_latency_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        retriever_latency_seconds=args.retriever_latency_ms / 1000,
+        documents_per_source=args.documents_per_source,
+    ):
+        for branch in args.branches:
+            results[branch] = await run_branch(
+                compiled,
+                script,
+                branch,
+                args.turns,
+                args.warmup,
+                args.alloc_turns,
+                dict(args.set),
+            )
+    return results
+
+
+def _configuration_value(text: str) -> tuple[str, Any]:
+    name, _, value = text.partition("=")
+    try:
+        return name, json.loads(value)
+    except json.JSONDecodeError:
+        return name, value
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--branches", nargs="+", choices=list(BRANCHES), default=list(BRANCHES)
+    )
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument(
+        "--alloc-turns",
+        type=int,
+        default=3,
+        help="Turns run with tracemalloc to measure allocations, 0 to skip.",
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0.0,
+        help="Output token rate of the fake models, 0 for instant generation.",
+    )
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--retriever-latency-ms", type=float, default=10.0)
+    parser.add_argument("--documents-per-source", type=int, default=4)
+    parser.add_argument("--plan-steps", type=int, default=3)
+    parser.add_argument("--queries-per-step", type=int, default=2)
+    parser.add_argument(
+        "--set",
+        type=_configuration_value,
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="Set a field of the agent configuration, the value is parsed as JSON if it can be. "
+        "For example --set speculative_pet_resolution=true.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as JSON."
+    )
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(_run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"Fake providers: LLM {args.llm_latency_ms:g} ms + "
+        f"{args.tokens_per_second:g} tokens/s, retrievers {args.retriever_latency_ms:g} ms"
+    )
+    for branch, result in results.items():
+        _print_branch(branch, result)
+
+
+if __name__ == "__main__":
+    main()
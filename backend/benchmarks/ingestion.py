@@ -0,0 +1,505 @@
+"""Benchmark the ingestion pipeline end to end, without the network, OpenAI or Postgres.
+
+A local HTTP server stands in for avmajournals.avma.org: it serves a nested sitemap index
+(root index -> child indexes -> urlsets with `lastmod`) and AVMA-shaped article pages,
+generated deterministically from their number. The real `AVMASitemapLoader`, parser and
+text splitter run against it through `build_ingestion_pipeline`, with a stub embedder
+and a vector sink that discards what it is given, and a throwaway ingestion ledger:
+
+    python -m backend.benchmarks.ingestion
+    python -m backend.benchmarks.ingestion --pages 5000 --parse-workers 4 --json
+
+The pipeline settings are read from the `INGEST_<FIELD NAME>` environment variables like
+for a real ingestion, the options below take precedence. With `--rerun`, the ingestion
+runs a second time against the same ledger to measure an incremental no-op refresh.
+
+The report has the sitemap crawl time, pages/s, chunks/s, the time every stage was busy,
+and the peak RSS of the benchmark process and of its parsing worker processes (the
+largest one, once they exited).
+"""
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import logging
+import multiprocessing
+import random
+import re
+import resource
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from backend.ingest import (
+    IngestionSettings,
+    build_ingestion_pipeline,
+    make_avma_loader,
+    make_text_splitter,
+)
+from backend.ingest_ledger import IngestionLedger, IngestionReport
+
+_WORDS = [
+    "cat",
+    "dog",
+    "horse",
+    "cattle",
+    "feline",
+    "canine",
+    "renal",
+    "hepatic",
+    "cardiac",
+    "dose",
+    "mg/kg",
+    "daily",
+    "treatment",
+    "diagnosis",
+    "prognosis",
+    "clinical",
+    "signs",
+    "serum",
+    "creatinine",
+    "urine",
+    "protein",
+    "weight",
+    "loss",
+    "vomiting",
+    "inappetence",
+    "therapy",
+    "trial",
+    "cohort",
+    "study",
+    "owners",
+    "patients",
+    "chronic",
+    "acute",
+    "disease",
+    "infection",
+    "vaccine",
+    "outcome",
+    "survival",
+    "analysis",
+    "results",
+]
+_LASTMOD = "2025-01-01T00:00:00Z"
+
+
+@dataclasses.dataclass(frozen=True)
+class SyntheticSite:
+    """The shape of the synthetic AVMA site.
+
+    Args:
+        pages (int): Number of article pages.
+        pages_per_sitemap (int): Number of URLs in each urlset.
+        sitemaps_per_index (int): Number of urlsets in each child sitemap index.
+        sections (int): Number of sections of an article page, which sets the page size.
+        seed (int): Seed of the generated page content.
+    """
+
+    pages: int = 2000
+    pages_per_sitemap: int = 200
+    sitemaps_per_index: int = 5
+    sections: int = 12
+    seed: int = 0
+
+    @property
+    def urlsets(self) -> int:
+        return -(-self.pages // self.pages_per_sitemap)
+
+    @property
+    def indexes(self) -> int:
+        return -(-self.urlsets // self.sitemaps_per_index)
+
+    def render(self, path: str, base_url: str) -> Optional[str]:
+        """Return the document served at `path`, None if there is none."""
+        name = path.rsplit("/", 1)[-1].removesuffix(".xml")
+        if path == "/sitemap.xml":
+            return _sitemap_index(
+                f"{base_url}/sitemaps/index-{i}.xml" for i in range(self.indexes)
+            )
+        if path.startswith("/sitemaps/index-"):
+            index = int(name.removeprefix("index-"))
+            first = index * self.sitemaps_per_index
+            last = min(first + self.sitemaps_per_index, self.urlsets)
+            return _sitemap_index(
+                f"{base_url}/sitemaps/urls-{i}.xml" for i in range(first, last)
+            )
+        if path.startswith("/sitemaps/urls-"):
+            urlset = int(name.removeprefix("urls-"))
+            first = urlset * self.pages_per_sitemap
+            last = min(first + self.pages_per_sitemap, self.pages)
+            return _urlset(
+                f"{base_url}/view/journals/javma/article-{i}.xml"
+                for i in range(first, last)
+            )
+        if path.startswith("/view/journals/javma/article-"):
+            page = int(name.removeprefix("article-"))
+            if page < self.pages:
+                return self.article(page)
+        return None
+
+    def article(self, page: int) -> str:
+        """Return an XHTML article page shaped like the AVMA journal ones."""
+        rng = random.Random(f"{self.seed}-{page}")
+
+        def sentence() -> str:
+            words = rng.choices(_WORDS, k=rng.randint(8, 20))
+            return " ".join(words).capitalize() + "."
+
+        title = f"Article {page}: {sentence()[:-1]}"
+        body = [f"<h1>{title}</h1>"]
+        for section in range(self.sections):
+            body.append(f"<h2>Section {section}</h2>")
+            for _ in range(rng.randint(2, 4)):
+                body.append(
+                    f"<p>{sentence()} <strong>{rng.choice(_WORDS)}</strong> "
+                    f'<a href="/view/{rng.randint(0, 999)}.xml">{sentence()}</a> '
+                    f"{' '.join(sentence() for _ in range(rng.randint(2, 6)))}</p>"
+                )
+            kind = rng.random()
+            if kind < 0.3:
+                items = "".join(
+                    f"<li>{sentence()}</li>" for _ in range(rng.randint(2, 6))
+                )
+                body.append(f"<ul>{items}</ul>")
+            elif kind < 0.5:
+                rows = "".join(
+                    f"<tr><td>{rng.choice(_WORDS)}</td><td>{rng.randint(1, 99)}</td></tr>"
+                    for _ in range(rng.randint(2, 6))
+                )
+                body.append(
+                    f"<table><thead><tr><th>Group</th><th>n</th></tr></thead>"
+                    f"<tbody>{rows}</tbody></table>"
+                )
+            elif kind < 0.6:
+                body.append(
+                    '<pre><code class="language-python">'
+                    f"dose = weight_kg * {rng.randint(1, 20)}\nprint(dose)</code></pre>"
+                )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" lang="en">\n'
+            f"<head><title>{title} | JAVMA</title>"
+            '<script type="text/javascript">window.dataLayer = [];</script>'
+            "<style>.content-box { margin: 0; }</style></head>\n"
+            '<body><nav class="site-nav"><ul><li><a href="/">Home</a></li>'
+            '<li><a href="/view/journals/javma/javma-overview.xml">JAVMA</a></li></ul></nav>'
+            '<div class="container"><aside class="sidebar">Related articles</aside>'
+            f'<div class="content-box article-body">{"".join(body)}</div></div>'
+            "<footer>American Veterinary Medical Association</footer></body></html>"
+        )
+
+
+def _sitemap_index(locs: Any) -> str:
+    sitemaps = "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locs)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f"{sitemaps}</sitemapindex>"
+    )
+
+
+def _urlset(locs: Any) -> str:
+    urls = "".join(
+        f"<url><loc>{loc}</loc><lastmod>{_LASTMOD}</lastmod></url>" for loc in locs
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f"{urls}</urlset>"
+    )
+
+
+def _serve(site: SyntheticSite, port_sender: Any) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            body = site.render(self.path, base_url)
+            if body is None:
+                self.send_error(404)
+                return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    port_sender.send(base_url)
+    server.serve_forever()
+
+
+class SiteServer:
+    """Serve a synthetic site from a separate process, so it does not compete for the GIL.
+
+    Use as a context manager, `base_url` is set on entry.
+    """
+
+    def __init__(self, site: SyntheticSite):
+        self.site = site
+        self.base_url = ""
+        self._process: Optional[multiprocessing.Process] = None
+
+    def __enter__(self) -> Self:
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_serve, args=(self.site, sender), daemon=True
+        )
+        self._process.start()
+        self.base_url = receiver.recv()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic embeddings derived from the text hash, with an optional per-call latency.
+
+    Args:
+        dimensions (int): Size of the vectors.
+        latency_seconds (float): Time every call sleeps for, to stand in for the provider.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency_seconds: float = 0.0):
+        self.dimensions = dimensions
+        self.latency_seconds = latency_seconds
+
+    def _embed(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).random(self.dimensions, np.float32).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class NullVectorSink:
+    """Stands in for the vector store: counts what is written and deleted, keeps nothing."""
+
+    def __init__(self) -> None:
+        self.written = 0
+        self.deleted = 0
+
+    def add_embeddings(
+        self,
+        texts: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict],
+        ids: list[str],
+    ) -> list[str]:
+        self.written += len(texts)
+        return ids
+
+    def delete(self, ids: list[str]) -> None:
+        self.deleted += len(ids)
+
+
+def _peak_rss_mib(who: int) -> float:
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_ingestion(
+    base_url: str,
+    settings: IngestionSettings,
+    ledger: IngestionLedger,
+    embedding: Embeddings,
+) -> dict[str, Any]:
+    """Crawl the sitemap at `base_url` and ingest its pages, returning the measurements."""
+    loader = make_avma_loader(
+        f"{base_url}/sitemap.xml",
+        filter_urls=[rf"^{re.escape(base_url)}/view/.*\.xml$"],
+        parse_workers=settings.parse_workers,
+        parse_chunksize=settings.parse_chunksize,
+    )
+    sink = NullVectorSink()
+    report = IngestionReport()
+    try:
+        start = time.perf_counter()
+        entries = loader.load_sitemap_entries()
+        crawl_seconds = time.perf_counter() - start
+
+        pipeline = build_ingestion_pipeline(
+            loader,
+            make_text_splitter(),
+            embedding,
+            sink,
+            settings,
+            ledger,
+            report,
+            entries=entries,
+        )
+        start = time.perf_counter()
+        stats = pipeline.run()
+        seconds = time.perf_counter() - start
+    finally:
+        loader.close()
+
+    pages = stats["parse"].items_out
+    chunks = sink.written
+    return {
+        "sitemap_entries": len(entries),
+        "crawl_seconds": crawl_seconds,
+        "pipeline_seconds": seconds,
+        "pages": pages,
+        "chunks": chunks,
+        "pages_per_second": pages / seconds,
+        "chunks_per_second": chunks / seconds,
+        "chunks_report": {
+            "added": report.added,
+            "updated": report.updated,
+            "skipped": report.skipped,
+            "deleted": report.deleted,
+        },
+        "stages": {
+            name: {
+                "items_in": stage.items_in,
+                "items_out": stage.items_out,
+                "busy_seconds": stage.busy_seconds,
+            }
+            for name, stage in stats.items()
+        },
+        "peak_rss_mib": _peak_rss_mib(resource.RUSAGE_SELF),
+        "peak_children_rss_mib": _peak_rss_mib(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _print_run(label: str, result: dict[str, Any]) -> None:
+    print(
+        f"{label}: {result['sitemap_entries']} sitemap entries crawled in "
+        f"{result['crawl_seconds']:.2f}s, pipeline {result['pipeline_seconds']:.2f}s"
+    )
+    print(
+        f"  {result['pages']} pages ({result['pages_per_second']:.1f}/s), "
+        f"{result['chunks']} chunks written ({result['chunks_per_second']:.1f}/s), "
+        + ", ".join(f"{key} {value}" for key, value in result["chunks_report"].items())
+    )
+    for name, stage in result["stages"].items():
+        print(
+            f"  {name:>6}: {stage['items_in']:>7} in {stage['items_out']:>7} out, "
+            f"busy {stage['busy_seconds']:8.2f}s"
+        )
+    print(
+        f"  peak RSS {result['peak_rss_mib']:.0f} MiB, "
+        f"worker processes {result['peak_children_rss_mib']:.0f} MiB"
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=SyntheticSite.pages)
+    parser.add_argument(
+        "--pages-per-sitemap", type=int, default=SyntheticSite.pages_per_sitemap
+    )
+    parser.add_argument(
+        "--sitemaps-per-index", type=int, default=SyntheticSite.sitemaps_per_index
+    )
+    parser.add_argument(
+        "--sections",
+        type=int,
+        default=SyntheticSite.sections,
+        help="Sections per article, about 2 KiB of markup each.",
+    )
+    parser.add_argument("--seed", type=int, default=SyntheticSite.seed)
+    parser.add_argument("--fetch-workers", type=int)
+    parser.add_argument("--parse-workers", type=int)
+    parser.add_argument("--parse-chunksize", type=int)
+    parser.add_argument("--embed-batch-size", type=int)
+    parser.add_argument(
+        "--embed-latency-ms",
+        type=float,
+        default=0.0,
+        help="Latency of every stub embedding call.",
+    )
+    parser.add_argument(
+        "--rerun",
+        action="store_true",
+        help="Ingest a second time against the same ledger.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as JSON."
+    )
+    args = parser.parse_args(argv)
+
+    overrides = {
+        name: value
+        for name in (
+            "fetch_workers",
+            "parse_workers",
+            "parse_chunksize",
+            "embed_batch_size",
+        )
+        if (value := getattr(args, name)) is not None
+    }
+    settings = dataclasses.replace(
+        IngestionSettings.from_env(), progress_interval_seconds=0, **overrides
+    )
+    site = SyntheticSite(
+        pages=args.pages,
+        pages_per_sitemap=args.pages_per_sitemap,
+        sitemaps_per_index=args.sitemaps_per_index,
+        sections=args.sections,
+        seed=args.seed,
+    )
+    embedding = StubEmbeddings(latency_seconds=args.embed_latency_ms / 1000)
+    logging.getLogger("backend.ingest_pipeline").setLevel(logging.WARNING)
+
+    results: dict[str, Any] = {
+        "site": dataclasses.asdict(site),
+        # The benchmark uses a throwaway ledger instead of settings.ledger_url.
+        "settings": {
+            key: value
+            for key, value in dataclasses.asdict(settings).items()
+            if key != "ledger_url"
+        },
+    }
+    with SiteServer(site) as server, tempfile.TemporaryDirectory() as tmp:
+        ledger = IngestionLedger(str(Path(tmp) / "ledger.sqlite3"), "benchmark")
+        results["first_run"] = run_ingestion(
+            server.base_url, settings, ledger, embedding
+        )
+        if args.rerun:
+            results["rerun"] = run_ingestion(
+                server.base_url, settings, ledger, embedding
+            )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"{site.pages} pages of {site.sections} sections, "
+        f"{site.indexes} child indexes of {site.sitemaps_per_index} urlsets, "
+        f"settings: "
+        + ", ".join(
+            f"{key}={value}"
+            for key, value in results["settings"].items()
+            if key != "progress_interval_seconds"
+        )
+    )
+    _print_run("First run", results["first_run"])
+    if args.rerun:
+        _print_run("Rerun", results["rerun"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,249 @@
+"""Embedding models, behind a persistent content-addressed cache.
+
+The same chunk text is embedded again on every re-ingestion and the same user
+queries are embedded again on every retrieval. `CachedEmbeddings` wraps an
+embedding model and keeps the vectors keyed by model name, dimensions and the
+SHA-256 of the text, in an in-memory LRU tier and a SQLite tier on disk. Batch
+calls only send the cache misses to the provider.
+
+The cache is configured with environment variables:
+
+- `EMBEDDING_CACHE_PATH`: path of the SQLite tier, empty to keep vectors in memory only.
+  Defaults to `embedding_cache.sqlite3` in the data directory (see `backend.utils.data_path`).
+- `EMBEDDING_CACHE_SIZE`: maximum number of vectors kept in memory.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
 from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 
+from backend.metrics import register_stats
+from backend.utils import data_path
+
+DEFAULT_CACHE_FILENAME = "embedding_cache.sqlite3"
+DEFAULT_CACHE_SIZE = 10_000
+
+# SQLite limits the number of host parameters of a statement.
+_SQLITE_BATCH = 500
+
+
+class EmbeddingCache:
+    """Two-tier store of embedding vectors, shared by all the cached models of a process.
+
+    Args:
+        disk_path (Optional[str]): Path of the SQLite tier, None to keep vectors in memory only.
+        max_memory_entries (int): Maximum number of vectors kept in memory.
+    """
+
+    def __init__(
+        self,
+        disk_path: Optional[str] = None,
+        max_memory_entries: int = DEFAULT_CACHE_SIZE,
+    ):
+        if max_memory_entries < 1:
+            raise ValueError("Embedding cache max_memory_entries should be at least 1")
+
+        self.max_memory_entries = max_memory_entries
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """Return the cached vectors of the keys found in either tier."""
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.hits += len(found)
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if self._conn is not None and missing:
+                on_disk = 0
+                for i in range(0, len(missing), _SQLITE_BATCH):
+                    batch = missing[i : i + _SQLITE_BATCH]
+                    rows = self._conn.execute(
+                        "SELECT key, vector FROM embeddings WHERE key IN "
+                        f"({', '.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._store_in_memory(key, vector)
+                        on_disk += 1
+                self.disk_hits += on_disk
+            self.misses += len(missing) - sum(key in found for key in missing)
+        return found
+
+    def put_many(self, vectors: dict[str, np.ndarray]) -> None:
+        """Store vectors in both tiers."""
+        with self._lock:
+            for key, vector in vectors.items():
+                self._store_in_memory(key, vector)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                        [(key, vector.tobytes()) for key, vector in vectors.items()],
+                    )
+
+    def _store_in_memory(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        """Return the hit/miss counters of the texts looked up and the hit rate."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self._memory),
+        }
+
+
+_caches: dict[tuple[str, int], EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(
+    disk_path: Optional[str] = None, max_memory_entries: Optional[int] = None
+) -> EmbeddingCache:
+    """Return the process-wide embedding cache, configured from the environment by default."""
+    if disk_path is None:
+        disk_path = os.environ.get("EMBEDDING_CACHE_PATH")
+        if disk_path is None:
+            disk_path = data_path(DEFAULT_CACHE_FILENAME)
+    if max_memory_entries is None:
+        max_memory_entries = int(
+            os.environ.get("EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+        )
+    key = (disk_path, max_memory_entries)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(disk_path or None, max_memory_entries)
+            register_stats(
+                "embedding_cache",
+                _caches[key].stats,
+                {"path": disk_path, "max_entries": str(max_memory_entries)},
+            )
+        return _caches[key]
+
+
+class CachedEmbeddings(Embeddings):
+    """An embedding model whose vectors are cached by model, dimensions and text hash.
+
+    Document and query embeddings are cached separately, since some models embed them
+    differently.
+
+    Args:
+        underlying (Embeddings): The model computing the vectors on a cache miss.
+        model_name (str): Name of the model, part of the cache key.
+        cache (Optional[EmbeddingCache]): Where the vectors are kept. Defaults to the
+            process-wide cache.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache or get_embedding_cache()
+        dimensions = getattr(underlying, "dimensions", None)
+        self._namespace = f"{model_name}|{dimensions or 'default'}"
+
+    def _key(self, kind: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return f"{self._namespace}|{kind}|{digest}"
+
+    def _plan(
+        self, kind: str, texts: list[str]
+    ) -> tuple[list[str], dict[str, np.ndarray], list[str]]:
+        keys = [self._key(kind, text) for text in texts]
+        found = self.cache.get_many(keys)
+        # Identical texts of a batch are only embedded once.
+        misses = list(
+            dict.fromkeys(text for key, text in zip(keys, texts) if key not in found)
+        )
+        return keys, found, misses
+
+    def _complete(
+        self,
+        kind: str,
+        keys: list[str],
+        found: dict[str, np.ndarray],
+        misses: list[str],
+        vectors: list[list[float]],
+    ) -> list[list[float]]:
+        computed = {
+            self._key(kind, text): np.asarray(vector, dtype=np.float32)
+            for text, vector in zip(misses, vectors)
+        }
+        if computed:
+            self.cache.put_many(computed)
+            found = {**found, **computed}
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, misses = self._plan("document", texts)
+        vectors = self.underlying.embed_documents(misses) if misses else []
+        return self._complete("document", keys, found, misses, vectors)
+
+    def embed_query(self, text: str) -> list[float]:
+        keys, found, misses = self._plan("query", [text])
+        vectors = [self.underlying.embed_query(text)] if misses else []
+        return self._complete("query", keys, found, misses, vectors)[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, misses = await asyncio.to_thread(self._plan, "document", texts)
+        vectors = await self.underlying.aembed_documents(misses) if misses else []
+        return await asyncio.to_thread(
+            self._complete, "document", keys, found, misses, vectors
+        )
+
+    async def aembed_query(self, text: str) -> list[float]:
+        keys, found, misses = await asyncio.to_thread(self._plan, "query", [text])
+        vectors = [await self.underlying.aembed_query(text)] if misses else []
+        return (
+            await asyncio.to_thread(
+                self._complete, "query", keys, found, misses, vectors
+            )
+        )[0]
+
+    def stats(self) -> dict[str, float]:
+        """Return the statistics of the underlying cache."""
+        return self.cache.stats()
+
 
 def get_embeddings_model() -> Embeddings:
-    return OpenAIEmbeddings(model="text-embedding-3-small")
+    return CachedEmbeddings(
+        OpenAIEmbeddings(model="text-embedding-3-small"),
+        model_name="openai/text-embedding-3-small",
+    )
@@ -1,16 +1,31 @@
-"""Load html from files, clean up, split, ingest into Weaviate."""
+"""Load html from the AVMA sitemap, clean up, split, ingest into Postgres.
+
+The pages stream through a fetch -> parse -> split -> embed -> write pipeline with
+bounded queues between the stages, so memory does not grow with the corpus.
+
+Ingestion is incremental: an ingestion ledger (see `backend.ingest_ledger`) records what
+was written, so pages whose sitemap `lastmod` did not change are not fetched again, only
+changed chunks are re-embedded, and the vectors of vanished chunks are deleted.
+"""
 
 import logging
 import os
+from dataclasses import dataclass, fields
+from typing import Iterable, Iterator, Optional
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
 from langchain_postgres import PGVectorStore, PGEngine
 from langchain_postgres.v2.indexes import IVFFlatIndex, HNSWIndex
 
 from backend.avma_sitemaploader import AVMASitemapLoader
 
 from backend.embeddings import get_embeddings_model
-from backend.parser import avma_docs_extractor
+from backend.ingest_ledger import IngestionLedger, IngestionReport, PendingChunk
+from backend.ingest_pipeline import Pipeline, Stage
+from backend.parser import avma_docs_extractor, avma_docs_extractor_lxml
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,11 +52,20 @@ logger = logging.getLogger(__name__)
 #     }
 
 
-def load_avma_docs():
+AVMA_SITEMAP_URL = "https://avmajournals.avma.org/sitemap.xml"
+AVMA_URL_FILTERS = (r"^https?://[^/]*\.avma\.org/.*\.xml$",)
+
+
+def make_avma_loader(
+    sitemap_url: str = AVMA_SITEMAP_URL,
+    filter_urls: Iterable[str] = AVMA_URL_FILTERS,
+    **kwargs,
+) -> AVMASitemapLoader:
     return AVMASitemapLoader(
-        "https://avmajournals.avma.org/sitemap.xml",
-        filter_urls=[r"^https?://[^/]*\.avma\.org/.*\.xml$"],
+        sitemap_url,
+        filter_urls=list(filter_urls),
         parsing_function=avma_docs_extractor,
+        markup_parsing_function=avma_docs_extractor_lxml,
         default_parser="lxml",
         # bs_kwargs={
         #     "parse_only": SoupStrainer(
@@ -49,11 +73,185 @@ def load_avma_docs():
         #     ),
         # },
         # meta_function=metadata_extractor,
-    ).load()
+        **kwargs,
+    )
+
+
+def load_avma_docs():
+    return make_avma_loader().load()
+
+
+def make_text_splitter() -> TextSplitter:
+    return RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
+
+
+@dataclass(kw_only=True)
+class IngestionSettings:
+    """Parallelism and buffering of the ingestion pipeline stages.
+
+    Every field can be overridden with an `INGEST_<FIELD NAME>` environment variable,
+    e.g. `INGEST_FETCH_WORKERS=16`.
+    """
+
+    fetch_workers: int = 8
+    parse_workers: int = os.cpu_count() or 1
+    """Number of processes parsing pages."""
+    parse_chunksize: int = 8
+    """Number of pages sent to a parsing process at once."""
+    split_workers: int = 1
+    embed_workers: int = 2
+    write_workers: int = 1
+    embed_batch_size: int = 256
+    queue_size: int = 64
+    """Maximum number of pages, documents or chunks waiting in front of a stage. The
+    embedded batches waiting to be written count as `embed_batch_size` chunks each."""
+    progress_interval_seconds: float = 10.0
+    ledger_url: str = ""
+    """SQLAlchemy URL, or SQLite file path, of the ingestion ledger database. The vector
+    database (`VECTOR_DB_URL`) if empty, so the ledger lives as long as the vectors."""
+
+    @classmethod
+    def from_env(cls) -> "IngestionSettings":
+        overrides = {}
+        for f in fields(cls):
+            value = os.environ.get(f"INGEST_{f.name.upper()}")
+            if value is not None:
+                overrides[f.name] = type(f.default)(value)
+        return cls(**overrides)
+
+
+def build_ingestion_pipeline(
+    loader: AVMASitemapLoader,
+    text_splitter: TextSplitter,
+    embedding: Embeddings,
+    vectorstore: VectorStore,
+    settings: IngestionSettings,
+    ledger: IngestionLedger,
+    report: IngestionReport,
+    entries: Optional[list[dict]] = None,
+) -> Pipeline:
+    """Build the fetch -> parse -> split -> embed -> write pipeline for a sitemap.
+
+    Only the pages and chunks that changed since they were recorded in the ledger are
+    fetched, embedded and written. The chunk counters are kept in `report`.
+    """
+
+    def fetch(el: dict) -> Iterator[tuple[dict, str]]:
+        url = el["loc"].strip()
+        unchanged = ledger.unchanged_chunks(url, el.get("lastmod"))
+        if unchanged is not None:
+            report.record(skipped=unchanged)
+            return
+        html = loader.fetch_page(url)
+        if html:
+            yield el, html
+
+    def parse(pages: list[tuple[dict, str]]) -> Iterator[Document]:
+        # Parsing is CPU-bound: with parse_workers > 1 the loader runs it in worker
+        # processes, and the stage threads only wait for their chunk.
+        yield from loader.parse_pages(pages)
+
+    def split(doc: Document) -> Iterator[PendingChunk]:
+        chunks = []
+        for chunk in text_splitter.split_documents([doc]):
+            if len(chunk.page_content) <= 10:
+                continue
+            # We try to return 'source' and 'title' metadata when querying vector store and
+            # Weaviate will error at query time if one of the attributes is missing from a
+            # retrieved document.
+            chunk.metadata.setdefault("source", "")
+            chunk.metadata.setdefault("title", "")
+            chunks.append(chunk)
+
+        url = doc.metadata["loc"].strip()
+        page, pending, vanished = ledger.plan_page(
+            url, doc.metadata.get("lastmod"), chunks, report
+        )
+        if vanished:
+            vectorstore.delete(vanished)
+            ledger.forget_chunks(url, vanished)
+            report.record(deleted=len(vanished))
+        if not pending:
+            ledger.record_page(page)
+        yield from pending
+
+    def embed(
+        chunks: list[PendingChunk],
+    ) -> Iterator[tuple[list[PendingChunk], list]]:
+        vectors = embedding.embed_documents(
+            [chunk.document.page_content for chunk in chunks]
+        )
+        yield chunks, vectors
+
+    def write(batch: tuple[list[PendingChunk], list]) -> Iterator[int]:
+        chunks, vectors = batch
+        vectorstore.add_embeddings(
+            texts=[chunk.document.page_content for chunk in chunks],
+            embeddings=vectors,
+            metadatas=[chunk.document.metadata for chunk in chunks],
+            ids=[chunk.vector_id for chunk in chunks],
+        )
+        ledger.record_chunks(chunks)
+        for chunk in chunks:
+            if chunk.page.chunk_written():
+                ledger.record_page(chunk.page)
+        yield len(chunks)
+
+    return Pipeline(
+        entries if entries is not None else loader.load_sitemap_entries(),
+        [
+            Stage("fetch", fetch, workers=settings.fetch_workers),
+            Stage(
+                "parse",
+                parse,
+                workers=settings.parse_workers,
+                batch_size=settings.parse_chunksize,
+            ),
+            Stage("split", split, workers=settings.split_workers),
+            Stage(
+                "embed",
+                embed,
+                workers=settings.embed_workers,
+                batch_size=settings.embed_batch_size,
+            ),
+            Stage(
+                "write",
+                write,
+                workers=settings.write_workers,
+                queue_size=max(1, settings.queue_size // settings.embed_batch_size),
+            ),
+        ],
+        queue_size=settings.queue_size,
+        progress_interval_seconds=settings.progress_interval_seconds,
+    )
+
+
+def delete_vanished_pages(
+    loader: AVMASitemapLoader,
+    entries: list[dict],
+    vectorstore: VectorStore,
+    ledger: IngestionLedger,
+    report: IngestionReport,
+) -> None:
+    """Delete the vectors of the recorded pages that left the sitemap.
+
+    Pages that left the sitemap can only be told apart from the ones outside the
+    selected block when the whole sitemap was loaded, so nothing is deleted when the
+    loader has a blocksize.
+    """
+    if loader.blocksize is not None:
+        return
+    for url, vector_ids in ledger.vanished_pages(
+        el["loc"].strip() for el in entries
+    ).items():
+        if vector_ids:
+            vectorstore.delete(vector_ids)
+        ledger.forget_page(url)
+        report.record(deleted=len(vector_ids))
 
 
 def ingest_docs():
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
+    text_splitter = make_text_splitter()
     embedding = get_embeddings_model()
     embedding_dimensions = 1536
     index_name = "petopeta-hnsw-index"
@@ -69,31 +267,36 @@ def ingest_docs():
     )
     # vectorstore.apply_vector_index(HNSWIndex(name=index_name))
 
-    docs_from_documentation = load_avma_docs()
-    logger.info(f"Loaded {len(docs_from_documentation)} docs from documentation")
-
-    docs_transformed = text_splitter.split_documents(docs_from_documentation)
-    docs_transformed = [doc for doc in docs_transformed if len(doc.page_content) > 10]
-
-    # We try to return 'source' and 'title' metadata when querying vector store and
-    # Weaviate will error at query time if one of the attributes is missing from a
-    # retrieved document.
-    for doc in docs_transformed:
-        if "source" not in doc.metadata:
-            doc.metadata["source"] = ""
-        if "title" not in doc.metadata:
-            doc.metadata["title"] = ""
-
-    logger.info(f"About to add docs of {len(docs_transformed)}")
+    settings = IngestionSettings.from_env()
+    loader = make_avma_loader(
+        parse_workers=settings.parse_workers, parse_chunksize=settings.parse_chunksize
+    )
+    ledger = IngestionLedger(
+        settings.ledger_url or os.environ["VECTOR_DB_URL"], collection=table_name
+    )
+    report = IngestionReport()
+    entries = loader.load_sitemap_entries()
+    pipeline = build_ingestion_pipeline(
+        loader,
+        text_splitter,
+        embedding,
+        vectorstore,
+        settings,
+        ledger,
+        report,
+        entries=entries,
+    )
+    try:
+        stats = pipeline.run()
+        delete_vanished_pages(loader, entries, vectorstore, ledger, report)
+    finally:
+        loader.close()
+        ledger.close()
 
-    batch_size = 256
-    for i in range(int(len(docs_transformed) / batch_size) + 1):
-        logger.info(f"adding docs from {batch_size * i} to {batch_size * (i + 1)}")
-        vectorstore.add_documents(
-            docs_transformed[batch_size * i : batch_size * (i + 1)]
-        )
+    logger.info(f"Ingested {stats['parse'].items_out} changed docs: chunks {report}")
 
-    vectorstore.reindex(index_name)
+    if report.added or report.updated or report.deleted:
+        vectorstore.reindex(index_name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,331 @@
+"""Ledger of the ingested pages and chunks, for incremental re-ingestion.
+
+The ledger remembers, per vector store collection, the sitemap `lastmod` of
+every ingested page and the content hash and vector id of each of its chunks.
+A re-ingestion skips the pages whose `lastmod` did not change, re-embeds only
+the chunks whose content changed, and deletes the vectors of the chunks (and
+pages) that disappeared, so a refresh costs the size of the delta instead of
+the size of the corpus.
+
+Vector ids are derived from the page URL and the chunk position, so the vector
+of an updated chunk is overwritten in place. The ledger tables live in the vector
+database by default, so they share the lifetime of the vectors they track.
+"""
+
+import hashlib
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from langchain_core.documents import Document
+from sqlalchemy import URL, create_engine, make_url, text
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a chunk's content."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def ledger_database_url(url: str) -> URL:
+    """Return the synchronous SQLAlchemy URL of a ledger database.
+
+    Args:
+        url (str): A SQLAlchemy URL, such as the async `VECTOR_DB_URL` of the vector
+            store, or the path of a SQLite database file.
+    """
+    if "://" not in url:
+        return make_url(f"sqlite:///{url}")
+    database_url = make_url(url)
+    if database_url.get_backend_name() == "postgresql":
+        # psycopg is the Postgres driver of the project, and runs both sync and async.
+        return database_url.set(drivername="postgresql+psycopg")
+    return database_url
+
+
+def chunk_vector_id(url: str, position: int) -> str:
+    """Return the deterministic vector id of the chunk at `position` in a page."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{url}#{position}"))
+
+
+@dataclass
+class IngestionReport:
+    """Chunk counters of an ingestion run."""
+
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(
+        self, *, added: int = 0, updated: int = 0, skipped: int = 0, deleted: int = 0
+    ) -> None:
+        with self._lock:
+            self.added += added
+            self.updated += updated
+            self.skipped += skipped
+            self.deleted += deleted
+
+    def __str__(self) -> str:
+        return (
+            f"{self.added} added, {self.updated} updated, "
+            f"{self.skipped} skipped, {self.deleted} deleted"
+        )
+
+
+@dataclass
+class PagePlan:
+    """What has to be written for a page whose content changed."""
+
+    url: str
+    lastmod: str
+    remaining: int
+    """Number of chunks of the page not written yet."""
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def chunk_written(self) -> bool:
+        """Count a written chunk, returns True once the whole page is written."""
+        with self._lock:
+            self.remaining -= 1
+            return self.remaining == 0
+
+
+@dataclass
+class PendingChunk:
+    """A new or changed chunk waiting to be embedded and written."""
+
+    document: Document
+    page: PagePlan
+    position: int
+    content_hash: str
+    vector_id: str
+
+
+class IngestionLedger:
+    """Database record of what has been ingested into a vector store collection.
+
+    The ledger is the only record of the vector ids written to the collection, so it is
+    meant to live in the vector database itself, next to the vectors it tracks. A page's
+    `lastmod` is only recorded once all of its chunks are written, so an interrupted run
+    re-fetches the pages it did not finish.
+
+    Args:
+        url (str): SQLAlchemy URL of the database, e.g. the `VECTOR_DB_URL` of the vector
+            store, or the path of a SQLite database file.
+        collection (str): Name of the vector store collection (table) the ledger tracks.
+    """
+
+    def __init__(self, url: str, collection: str):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._engine = create_engine(ledger_database_url(url))
+        with self._engine.begin() as conn:
+            if self._engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.exec_driver_sql(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_ledger_pages (
+                    collection TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    lastmod TEXT NOT NULL,
+                    PRIMARY KEY (collection, url)
+                )
+                """
+            )
+            conn.exec_driver_sql(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_ledger_chunks (
+                    collection TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    vector_id TEXT NOT NULL,
+                    PRIMARY KEY (collection, url, position)
+                )
+                """
+            )
+
+    def close(self) -> None:
+        """Close the connections to the database."""
+        self._engine.dispose()
+
+    def unchanged_chunks(self, url: str, lastmod: Optional[str]) -> Optional[int]:
+        """Return the number of chunks of a page if its `lastmod` did not change, else None.
+
+        Pages without a `lastmod` in the sitemap are always considered changed.
+        """
+        if not lastmod:
+            return None
+        params = {"collection": self.collection, "url": url}
+        with self._lock, self._engine.connect() as conn:
+            recorded = conn.execute(
+                text(
+                    "SELECT lastmod FROM ingest_ledger_pages "
+                    "WHERE collection = :collection AND url = :url"
+                ),
+                params,
+            ).scalar()
+            if recorded != lastmod:
+                return None
+            return conn.execute(
+                text(
+                    "SELECT COUNT(*) FROM ingest_ledger_chunks "
+                    "WHERE collection = :collection AND url = :url"
+                ),
+                params,
+            ).scalar_one()
+
+    def plan_page(
+        self,
+        url: str,
+        lastmod: Optional[str],
+        chunks: list[Document],
+        report: IngestionReport,
+    ) -> tuple[PagePlan, list[PendingChunk], list[str]]:
+        """Compare the new chunks of a page to the recorded ones.
+
+        Args:
+            url (str): The page URL.
+            lastmod (Optional[str]): The page `lastmod` from the sitemap.
+            chunks (list[Document]): The chunks of the page, in order.
+            report (IngestionReport): Where the added, updated and skipped chunks are counted.
+
+        Returns:
+            tuple[PagePlan, list[PendingChunk], list[str]]: The page plan, the chunks to embed and
+                write, and the vector ids of the chunks that disappeared. The caller deletes those
+                vectors and then calls `forget_chunks`.
+        """
+        with self._lock, self._engine.connect() as conn:
+            recorded = dict(
+                conn.execute(
+                    text(
+                        "SELECT position, content_hash FROM ingest_ledger_chunks "
+                        "WHERE collection = :collection AND url = :url"
+                    ),
+                    {"collection": self.collection, "url": url},
+                ).all()
+            )
+
+        pending = []
+        page = PagePlan(url=url, lastmod=lastmod or "", remaining=0)
+        added = updated = 0
+        for position, chunk in enumerate(chunks):
+            digest = content_hash(chunk.page_content)
+            if recorded.get(position) == digest:
+                continue
+            if position in recorded:
+                updated += 1
+            else:
+                added += 1
+            vector_id = chunk_vector_id(url, position)
+            chunk.id = vector_id
+            pending.append(PendingChunk(chunk, page, position, digest, vector_id))
+        page.remaining = len(pending)
+        report.record(added=added, updated=updated, skipped=len(chunks) - len(pending))
+
+        vanished = [
+            chunk_vector_id(url, position)
+            for position in sorted(recorded)
+            if position >= len(chunks)
+        ]
+        return page, pending, vanished
+
+    def record_chunks(self, chunks: Iterable[PendingChunk]) -> None:
+        """Record chunks whose vectors were written."""
+        rows = [
+            {
+                "collection": self.collection,
+                "url": chunk.page.url,
+                "position": chunk.position,
+                "content_hash": chunk.content_hash,
+                "vector_id": chunk.vector_id,
+            }
+            for chunk in chunks
+        ]
+        if not rows:
+            return
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO ingest_ledger_chunks "
+                    "VALUES (:collection, :url, :position, :content_hash, :vector_id) "
+                    "ON CONFLICT (collection, url, position) DO UPDATE SET "
+                    "content_hash = excluded.content_hash, vector_id = excluded.vector_id"
+                ),
+                rows,
+            )
+
+    def record_page(self, page: PagePlan) -> None:
+        """Record the `lastmod` of a page whose chunks are all written."""
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO ingest_ledger_pages VALUES (:collection, :url, :lastmod) "
+                    "ON CONFLICT (collection, url) DO UPDATE SET lastmod = excluded.lastmod"
+                ),
+                {
+                    "collection": self.collection,
+                    "url": page.url,
+                    "lastmod": page.lastmod,
+                },
+            )
+
+    def forget_chunks(self, url: str, vector_ids: Iterable[str]) -> None:
+        """Remove chunks of a page whose vectors were deleted."""
+        rows = [
+            {"collection": self.collection, "url": url, "vector_id": vector_id}
+            for vector_id in vector_ids
+        ]
+        if not rows:
+            return
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DELETE FROM ingest_ledger_chunks WHERE collection = :collection "
+                    "AND url = :url AND vector_id = :vector_id"
+                ),
+                rows,
+            )
+
+    def vanished_pages(self, urls: Iterable[str]) -> dict[str, list[str]]:
+        """Return the vector ids of the recorded pages that are not in `urls`, by page URL."""
+        seen = set(urls)
+        vanished: dict[str, list[str]] = {}
+        with self._lock, self._engine.connect() as conn:
+            # Chunks of a page interrupted before its lastmod was recorded count as well.
+            rows = conn.execute(
+                text(
+                    "SELECT url, vector_id FROM ingest_ledger_chunks "
+                    "WHERE collection = :collection "
+                    "UNION ALL SELECT url, NULL FROM ingest_ledger_pages "
+                    "WHERE collection = :collection"
+                ),
+                {"collection": self.collection},
+            ).all()
+        for url, vector_id in rows:
+            if url in seen:
+                continue
+            ids = vanished.setdefault(url, [])
+            if vector_id is not None:
+                ids.append(vector_id)
+        return vanished
+
+    def forget_page(self, url: str) -> None:
+        """Remove a page and all of its chunks."""
+        params = {"collection": self.collection, "url": url}
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DELETE FROM ingest_ledger_chunks "
+                    "WHERE collection = :collection AND url = :url"
+                ),
+                params,
+            )
+            conn.execute(
+                text(
+                    "DELETE FROM ingest_ledger_pages "
+                    "WHERE collection = :collection AND url = :url"
+                ),
+                params,
+            )
@@ -0,0 +1,239 @@
+"""A streaming, stage-overlapped pipeline for ingestion.
+
+Items flow from a source iterator through a chain of stages connected by
+bounded queues. Every stage runs on its own pool of worker threads, so
+fetching, parsing, splitting, embedding and writing overlap, and a slow stage
+applies backpressure to the ones before it instead of letting items pile up in
+memory. Peak memory is bounded by the queue sizes and batch sizes, not by the
+size of the corpus.
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+@dataclass
+class Stage:
+    """A step of the pipeline.
+
+    `fn` receives one item (or a list of items when `batch_size` is set) and returns an
+    iterable of zero or more items for the next stage.
+    """
+
+    name: str
+    fn: Callable[[Any], Iterable[Any]]
+    workers: int = 1
+    batch_size: Optional[int] = None
+    queue_size: Optional[int] = None
+    """Maximum number of items waiting in front of the stage, the `queue_size` of the
+    pipeline if None. Set it lower for stages receiving large items, such as batches."""
+
+
+@dataclass
+class StageStats:
+    """Progress counters of a stage."""
+
+    items_in: int = 0
+    items_out: int = 0
+    busy_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, items_in: int, items_out: int, busy_seconds: float) -> None:
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy_seconds += busy_seconds
+
+
+class PipelineError(RuntimeError):
+    """Raised when a stage of the pipeline failed."""
+
+
+class Pipeline:
+    """Run a source through stages connected by bounded queues.
+
+    Args:
+        source (Iterable[Any]): The items fed to the first stage.
+        stages (list[Stage]): The stages, in order. The items returned by the last stage are discarded.
+        queue_size (int): Maximum number of items waiting in front of each stage, unless the
+            stage sets its own.
+        progress_interval_seconds (Optional[float]): How often progress is logged, None to disable.
+    """
+
+    def __init__(
+        self,
+        source: Iterable[Any],
+        stages: list[Stage],
+        *,
+        queue_size: int = 64,
+        progress_interval_seconds: Optional[float] = 10.0,
+    ):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        if queue_size < 1 or any(
+            stage.queue_size is not None and stage.queue_size < 1 for stage in stages
+        ):
+            raise ValueError("Pipeline queue_size should be at least 1")
+
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.progress_interval_seconds = progress_interval_seconds
+        self.stats = {stage.name: StageStats() for stage in stages}
+        self._stop = threading.Event()
+        self._errors: list[BaseException] = []
+        self._started_at = 0.0
+
+    def run(self) -> dict[str, StageStats]:
+        """Run the pipeline until the source is exhausted and every stage is drained.
+
+        Returns:
+            dict[str, StageStats]: The counters of every stage.
+
+        Raises:
+            PipelineError: If the source or a stage raised, the pipeline is stopped early.
+        """
+        self._started_at = time.perf_counter()
+        queues = [
+            queue.Queue(stage.queue_size or self.queue_size) for stage in self.stages
+        ]
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(queues[0],), name="pipeline-source"
+            )
+        ]
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for n in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, queues[i], outbox, remaining, lock),
+                        name=f"pipeline-{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+
+        reporter = None
+        if self.progress_interval_seconds:
+            reporter = threading.Thread(
+                target=self._report, name="pipeline-progress", daemon=True
+            )
+
+        for thread in threads:
+            thread.start()
+        if reporter is not None:
+            reporter.start()
+        for thread in threads:
+            thread.join()
+        self._stop.set()
+        if reporter is not None:
+            reporter.join()
+
+        self.log_progress()
+        if self._errors:
+            raise PipelineError("Ingestion pipeline failed") from self._errors[0]
+        return self.stats
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """Put an item in a queue, blocking while it is full. Returns False once stopped."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fail(self, error: BaseException) -> None:
+        self._errors.append(error)
+        self._stop.set()
+
+    def _feed(self, inbox: queue.Queue) -> None:
+        try:
+            for item in self.source:
+                if not self._put(inbox, item):
+                    return
+        except BaseException as e:
+            self._fail(e)
+            logger.exception("Pipeline source failed")
+        finally:
+            self._put(inbox, _END)
+
+    def _work(
+        self,
+        stage: Stage,
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue],
+        remaining: list[int],
+        lock: threading.Lock,
+    ) -> None:
+        stats = self.stats[stage.name]
+        batch: list[Any] = []
+
+        def process(item: Any, n_in: int) -> None:
+            start = time.perf_counter()
+            outputs = list(stage.fn(item))
+            stats.record(n_in, len(outputs), time.perf_counter() - start)
+            if outbox is not None:
+                for output in outputs:
+                    if not self._put(outbox, output):
+                        return
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    # Let the other workers of the stage see the end as well.
+                    inbox.put(_END)
+                    break
+                if stage.batch_size is None:
+                    process(item, 1)
+                    continue
+                batch.append(item)
+                if len(batch) >= stage.batch_size:
+                    process(batch, len(batch))
+                    batch = []
+            if batch and not self._stop.is_set():
+                process(batch, len(batch))
+        except BaseException as e:
+            # Stop the other workers first, formatting the traceback takes a while.
+            self._fail(e)
+            logger.exception("Pipeline stage %r failed", stage.name)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                self._put(outbox, _END)
+
+    def _report(self) -> None:
+        while not self._stop.wait(self.progress_interval_seconds):
+            self.log_progress()
+
+    def log_progress(self) -> None:
+        """Log the progress and throughput of every stage."""
+        elapsed = time.perf_counter() - self._started_at
+        logger.info(
+            "Ingestion progress after %.1fs: %s",
+            elapsed,
+            " | ".join(
+                f"{name}: {stats.items_in} in, {stats.items_out} out, "
+                f"{stats.items_in / elapsed if elapsed else 0.0:.1f}/s, "
+                f"busy {stats.busy_seconds:.0f}s"
+                for name, stats in self.stats.items()
+            ),
+        )
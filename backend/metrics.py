@@ -0,0 +1,504 @@
+"""In-process metrics of the graph, LLM, retrieval and store operations.
+
+LangSmith traces are sampled, delayed and live outside of the process. This module
+keeps counters and histograms in memory and renders them in the Prometheus text
+format, served at `/metrics` by `backend.server`.
+
+The operations are measured without touching the nodes:
+
+- `MetricsCallbackHandler`, attached to every LangChain run of the process, times
+  every graph node (subgraph nodes included), LLM call and retriever call, and counts
+  the tokens of every LLM call per model. Set `METRICS_ENABLED=false` to detach it.
+- `instrument_store` wraps a LangGraph store to time its operations.
+- Components with a `stats()` method (caches, pools) register it with `register_stats`,
+  their values are exported as gauges when the metrics are scraped.
+"""
+
+import bisect
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    ListNamespacesOp,
+    Op,
+    PutOp,
+    Result,
+    SearchOp,
+)
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)  # fmt: skip
+
+_INVALID_NAME_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Observations counted in cumulative buckets per label set, with their sum."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: the count of every bucket (and +Inf), and the sum.
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = {
+                key: (list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            }
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": _format_value(float(bound))}
+                yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """The metrics of the process, and the `stats()` providers exported as gauges."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Any] = {}
+        self._stats: list[tuple[str, Callable[[], dict], dict[str, str], str]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Any) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_stats(
+        self,
+        component: str,
+        stats: Callable[[], dict],
+        labels: Optional[dict[str, str]] = None,
+        nested_label: str = "key",
+    ) -> None:
+        """Export the values returned by a `stats()` method as gauges.
+
+        Every numeric value `key` becomes a `petopeta_<component>_<key>` gauge. Values
+        that are dicts are exported per dict key, under the `nested_label` label.
+
+        Args:
+            component (str): Name of the component, part of the gauge names.
+            stats (Callable[[], dict]): Function returning the current values.
+            labels (Optional[dict[str, str]]): Labels telling apart several instances
+                of a component.
+            nested_label (str): Label of the keys of nested dicts.
+        """
+        with self._lock:
+            self._stats.append((component, stats, labels or {}, nested_label))
+
+    def _stats_samples(self) -> Iterable[str]:
+        with self._lock:
+            providers = list(self._stats)
+        gauges: dict[str, list[str]] = {}
+        for component, stats, labels, nested_label in providers:
+            try:
+                values = stats()
+            except Exception:
+                logger.warning(
+                    "Stats of %s could not be collected", component, exc_info=True
+                )
+                continue
+            for key, value in values.items():
+                if isinstance(value, dict):
+                    entries = [
+                        ({**labels, nested_label: str(key)}, name, nested)
+                        for name, nested in value.items()
+                    ]
+                else:
+                    entries = [(labels, key, value)]
+                for sample_labels, name, number in entries:
+                    if isinstance(number, bool) or not isinstance(number, (int, float)):
+                        continue
+                    metric = _INVALID_NAME_CHARACTERS.sub(
+                        "_", f"petopeta_{component}_{name}"
+                    )
+                    gauges.setdefault(metric, []).append(
+                        f"{metric}{_format_labels(sample_labels)} {_format_value(number)}"
+                    )
+        for metric, samples in sorted(gauges.items()):
+            yield f"# TYPE {metric} gauge"
+            yield from samples
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        lines.extend(self._stats_samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+node_duration_seconds = registry.histogram(
+    "petopeta_graph_node_duration_seconds",
+    "Duration of the graph node runs.",
+    ("node",),
+)
+node_errors_total = registry.counter(
+    "petopeta_graph_node_errors_total", "Graph node runs that raised.", ("node",)
+)
+llm_duration_seconds = registry.histogram(
+    "petopeta_llm_duration_seconds", "Latency of the LLM calls.", ("model",)
+)
+llm_errors_total = registry.counter(
+    "petopeta_llm_errors_total", "LLM calls that raised.", ("model",)
+)
+llm_tokens_total = registry.counter(
+    "petopeta_llm_tokens_total",
+    "Tokens of the LLM calls, by model and direction (input or output).",
+    ("model", "direction"),
+)
+retrieval_duration_seconds = registry.histogram(
+    "petopeta_retrieval_duration_seconds",
+    "Latency of the retriever calls (web search, vector store).",
+    ("retriever",),
+)
+retrieval_errors_total = registry.counter(
+    "petopeta_retrieval_errors_total", "Retriever calls that raised.", ("retriever",)
+)
+store_duration_seconds = registry.histogram(
+    "petopeta_store_duration_seconds",
+    "Latency of the LangGraph store operations.",
+    ("operation",),
+)
+store_errors_total = registry.counter(
+    "petopeta_store_errors_total",
+    "LangGraph store operations that raised.",
+    ("operation",),
+)
+
+
+def register_stats(
+    component: str,
+    stats: Callable[[], dict],
+    labels: Optional[dict[str, str]] = None,
+    nested_label: str = "key",
+) -> None:
+    """Export a `stats()` method with the process-wide registry, see `MetricsRegistry.register_stats`."""
+    registry.register_stats(component, stats, labels, nested_label)
+
+
+def _node_name(metadata: dict[str, Any]) -> str:
+    """Return the node name, prefixed with the names of its parent graph nodes.
+
+    The checkpoint namespace of a subgraph node is `parent:<task id>|node:<task id>`.
+    """
+    namespace = metadata.get("langgraph_checkpoint_ns", "")
+    if not namespace:
+        return metadata["langgraph_node"]
+    return "/".join(part.split(":", 1)[0] for part in namespace.split("|"))
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Time the graph nodes, LLM calls and retriever calls of the runs it is attached to."""
+
+    # Called in the thread of the run, so the timestamps are not delayed by an executor.
+    run_inline = True
+
+    def __init__(self) -> None:
+        self._runs: dict[uuid.UUID, tuple[Any, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: uuid.UUID, kind: Any, label: str) -> None:
+        with self._lock:
+            self._runs[run_id] = (kind, label, time.perf_counter())
+
+    def _end(self, run_id: uuid.UUID, kind: Any) -> Optional[tuple[str, float]]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or run[0] is not kind:
+            return None
+        return run[1], time.perf_counter() - run[2]
+
+    def on_chain_start(
+        self,
+        serialized: Any,
+        inputs: Any,
+        *,
+        run_id: uuid.UUID,
+        parent_run_id: Optional[uuid.UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        name = kwargs.get("name")
+        # Other runnables inside a node inherit its metadata, the node run itself has its name
+        # and a step tag.
+        if (
+            name
+            and name == metadata.get("langgraph_node")
+            and not name.startswith("__")
+            and any(tag.startswith("graph:step:") for tag in tags or ())
+        ):
+            self._start(run_id, node_duration_seconds, _node_name(metadata))
+
+    def on_chain_end(self, outputs: Any, *, run_id: uuid.UUID, **kwargs: Any) -> None:
+        if run := self._end(run_id, node_duration_seconds):
+            node_duration_seconds.observe(run[1], node=run[0])
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        if run := self._end(run_id, node_duration_seconds):
+            # Commands raised to jump to another node are not errors.
+            if type(error).__name__ != "ParentCommand":
+                node_errors_total.inc(node=run[0])
+            node_duration_seconds.observe(run[1], node=run[0])
+
+    def on_chat_model_start(
+        self,
+        serialized: Any,
+        messages: Any,
+        *,
+        run_id: uuid.UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = (
+            (metadata or {}).get("ls_model_name")
+            or params.get("model")
+            or params.get("model_name")
+            or "unknown"
+        )
+        self._start(run_id, llm_duration_seconds, str(model))
+
+    def on_llm_end(
+        self, response: LLMResult, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        run = self._end(run_id, llm_duration_seconds)
+        if run is None:
+            return
+        model, seconds = run
+        llm_duration_seconds.observe(seconds, model=model)
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                )
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+        if not (input_tokens or output_tokens):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+        if input_tokens:
+            llm_tokens_total.inc(input_tokens, model=model, direction="input")
+        if output_tokens:
+            llm_tokens_total.inc(output_tokens, model=model, direction="output")
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        if run := self._end(run_id, llm_duration_seconds):
+            llm_errors_total.inc(model=run[0])
+            llm_duration_seconds.observe(run[1], model=run[0])
+
+    def on_retriever_start(
+        self,
+        serialized: Any,
+        query: str,
+        *,
+        run_id: uuid.UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        retriever = (metadata or {}).get("ls_vector_store_provider") or kwargs.get(
+            "name", "unknown"
+        )
+        self._start(run_id, retrieval_duration_seconds, str(retriever))
+
+    def on_retriever_end(
+        self, documents: Any, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        if run := self._end(run_id, retrieval_duration_seconds):
+            retrieval_duration_seconds.observe(run[1], retriever=run[0])
+
+    def on_retriever_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        if run := self._end(run_id, retrieval_duration_seconds):
+            retrieval_errors_total.inc(retriever=run[0])
+            retrieval_duration_seconds.observe(run[1], retriever=run[0])
+
+
+metrics_callback = MetricsCallbackHandler()
+
+# The handler is added to every run of the process by the LangChain callback manager,
+# like the LangSmith tracer, so the graphs, their subgraphs and the nodes themselves do
+# not have to pass it around. It is inherited by child runs and only attached once.
+_metrics_callback_var: ContextVar[Optional[MetricsCallbackHandler]] = ContextVar(
+    "petopeta_metrics_callback",
+    default=(
+        metrics_callback
+        if os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+        else None
+    ),
+)
+register_configure_hook(_metrics_callback_var, inheritable=True)
+
+
+def _store_operation(op: Op) -> str:
+    if isinstance(op, GetOp):
+        return "get"
+    if isinstance(op, SearchOp):
+        return "search"
+    if isinstance(op, PutOp):
+        return "put" if op.value is not None else "delete"
+    if isinstance(op, ListNamespacesOp):
+        return "list_namespaces"
+    return type(op).__name__
+
+
+class InstrumentedStore(BaseStore):
+    """A LangGraph store timing the operations of the store it wraps.
+
+    Every store method goes through `batch`/`abatch`, a batch is timed once and labelled
+    with its first operation.
+    """
+
+    def __init__(self, store: BaseStore):
+        self.store = store
+
+    def batch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        operation = _store_operation(ops[0]) if ops else "empty"
+        start = time.perf_counter()
+        try:
+            return self.store.batch(ops)
+        except Exception:
+            store_errors_total.inc(operation=operation)
+            raise
+        finally:
+            store_duration_seconds.observe(
+                time.perf_counter() - start, operation=operation
+            )
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        operation = _store_operation(ops[0]) if ops else "empty"
+        start = time.perf_counter()
+        try:
+            return await self.store.abatch(ops)
+        except Exception:
+            store_errors_total.inc(operation=operation)
+            raise
+        finally:
+            store_duration_seconds.observe(
+                time.perf_counter() - start, operation=operation
+            )
+
+
+def instrument_store(store: BaseStore) -> BaseStore:
+    """Wrap a store so that its operations are timed, unless it already is."""
+    if isinstance(store, InstrumentedStore):
+        return store
+    return InstrumentedStore(store)
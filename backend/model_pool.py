@@ -0,0 +1,137 @@
+"""Process-wide pool of chat model clients.
+
+`init_chat_model` builds a brand new client (and with it a new HTTP connection
+pool) every time it is called. The graph nodes load their models on every
+invocation, so without pooling each LLM call in a turn pays for a fresh TLS
+handshake. The pool keeps initialized clients keyed by provider, model and
+kwargs so that keep-alive connections are reused across turns and threads.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
+
+from backend.metrics import register_stats
+
+DEFAULT_POOL_SIZE = int(os.environ.get("CHAT_MODEL_POOL_SIZE", "16"))
+
+# Attributes under which the langchain provider integrations keep their SDK clients.
+_SDK_CLIENT_ATTRIBUTES = (
+    "root_client",
+    "root_async_client",
+    "_client",
+    "_async_client",
+)
+
+
+def _pool_key(provider: str, model: str, model_kwargs: dict[str, Any]) -> str:
+    return json.dumps(
+        [provider, model, model_kwargs],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=repr,
+    )
+
+
+def _count_connections(model: BaseChatModel) -> int:
+    """Best-effort count of the open HTTP connections held by a model's SDK clients."""
+    count = 0
+    for attr in _SDK_CLIENT_ATTRIBUTES:
+        sdk_client = getattr(model, attr, None)
+        http_client = getattr(sdk_client, "_client", None)
+        transport = getattr(http_client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            count += len(connections)
+    return count
+
+
+class ChatModelPool:
+    """A bounded, thread-safe LRU pool of initialized chat model clients.
+
+    Args:
+        max_size (int): Maximum number of clients to keep alive.
+        factory (Callable[..., BaseChatModel]): Function used to build a client on a miss.
+            Receives the same arguments as `init_chat_model`.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_POOL_SIZE,
+        factory: Callable[..., BaseChatModel] = init_chat_model,
+    ):
+        if max_size < 1:
+            raise ValueError("Chat model pool size should be at least 1")
+
+        self.max_size = max_size
+        self.factory = factory
+        self._models: OrderedDict[str, BaseChatModel] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, provider: str, model: str, **model_kwargs: Any) -> BaseChatModel:
+        """Return the pooled client for the given provider/model/kwargs, creating it on a miss."""
+        key = _pool_key(provider, model, model_kwargs)
+        with self._lock:
+            pooled = self._models.get(key)
+            if pooled is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return pooled
+            self.misses += 1
+
+        # Build outside of the lock, client construction can be slow.
+        created = self.factory(model, model_provider=provider, **model_kwargs)
+
+        with self._lock:
+            # Another thread may have built the same client in the meantime, keep the first one.
+            pooled = self._models.setdefault(key, created)
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_size:
+                # Evicted clients are not closed: nodes of a running turn may still hold them.
+                # Their connections are released once the last reference is gone.
+                self._models.popitem(last=False)
+                self.evictions += 1
+        return pooled
+
+    def clear(self) -> None:
+        """Drop every pooled client."""
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the number of live clients and connections."""
+        with self._lock:
+            models = list(self._models.values())
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(models),
+                "max_size": self.max_size,
+            }
+        stats["live_connections"] = sum(_count_connections(m) for m in models)
+        return stats
+
+
+_pool: Optional[ChatModelPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_chat_model_pool() -> ChatModelPool:
+    """Return the process-wide chat model pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ChatModelPool()
+                register_stats("chat_model_pool", _pool.stats)
+    return _pool
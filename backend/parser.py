@@ -1,8 +1,9 @@
 import re
-from typing import Generator
+from typing import Any, Generator, Iterator, Optional
 
 from bs4 import BeautifulSoup, Doctype, Tag
 from bs4.element import NavigableString
+from lxml import etree
 
 
 def avma_docs_extractor(soup: BeautifulSoup) -> str:
@@ -125,3 +126,310 @@ def simple_extractor(html: str | BeautifulSoup) -> str:
             "Input should be either BeautifulSoup object or an HTML string"
         )
     return re.sub(r"\n\n+", "\n\n", soup.text).strip()
+
+
+# lxml fast path for avma_docs_extractor.
+#
+# `avma_docs_extractor_lxml` produces the same output as `avma_docs_extractor` on a
+# BeautifulSoup built with the "xml" or "lxml" parser, without building the soup: it reads
+# the lxml tree those parsers are built from, with the same semantics as BeautifulSoup.
+# In particular:
+#   - whitespace-only strings are collapsed to a single newline or space, except inside
+#     <pre> and <textarea> in HTML documents;
+#   - comments (and processing instructions in XML documents) are strings when walking the
+#     children of a tag, but are left out of get_text();
+#   - in HTML documents, strings inside <rt>, <rp> and <template> are left out of get_text();
+#   - in XML documents, tags are named without their namespace prefix and class attributes
+#     are plain strings instead of lists of classes;
+#   - the last value of a repeated attribute wins.
+
+_SCAPE_TAGS = ("nav", "footer", "aside", "script", "style")
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+_SPECIAL_STRING_TAGS = ("rt", "rp", "template")
+# BeautifulSoup feeds XML markup to lxml in chunks of this size.
+_XML_CHUNK_SIZE = 512
+_CLASS_TOKEN = re.compile(r"\S+")
+_LANGUAGE_CLASS = re.compile(r"language-\w+")
+
+
+class _LxmlSoup:
+    """An lxml tree read the way BeautifulSoup would present it."""
+
+    def __init__(self, markup: str, xml: bool):
+        self.xml = xml
+        self.root = self._parse(markup)
+        # Slow paths, only taken by documents that need them.
+        self.has_prefixed_tags = False
+        self.has_special_strings = False
+        if self.root is not None:
+            self._prepare()
+
+    def _parse(self, markup: str) -> Optional[etree._Element]:
+        if markup[:1] == "\N{BYTE ORDER MARK}":
+            markup = markup[1:]
+        try:
+            if self.xml:
+                parser = etree.XMLParser(recover=True)
+                for i in range(0, max(len(markup), 1), _XML_CHUNK_SIZE):
+                    parser.feed(markup[i : i + _XML_CHUNK_SIZE])
+            else:
+                parser = etree.HTMLParser(recover=True)
+                parser.feed(markup)
+            return parser.close()
+        except etree.XMLSyntaxError:
+            # Nothing could be parsed, e.g. an empty document.
+            return None
+
+    def _prepare(self) -> None:
+        has_preserving_tags = not self.xml and any(
+            True for _ in self.root.iter(*_PRESERVE_WHITESPACE_TAGS)
+        )
+        scape = []
+        for node in self.root.iter():
+            tag = node.tag
+            if isinstance(tag, str):
+                if self.xml and "}" not in tag and ":" in tag:
+                    self.has_prefixed_tags = True
+                if not self.xml and tag in _SPECIAL_STRING_TAGS:
+                    self.has_special_strings = True
+                if self.name(node) in _SCAPE_TAGS:
+                    scape.append(node)
+                if self.xml and len(node.attrib) > 1:
+                    _dedupe_attributes(node)
+                own_tag = tag
+            else:
+                own_tag = None
+            if tag is not etree.PI and _is_space(node.text):
+                node.text = _collapse(
+                    node.text,
+                    has_preserving_tags
+                    and (
+                        own_tag in _PRESERVE_WHITESPACE_TAGS or _in_preserving_tag(node)
+                    ),
+                )
+            if node is not self.root and _is_space(node.tail):
+                node.tail = _collapse(
+                    node.tail, has_preserving_tags and _in_preserving_tag(node)
+                )
+
+        # Same as decompose(): drop the tags and their content, but keep the string that
+        # follows them as a separate string.
+        for node in scape:
+            node.clear(keep_tail=True)
+
+    def name(self, el: etree._Element) -> str:
+        tag = el.tag
+        if self.xml:
+            return tag.rpartition("}")[2].rpartition(":")[2]
+        return tag
+
+    def descendants(self, el: etree._Element, name: str) -> Iterator[etree._Element]:
+        if not self.xml:
+            return el.iterdescendants(name)
+        if not self.has_prefixed_tags:
+            return el.iterdescendants("{*}" + name)
+        return (
+            node
+            for node in el.iterdescendants(etree.Element)
+            if self.name(node) == name
+        )
+
+    def find(self, el: etree._Element, name: str) -> Optional[etree._Element]:
+        return next(self.descendants(el, name), None)
+
+    def classes(self, el: etree._Element, default: Any) -> Any:
+        """Return the class attribute as BeautifulSoup would, or `default`."""
+        value = el.get("class")
+        if value is None:
+            return default
+        return value if self.xml else _CLASS_TOKEN.findall(value)
+
+    def has_class(self, el: etree._Element, class_: str) -> bool:
+        """Match a class the way `find_all(class_=...)` does."""
+        value = el.get("class")
+        if value is None:
+            return False
+        if self.xml:
+            return value == class_
+        return class_ in _CLASS_TOKEN.findall(value) or value == class_
+
+    def get_text(self, el: etree._Element, strip: bool = False) -> str:
+        strings = (
+            self._strings(el, _in_special_string_tag(el))
+            if self.has_special_strings
+            else el.itertext()
+        )
+        if strip:
+            return "".join(s for s in (s.strip() for s in strings) if s)
+        return "".join(strings)
+
+    def _strings(self, el: etree._Element, special: bool) -> Iterator[str]:
+        special = special or el.tag in _SPECIAL_STRING_TAGS
+        if el.text and not special:
+            yield el.text
+        for child in el:
+            if isinstance(child.tag, str):
+                yield from self._strings(child, special)
+            if child.tail and not special:
+                yield child.tail
+
+
+def _is_space(text: Optional[str]) -> bool:
+    return bool(text) and not text.strip(_ASCII_SPACES)
+
+
+def _collapse(text: str, preserve: bool) -> str:
+    if preserve:
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _dedupe_attributes(node: etree._Element) -> None:
+    # The recovering XML parser keeps repeated attributes, BeautifulSoup keeps the last value.
+    keys = node.keys()
+    if len(keys) == len(set(keys)):
+        return
+    values = {value.attrname: str(value) for value in node.xpath("@*")}
+    node.attrib.clear()
+    for key in dict.fromkeys(keys):
+        node.set(key, values[key])
+
+
+def _in_preserving_tag(node: etree._Element) -> bool:
+    return any(True for _ in node.iterancestors(*_PRESERVE_WHITESPACE_TAGS))
+
+
+def _in_special_string_tag(node: etree._Element) -> bool:
+    return any(True for _ in node.iterancestors(*_SPECIAL_STRING_TAGS))
+
+
+def avma_docs_extractor_lxml(markup: str, parser: str = "lxml") -> str:
+    """Extract the Markdown content of a page like `avma_docs_extractor`, straight from lxml.
+
+    Args:
+        markup (str): The raw page.
+        parser (str): The BeautifulSoup parser the page would be parsed with, "xml" or "lxml".
+
+    Returns:
+        str: The same output as `avma_docs_extractor(BeautifulSoup(markup, parser))`.
+    """
+    if parser not in ("xml", "lxml"):
+        raise ValueError(f"Unsupported parser for the lxml extractor: {parser}")
+    soup = _LxmlSoup(markup, xml=parser == "xml")
+    if soup.root is None:
+        return ""
+
+    def get_text(tag: etree._Element) -> Generator[str, None, None]:
+        if tag.text:
+            yield tag.text
+        for child in tag:
+            if child.tag is etree.Comment:
+                yield child.text or ""
+            elif child.tag is etree.PI:
+                yield f"{child.target} {child.text or ''}"
+            elif isinstance(child.tag, str):
+                yield from get_tag_text(child)
+            if child.tail:
+                yield child.tail
+
+    def get_tag_text(child: etree._Element) -> Generator[str, None, None]:
+        name = soup.name(child)
+        if name in ["h1", "h2", "h3", "h4", "h5", "h6"]:
+            yield f"{'#' * int(name[1:])} {soup.get_text(child)}\n\n"
+        elif name == "a":
+            yield f"[{soup.get_text(child)}]({child.get('href')})"
+        elif name == "img":
+            yield f"![{child.get('alt', '')}]({child.get('src')})"
+        elif name in ["strong", "b"]:
+            yield f"**{soup.get_text(child)}**"
+        elif name in ["em", "i"]:
+            yield f"_{soup.get_text(child)}_"
+        elif name == "br":
+            yield "\n"
+        elif name == "code":
+            parent = child.getparent()
+            if parent is not None and soup.name(parent) == "pre":
+                language = next(
+                    filter(_LANGUAGE_CLASS.match, soup.classes(parent, "")), None
+                )
+                language = "" if language is None else language.split("-")[1]
+
+                lines = [
+                    "".join(
+                        soup.get_text(token) for token in soup.descendants(span, "span")
+                    )
+                    for span in soup.descendants(child, "span")
+                    if soup.has_class(span, "token-line")
+                ]
+                code_content = "\n".join(lines)
+                yield f"```{language}\n{code_content}\n```\n\n"
+            else:
+                yield f"`{soup.get_text(child)}`"
+        elif name == "p":
+            yield from get_text(child)
+            yield "\n\n"
+        elif name == "ul":
+            for li in child:
+                if isinstance(li.tag, str) and soup.name(li) == "li":
+                    yield "- "
+                    yield from get_text(li)
+                    yield "\n\n"
+        elif name == "ol":
+            items = (
+                li for li in child if isinstance(li.tag, str) and soup.name(li) == "li"
+            )
+            for i, li in enumerate(items):
+                yield f"{i + 1}. "
+                yield from get_text(li)
+                yield "\n\n"
+        elif name == "div" and "tabs-container" in soup.classes(child, [""]):
+            tabs = [
+                li for li in soup.descendants(child, "li") if li.get("role") == "tab"
+            ]
+            tab_panels = [
+                div
+                for div in soup.descendants(child, "div")
+                if div.get("role") == "tabpanel"
+            ]
+            for tab, tab_panel in zip(tabs, tab_panels):
+                tab_name = soup.get_text(tab, strip=True)
+                yield f"{tab_name}\n"
+                yield from get_text(tab_panel)
+        elif name == "table":
+            thead = soup.find(child, "thead")
+            if thead is not None:
+                headers = list(soup.descendants(thead, "th"))
+                if headers:
+                    yield "| "
+                    yield " | ".join(soup.get_text(header) for header in headers)
+                    yield " |\n"
+                    yield "| "
+                    yield " | ".join("----" for _ in headers)
+                    yield " |\n"
+
+            tbody = soup.find(child, "tbody")
+            if tbody is not None:
+                for row in soup.descendants(tbody, "tr"):
+                    yield "| "
+                    yield " | ".join(
+                        soup.get_text(cell, strip=True)
+                        for cell in soup.descendants(row, "td")
+                    )
+                    yield " |\n"
+
+            yield "\n\n"
+        elif name in ["button"]:
+            return
+        else:
+            yield from get_text(child)
+
+    all_content = []
+    for content_part in soup.root.iter(etree.Element):
+        if soup.name(content_part) == "div" and "content-box" in (
+            content_part.get("class") or ""
+        ):
+            all_content.append("".join(get_text(content_part)))
+
+    joined = "\n".join(all_content)
+    return re.sub(r"\n\n+", "\n\n", joined).strip()
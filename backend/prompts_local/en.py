@@ -92,6 +92,24 @@ Anything between the following `context` html blocks is retrieved from a knowled
 """
 )
 
+SUMMARIZE_CONVERSATION_SYSTEM_PROMPT_STR = (
+    SYSMTEM_MAIN_PROMPT_STR
+    + """Your conversation with the user is getting long. Its oldest messages are replaced by a summary, which you will read instead of them in the rest of the conversation.
+
+Extend the current summary below with the new messages of the conversation given by the user, and answer with the new summary only.
+
+# Guidelines
+- Keep the facts about the user's pets: names, species, breeds, ages, weights, health conditions, treatments.
+- Keep the questions of the user and the gist of the advice given.
+- Drop greetings, citations and repetitions.
+- Write at most 200 words, in the third person.
+
+<summary>
+{summary}
+</summary>
+"""
+)
+
 GENERATE_QUERIES_SYSTEM_PROMPT_STR = """Generate 3 search queries to search for to answer the user's question.
 
 These search queries should be diverse in nature - do not generate repetitive ones."""
@@ -1,8 +1,12 @@
+import asyncio
+import atexit
 import os
+import threading
 from contextlib import contextmanager, asynccontextmanager
-from typing import Iterator, AsyncIterator
+from typing import Iterator, AsyncIterator, Optional
 
 import weaviate
+from weaviate.config import ConnectionConfig
 from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import RunnableConfig
@@ -11,43 +15,160 @@ from langchain_postgres import PGVectorStore, PGEngine
 
 from backend.configuration import BaseConfiguration
 from backend.constants import DOCS_INDEX_NAME
-from backend.embeddings import get_embeddings_model
+from backend.embeddings import CachedEmbeddings
 
 
 def make_text_encoder(model: str) -> Embeddings:
-    """Connect to the configured text encoder."""
+    """Connect to the configured text encoder, behind the embedding cache."""
     provider, model = model.split("/", maxsplit=1)
     match provider:
         case "openai":
             from langchain_openai import OpenAIEmbeddings
 
-            return OpenAIEmbeddings(model=model)
+            return CachedEmbeddings(
+                OpenAIEmbeddings(model=model), model_name=f"{provider}/{model}"
+            )
         case _:
             raise ValueError(f"Unsupported embedding provider: {provider}")
 
 
+def embedding_model_key(embedding_model: Embeddings) -> str:
+    """Identify an embedding model by name and dimensions, through the embedding cache."""
+    underlying = getattr(embedding_model, "underlying", embedding_model)
+    name = (
+        getattr(embedding_model, "model_name", None)
+        or getattr(underlying, "model", None)
+        or type(underlying).__name__
+    )
+    return f"{name}|{getattr(underlying, 'dimensions', None) or 'default'}"
+
+
+class RetrieverRegistry:
+    """Process-wide engines and clients of the retriever providers.
+
+    Creating a `PGEngine` (and its connection pool) or a Weaviate connection is expensive,
+    and so is the table introspection done by `PGVectorStore.create`. The registry builds
+    them once per process, shares their bounded connection pools between requests, and
+    closes them on shutdown. Retrievers handed out per request are cheap views with their
+    own `search_kwargs`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._embedding_models: dict[str, Embeddings] = {}
+        self._pg_engine: Optional[PGEngine] = None
+        self._pg_vectorstores: dict[tuple[str, str], PGVectorStore] = {}
+        self._weaviate_client: Optional[weaviate.WeaviateClient] = None
+        self._weaviate_stores: dict[str, WeaviateVectorStore] = {}
+
+    def embedding_model(self, model: str) -> Embeddings:
+        """Return the shared text encoder for a fully specified embedding model name."""
+        with self._lock:
+            if model not in self._embedding_models:
+                self._embedding_models[model] = make_text_encoder(model)
+            return self._embedding_models[model]
+
+    def pg_engine(self) -> PGEngine:
+        """Return the shared Postgres engine, with a bounded connection pool."""
+        with self._lock:
+            if self._pg_engine is None:
+                self._pg_engine = PGEngine.from_connection_string(
+                    url=os.environ["VECTOR_DB_URL"],
+                    pool_size=int(os.environ.get("VECTOR_DB_POOL_SIZE", "5")),
+                    max_overflow=int(os.environ.get("VECTOR_DB_MAX_OVERFLOW", "10")),
+                    pool_pre_ping=True,
+                )
+            return self._pg_engine
+
+    async def apg_vectorstore(
+        self, table_name: str, embedding_model: Embeddings
+    ) -> PGVectorStore:
+        """Return the shared vector store of a Postgres table, creating it on first use.
+
+        Stores are shared per table and embedding model, so a store never embeds queries
+        with another model than the one requested.
+        """
+        key = (table_name, embedding_model_key(embedding_model))
+        vectorstore = self._pg_vectorstores.get(key)
+        if vectorstore is None:
+            created = await PGVectorStore.create(
+                engine=self.pg_engine(),
+                table_name=table_name,
+                embedding_service=embedding_model,
+            )
+            with self._lock:
+                # Keep the first store if another request created one in the meantime.
+                vectorstore = self._pg_vectorstores.setdefault(key, created)
+        return vectorstore
+
+    def weaviate_client(self) -> weaviate.WeaviateClient:
+        """Return the shared Weaviate cloud client, with a bounded session pool."""
+        with self._lock:
+            if self._weaviate_client is None:
+                self._weaviate_client = weaviate.connect_to_weaviate_cloud(
+                    cluster_url=os.environ["WEAVIATE_URL"],
+                    auth_credentials=weaviate.classes.init.Auth.api_key(
+                        os.environ.get("WEAVIATE_API_KEY", "not_provided")
+                    ),
+                    additional_config=weaviate.classes.init.AdditionalConfig(
+                        connection=ConnectionConfig(
+                            session_pool_connections=int(
+                                os.environ.get("WEAVIATE_POOL_CONNECTIONS", "10")
+                            ),
+                            session_pool_maxsize=int(
+                                os.environ.get("WEAVIATE_POOL_MAXSIZE", "20")
+                            ),
+                        )
+                    ),
+                    skip_init_checks=True,
+                )
+            return self._weaviate_client
+
+    def weaviate_store(self, embedding_model: Embeddings) -> WeaviateVectorStore:
+        """Return the shared vector store of the docs index."""
+        client = self.weaviate_client()
+        key = embedding_model_key(embedding_model)
+        with self._lock:
+            if key not in self._weaviate_stores:
+                self._weaviate_stores[key] = WeaviateVectorStore(
+                    client=client,
+                    index_name=DOCS_INDEX_NAME,
+                    text_key="text",
+                    embedding=embedding_model,
+                    attributes=["source", "title"],
+                )
+            return self._weaviate_stores[key]
+
+    async def aclose(self) -> None:
+        """Close the shared clients and dispose of their connection pools."""
+        with self._lock:
+            pg_engine, self._pg_engine = self._pg_engine, None
+            weaviate_client, self._weaviate_client = self._weaviate_client, None
+            self._pg_vectorstores.clear()
+            self._weaviate_stores.clear()
+        if pg_engine is not None:
+            await pg_engine.close()
+        if weaviate_client is not None:
+            weaviate_client.close()
+
+    def close(self) -> None:
+        """Synchronous version of `aclose`, used on interpreter shutdown."""
+        asyncio.run(self.aclose())
+
+
+retriever_registry = RetrieverRegistry()
+atexit.register(retriever_registry.close)
+
+
 @contextmanager
 def make_weaviate_retriever(
     configuration: BaseConfiguration, embedding_model: Embeddings
 ) -> Iterator[BaseRetriever]:
     """Caution: use 0.0.3 version of WeaviateVectorStore, there are bugs with 0.0.4"""
 
-    with weaviate.connect_to_weaviate_cloud(
-        cluster_url=os.environ["WEAVIATE_URL"],
-        auth_credentials=weaviate.classes.init.Auth.api_key(
-            os.environ.get("WEAVIATE_API_KEY", "not_provided")
-        ),
-        skip_init_checks=True,
-    ) as weaviate_client:
-        store = WeaviateVectorStore(
-            client=weaviate_client,
-            index_name=DOCS_INDEX_NAME,
-            text_key="text",
-            embedding=embedding_model,
-            attributes=["source", "title"],
-        )
-        search_kwargs = {**configuration.search_kwargs, "return_uuids": True}
-        yield store.as_retriever(search_kwargs=search_kwargs)
+    store = retriever_registry.weaviate_store(embedding_model)
+    search_kwargs = {**configuration.search_kwargs, "return_uuids": True}
+    yield store.as_retriever(search_kwargs=search_kwargs)
 
 
 @contextmanager
@@ -56,7 +177,7 @@ def make_retriever(
 ) -> Iterator[BaseRetriever]:
     """Create a retriever for the agent, based on the current configuration."""
     configuration = BaseConfiguration.from_runnable_config(config)
-    embedding_model = make_text_encoder(configuration.embedding_model)
+    embedding_model = retriever_registry.embedding_model(configuration.embedding_model)
     match configuration.retriever_provider:
         case "weaviate":
             with make_weaviate_retriever(configuration, embedding_model) as retriever:
@@ -77,15 +198,10 @@ async def amake_retriever(
     """Create a retriever for the agent asynchronously, based on the current configuration."""
 
     configuration = BaseConfiguration.from_runnable_config(config)
-    embedding_model = get_embeddings_model()
-
-    table_name = os.environ["VECTOR_TABLE_NAME"]
-    pg_engine = PGEngine.from_connection_string(url=os.environ["VECTOR_DB_URL"])
+    embedding_model = retriever_registry.embedding_model(configuration.embedding_model)
 
-    vectorstore = await PGVectorStore.create(
-        engine=pg_engine,
-        table_name=table_name,
-        embedding_service=embedding_model,
+    vectorstore = await retriever_registry.apg_vectorstore(
+        os.environ["VECTOR_TABLE_NAME"], embedding_model
     )
     search_kwargs = {**configuration.search_kwargs, "return_uuids": True}
     yield vectorstore.as_retriever(search_kwargs=search_kwargs)
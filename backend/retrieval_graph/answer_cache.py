@@ -0,0 +1,477 @@
+"""Semantic answer cache for the research pipeline.
+
+Many users ask nearly the same question ("can my dog eat grapes") about the
+same kind of pet. The cache stores the final answer of the research pipeline
+together with its sources, keyed by the embedding of the normalized question and
+a canonical pet profile (species, breed and age bucket). A later question whose
+embedding is close enough to a cached one, for the same profile, is answered
+from the cache without planning, researching or calling the response model.
+
+Two backends are provided: an in-memory one, and a SQLite one that survives
+restarts and can be shared by the workers of a host.
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from backend.embeddings import get_embeddings_model
+from backend.metrics import register_stats
+from backend.utils import data_path
+
+
+@dataclass
+class CachedAnswer:
+    """An answer stored in the cache."""
+
+    embedding: np.ndarray
+    """Unit-normalized embedding of the normalized question."""
+    answer: str
+    sources: list[dict[str, Any]] = field(default_factory=list)
+    """The documents the answer was generated from, as page_content/metadata dicts."""
+    created_at: float = field(default_factory=time.time)
+    id: Optional[int] = None
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question and strip punctuation and redundant whitespace."""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def _age_bucket(age: Any) -> str:
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    if age < 1:
+        return "young"
+    if age < 8:
+        return "adult"
+    return "senior"
+
+
+def pet_profile_key(pet: Optional[dict[str, Any]]) -> str:
+    """Return the canonical profile (species, breed, age bucket) of a pet as a cache key."""
+    pet = pet or {}
+    species = (pet.get("species") or "").strip().lower()
+    breed = (pet.get("breed") or "").strip().lower()
+    return f"{species}|{breed}|{_age_bucket(pet.get('age'))}"
+
+
+def _unit(embedding: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCacheBackend(ABC):
+    """Storage for cached answers, partitioned by pet profile.
+
+    Backends own the size bound: `add` evicts the least recently used entries once
+    more than `max_entries` answers are stored. Answer ids increase in the order the
+    answers are added.
+    """
+
+    shared = False
+    """Whether other processes can add answers to the storage, in which case the answers
+    added since the last lookup are read on every lookup."""
+
+    def __init__(self, max_entries: int = 10_000):
+        if max_entries < 1:
+            raise ValueError("Answer cache max_entries should be at least 1")
+        self.max_entries = max_entries
+
+    @abstractmethod
+    def entries(self, profile: str, after_id: int = -1) -> list[CachedAnswer]:
+        """Return the answers cached for a pet profile, added after the answer `after_id`."""
+
+    @abstractmethod
+    def get(self, entry_id: int) -> Optional[CachedAnswer]:
+        """Return a cached answer, or None if it was removed."""
+
+    @abstractmethod
+    def add(self, profile: str, entry: CachedAnswer) -> list[int]:
+        """Store an answer for a pet profile, and return the ids of the answers evicted."""
+
+    @abstractmethod
+    def touch(self, entry_id: int) -> None:
+        """Mark an answer as recently used."""
+
+    @abstractmethod
+    def delete(self, entry_ids: Sequence[int]) -> None:
+        """Remove answers from the cache."""
+
+
+class InMemoryAnswerCacheBackend(AnswerCacheBackend):
+    """Keep cached answers in the memory of the current process."""
+
+    def __init__(self, max_entries: int = 10_000):
+        super().__init__(max_entries)
+        self._entries: OrderedDict[int, tuple[str, CachedAnswer]] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def entries(self, profile: str, after_id: int = -1) -> list[CachedAnswer]:
+        with self._lock:
+            return sorted(
+                (
+                    entry
+                    for p, entry in self._entries.values()
+                    if p == profile and entry.id > after_id
+                ),
+                key=lambda entry: entry.id,
+            )
+
+    def get(self, entry_id: int) -> Optional[CachedAnswer]:
+        with self._lock:
+            stored = self._entries.get(entry_id)
+        return stored[1] if stored else None
+
+    def add(self, profile: str, entry: CachedAnswer) -> list[int]:
+        evicted = []
+        with self._lock:
+            entry.id = self._next_id
+            self._next_id += 1
+            self._entries[entry.id] = (profile, entry)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        return evicted
+
+    def touch(self, entry_id: int) -> None:
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+
+    def delete(self, entry_ids: Sequence[int]) -> None:
+        with self._lock:
+            for entry_id in entry_ids:
+                self._entries.pop(entry_id, None)
+
+
+class SQLiteAnswerCacheBackend(AnswerCacheBackend):
+    """Keep cached answers in a local SQLite database.
+
+    Args:
+        path (str): Path of the database file.
+        max_entries (int): Maximum number of answers to keep.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, max_entries: int = 10_000):
+        super().__init__(max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                profile TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_profile ON answers (profile, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _entry(row: tuple) -> CachedAnswer:
+        return CachedAnswer(
+            id=row[0],
+            embedding=np.frombuffer(row[1], dtype=np.float32),
+            answer=row[2],
+            sources=json.loads(row[3]),
+            created_at=row[4],
+        )
+
+    def entries(self, profile: str, after_id: int = -1) -> list[CachedAnswer]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding, answer, sources, created_at FROM answers "
+                "WHERE profile = ? AND id > ? ORDER BY id",
+                (profile, after_id),
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def get(self, entry_id: int) -> Optional[CachedAnswer]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, embedding, answer, sources, created_at FROM answers WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def add(self, profile: str, entry: CachedAnswer) -> list[int]:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (profile, embedding, answer, sources, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    profile,
+                    np.asarray(entry.embedding, dtype=np.float32).tobytes(),
+                    entry.answer,
+                    json.dumps(entry.sources, default=str),
+                    entry.created_at,
+                    time.time(),
+                ),
+            )
+            entry.id = cursor.lastrowid
+            evicted = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                    (self.max_entries,),
+                )
+            ]
+            self._conn.executemany(
+                "DELETE FROM answers WHERE id = ?",
+                [(entry_id,) for entry_id in evicted],
+            )
+        return evicted
+
+    def touch(self, entry_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), entry_id)
+            )
+
+    def delete(self, entry_ids: Sequence[int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM answers WHERE id = ?",
+                [(entry_id,) for entry_id in entry_ids],
+            )
+
+
+class _ProfileIndex:
+    """The embeddings of the answers cached for a pet profile, stacked in one matrix."""
+
+    def __init__(self) -> None:
+        self.ids = np.empty(0, dtype=np.int64)
+        self.embeddings: Optional[np.ndarray] = None
+        self.created_at = np.empty(0)
+        self.last_id = -1
+        """The id of the last answer read from the backend."""
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def extend(self, entries: Sequence[CachedAnswer]) -> None:
+        if not entries:
+            return
+        embeddings = np.stack([entry.embedding for entry in entries])
+        self.ids = np.concatenate([self.ids, [entry.id for entry in entries]])
+        self.embeddings = (
+            embeddings
+            if self.embeddings is None
+            else np.concatenate([self.embeddings, embeddings])
+        )
+        self.created_at = np.concatenate(
+            [self.created_at, [entry.created_at for entry in entries]]
+        )
+        self.last_id = max(self.last_id, int(self.ids.max()))
+
+    def remove(self, entry_ids: Sequence[int]) -> None:
+        keep = ~np.isin(self.ids, entry_ids)
+        self.ids = self.ids[keep]
+        self.created_at = self.created_at[keep]
+        if self.embeddings is not None:
+            self.embeddings = self.embeddings[keep]
+
+
+class SemanticAnswerCache:
+    """Look up and store answers by question similarity within a pet profile.
+
+    The embeddings of the cached answers are kept in memory, in one matrix per pet
+    profile read from the backend on the first lookup of the profile, so a lookup is a
+    single matrix product. Only the answer found is read from the backend. The backend
+    calls run in a worker thread.
+
+    Args:
+        backend (AnswerCacheBackend): Where the answers are stored.
+        embeddings (Optional[Embeddings]): Model used to embed the normalized questions.
+    """
+
+    def __init__(
+        self, backend: AnswerCacheBackend, embeddings: Optional[Embeddings] = None
+    ):
+        self.backend = backend
+        self.embeddings = embeddings or get_embeddings_model()
+        self._indexes: dict[str, _ProfileIndex] = {}
+        # id -> profile of the answers in the indexes
+        self._profiles: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def _index(self, profile: str) -> _ProfileIndex:
+        # Called with the lock held.
+        index = self._indexes.get(profile)
+        if index is None or self.backend.shared:
+            index = self._indexes.setdefault(profile, _ProfileIndex())
+            entries = self.backend.entries(profile, index.last_id)
+            index.extend(entries)
+            self._profiles.update((entry.id, profile) for entry in entries)
+        return index
+
+    def _forget(self, entry_ids: Sequence[int]) -> None:
+        # Called with the lock held.
+        by_profile: dict[str, list[int]] = {}
+        for entry_id in entry_ids:
+            profile = self._profiles.pop(entry_id, None)
+            if profile is not None:
+                by_profile.setdefault(profile, []).append(entry_id)
+        for profile, ids in by_profile.items():
+            self._indexes[profile].remove(ids)
+
+    def _prepare(self, profile: str, ttl_seconds: float) -> int:
+        """Load the index of a profile, remove its expired answers, and return its size."""
+        with self._lock:
+            index = self._index(profile)
+            expired = [
+                int(entry_id)
+                for entry_id in index.ids[index.created_at < time.time() - ttl_seconds]
+            ]
+            if expired:
+                self.backend.delete(expired)
+                self._forget(expired)
+                self.expired += len(expired)
+            if not index:
+                self.misses += 1
+            return len(index)
+
+    def _search(
+        self, profile: str, query: np.ndarray, threshold: float
+    ) -> Optional[CachedAnswer]:
+        with self._lock:
+            index = self._index(profile)
+            while len(index):
+                similarities = index.embeddings @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] < threshold:
+                    break
+                entry_id = int(index.ids[best])
+                entry = self.backend.get(entry_id)
+                if entry is not None:
+                    self.backend.touch(entry_id)
+                    self.hits += 1
+                    return entry
+                # Evicted by another process sharing the backend.
+                self._forget([entry_id])
+            self.misses += 1
+            return None
+
+    async def alookup(
+        self,
+        question: str,
+        pet: Optional[dict[str, Any]],
+        *,
+        threshold: float,
+        ttl_seconds: float,
+    ) -> Optional[CachedAnswer]:
+        """Return the most similar cached answer above `threshold`, if any.
+
+        Expired answers met during the lookup are removed from the backend.
+        """
+        profile = pet_profile_key(pet)
+        if not await asyncio.to_thread(self._prepare, profile, ttl_seconds):
+            return None
+
+        query = _unit(await self.embeddings.aembed_query(normalize_question(question)))
+        return await asyncio.to_thread(self._search, profile, query, threshold)
+
+    def _store(self, profile: str, entry: CachedAnswer) -> None:
+        with self._lock:
+            evicted = self.backend.add(profile, entry)
+            # Shared backends are read again on the next lookup, in the order of the ids.
+            if profile in self._indexes and not self.backend.shared:
+                self._indexes[profile].extend([entry])
+                self._profiles[entry.id] = profile
+            self._forget(evicted)
+
+    async def astore(
+        self,
+        question: str,
+        pet: Optional[dict[str, Any]],
+        answer: str,
+        documents: Sequence[Document],
+    ) -> None:
+        """Cache the answer to a question together with the documents it was based on."""
+        embedding = await self.embeddings.aembed_query(normalize_question(question))
+        entry = CachedAnswer(
+            embedding=_unit(embedding),
+            answer=answer,
+            sources=[
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in documents
+            ],
+        )
+        await asyncio.to_thread(self._store, pet_profile_key(pet), entry)
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit/miss counters of the cache, and the number of answers indexed."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "indexed": len(self._profiles),
+            }
+
+
+_caches: dict[tuple[str, str, int], SemanticAnswerCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_answer_cache(backend: str, path: str, max_entries: int) -> SemanticAnswerCache:
+    """Return the process-wide answer cache for a backend configuration.
+
+    Args:
+        backend (str): Either 'memory' or 'sqlite'.
+        path (str): Path of the SQLite database, ignored by the memory backend. Empty for
+            `answer_cache.sqlite3` in the data directory.
+        max_entries (int): Maximum number of answers to keep.
+    """
+    key = (backend, path, max_entries)
+    with _caches_lock:
+        if key not in _caches:
+            match backend:
+                case "memory":
+                    store = InMemoryAnswerCacheBackend(max_entries)
+                case "sqlite":
+                    store = SQLiteAnswerCacheBackend(
+                        path or data_path("answer_cache.sqlite3"), max_entries
+                    )
+                case _:
+                    raise ValueError(f"Unsupported answer cache backend: {backend}")
+            _caches[key] = SemanticAnswerCache(store)
+            register_stats(
+                "answer_cache",
+                _caches[key].stats,
+                {"backend": backend, "path": path, "max_entries": str(max_entries)},
+            )
+        return _caches[key]
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
+from typing import Literal
 
 from backend.configuration import BaseConfiguration
 from backend.retrieval_graph import prompts
@@ -30,6 +31,215 @@ class AgentConfiguration(BaseConfiguration):
         },
     )
 
+    # routing
+
+    router_model_path: str = field(
+        default="",
+        metadata={
+            "description": "Path of the local router classifier model. When set, confident routing decisions are made locally without calling the query model."
+        },
+    )
+
+    router_confidence_threshold: float = field(
+        default=0.9,
+        metadata={
+            "description": "The minimum probability for a decision of the local router classifier to be used instead of the LLM router."
+        },
+    )
+
+    router_decision_log_path: str = field(
+        default="",
+        metadata={
+            "description": "Path of a JSON lines file the decisions of the LLM router are appended to, used to train the local router classifier."
+        },
+    )
+
+    # pets
+
+    local_pet_resolution: bool = field(
+        default=True,
+        metadata={
+            "description": "Whether to resolve the pets mentioned by the user with local matching first, and only run the LLM pet filters when the match is ambiguous or mentions a new animal."
+        },
+    )
+
+    speculative_pet_resolution: bool = field(
+        default=False,
+        metadata={
+            "description": "Whether to resolve the user's pets while the LLM router classifies the question, instead of after it. The resolution is cancelled, without storing any new pet, when the question does not need pets."
+        },
+    )
+
+    pet_profile_cache_ttl_seconds: float = field(
+        default=5 * 60,
+        metadata={
+            "description": "How long the pets of a user read from the store are reused, in seconds. The pet tools invalidate them on every write, the window bounds how long writes made by other processes go unseen. 0 reads the store every time."
+        },
+    )
+
+    # research
+
+    research_mode: Literal["sequential", "parallel"] = field(
+        default="parallel",
+        metadata={
+            "description": "How the steps of the research plan are executed. 'sequential' runs one step at a time, 'parallel' sends every step to the researcher at once."
+        },
+    )
+
+    max_concurrent_research_steps: int = field(
+        default=4,
+        metadata={
+            "description": "The maximum number of research plan steps that are researched at the same time in 'parallel' research mode."
+        },
+    )
+
+    retrieval_sources: list[Literal["library", "web"]] = field(
+        default_factory=lambda: ["library", "web"],
+        metadata={
+            "description": "The sources queried concurrently for every research query: the library vector store and/or the web search."
+        },
+    )
+
+    library_retrieval_deadline_seconds: float = field(
+        default=2.0,
+        metadata={
+            "description": "How long the library vector store is waited for before its results are dropped, in seconds."
+        },
+    )
+
+    web_retrieval_deadline_seconds: float = field(
+        default=6.0,
+        metadata={
+            "description": "How long the web search is waited for before its results are dropped, in seconds."
+        },
+    )
+
+    rrf_k: int = field(
+        default=60,
+        metadata={
+            "description": "The rank constant of the reciprocal rank fusion merging the results of the retrieval sources."
+        },
+    )
+
+    search_cache_ttl_seconds: float = field(
+        default=15 * 60,
+        metadata={"description": "How long web search results are reused, in seconds."},
+    )
+
+    search_cache_max_entries: int = field(
+        default=2048,
+        metadata={
+            "description": "The maximum number of search queries whose results are kept in memory."
+        },
+    )
+
+    search_cache_path: str = field(
+        default="",
+        metadata={
+            "description": "Path of a SQLite database used as an on-disk tier of the search cache. Leave empty to keep results in memory only."
+        },
+    )
+
+    # answer cache
+
+    answer_cache_enabled: bool = field(
+        default=False,
+        metadata={
+            "description": "Whether to answer questions that are similar to an already answered one, for the same kind of pet, from the semantic answer cache."
+        },
+    )
+
+    answer_cache_backend: Literal["memory", "sqlite"] = field(
+        default="memory",
+        metadata={"description": "Where the semantic answer cache is stored."},
+    )
+
+    answer_cache_path: str = field(
+        default="",
+        metadata={
+            "description": "Path of the database file used by the 'sqlite' answer cache backend. Leave empty for answer_cache.sqlite3 in the data directory, set with the PETOPETA_DATA_DIR environment variable."
+        },
+    )
+
+    answer_cache_similarity_threshold: float = field(
+        default=0.95,
+        metadata={
+            "description": "The minimum cosine similarity between two questions for a cached answer to be reused."
+        },
+    )
+
+    answer_cache_ttl_seconds: float = field(
+        default=7 * 24 * 60 * 60,
+        metadata={"description": "How long a cached answer can be reused, in seconds."},
+    )
+
+    answer_cache_max_entries: int = field(
+        default=10_000,
+        metadata={
+            "description": "The maximum number of cached answers, the least recently used ones are evicted first."
+        },
+    )
+
+    # context
+
+    near_duplicate_max_distance: int = field(
+        default=8,
+        metadata={
+            "description": "The maximum number of differing bits between the SimHash fingerprints of two retrieved documents for them to be near-duplicates. A negative value only suppresses web results with the same URL."
+        },
+    )
+
+    rerank_step_weight: float = field(
+        default=0.5,
+        metadata={
+            "description": "The weight of the relevance of a retrieved document to the research plan step that retrieved it, relative to its relevance to the user's question, when reranking."
+        },
+    )
+
+    context_token_budget: int = field(
+        default=6000,
+        metadata={
+            "description": "The maximum number of tokens of retrieved documents put in the response prompt."
+        },
+    )
+
+    context_token_budget_by_model: dict[str, int] = field(
+        default_factory=dict,
+        metadata={
+            "description": "Token budgets of the response prompt context for specific response models, in provider/model-name form, overriding context_token_budget."
+        },
+    )
+
+    context_max_documents: int = field(
+        default=20,
+        metadata={
+            "description": "The maximum number of retrieved documents put in the response prompt."
+        },
+    )
+
+    context_max_tokens_per_document: int = field(
+        default=1000,
+        metadata={
+            "description": "Retrieved documents longer than this number of tokens are truncated to the passages matching the question best."
+        },
+    )
+
+    # history
+
+    history_max_turns: int = field(
+        default=3,
+        metadata={
+            "description": "The number of previous turns of the conversation sent verbatim to the language models. Older turns are replaced by a rolling summary of the thread. It is refreshed in the background and adopted by a later turn, so no turn waits for it. A negative value disables the summary."
+        },
+    )
+
+    history_max_tokens: int = field(
+        default=3000,
+        metadata={
+            "description": "The maximum number of tokens of conversation history sent to a language model. The oldest turns not covered by the summary are dropped beyond it, the current question is always sent. 0 disables the limit."
+        },
+    )
+
     # prompts
 
     router_system_prompt: str = field(
@@ -72,6 +282,13 @@ class AgentConfiguration(BaseConfiguration):
         metadata={"description": "The system prompt used for generating responses."},
     )
 
+    summarize_conversation_system_prompt: str = field(
+        default=prompts.SUMMARIZE_CONVERSATION_SYSTEM_PROMPT,
+        metadata={
+            "description": "The system prompt used for extending the rolling summary of the conversation with the turns that are no longer sent verbatim."
+        },
+    )
+
     get_and_update_pet_info_system_prompt: str = field(
         default=prompts.GET_AND_UPDATE_PET_INFO_SYSTEM_PROMPT,
         metadata={
@@ -0,0 +1,224 @@
+"""Token-budgeted packing of the retrieved documents into the response prompt.
+
+The research steps return library chunks of up to 4000 characters and web results that
+often overlap. Sending all of them in arrival order makes the response prompt large,
+which costs time to first token and money. The packer:
+
+1. drops the documents with the same words as another one. Near-duplicates are left to
+   the deduplicate_documents node (see `backend.retrieval_graph.dedup`);
+2. ranks the documents by BM25 relevance to the question, keeping the retrieval order
+   for ties, unless the rerank stage already ordered them;
+3. truncates long documents to the passages that match the question best;
+4. adds documents in rank order until the token budget of the response model is spent.
+
+Tokens are counted with the shared token counter, which memoizes the counts of the
+documents seen by the packing steps.
+"""
+
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from langchain_core.documents import Document
+
+from backend.metrics import register_stats
+from backend.retrieval_graph.rerank import BM25Index, tokenize
+from backend.token_counter import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Documents get a share of the budget only if it leaves room for some useful text.
+MIN_DOCUMENT_TOKENS = 64
+PASSAGE_SEPARATOR = "\n…\n"
+
+_PASSAGE_PATTERN = re.compile(r"\n\s*\n|(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Count the tokens of a text with the default token counter."""
+    return get_token_counter().count_text(text)
+
+
+@dataclass
+class PackingReport:
+    """What the packer did to the documents of a prompt."""
+
+    documents_in: int = 0
+    documents_packed: int = 0
+    duplicates_dropped: int = 0
+    documents_truncated: int = 0
+    documents_over_budget: int = 0
+    tokens_in: int = 0
+    tokens_packed: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_packed
+
+
+@dataclass
+class PackedContext:
+    """The documents selected for a prompt."""
+
+    documents: list[Document]
+    """The packed documents, best first, possibly truncated to their best passages."""
+    sources: list[Document]
+    """The original documents the packed ones come from, in the same order."""
+    report: PackingReport
+
+
+def _deduplicate(documents_terms: list[list[str]]) -> list[int]:
+    """Return the indexes of the documents to keep, the first of duplicates is kept."""
+    kept: list[int] = []
+    seen: set[tuple[str, ...]] = set()
+    for i, terms in enumerate(documents_terms):
+        key = tuple(terms)
+        if key not in seen:
+            seen.add(key)
+            kept.append(i)
+    return kept
+
+
+def truncate_to_passages(text: str, query_terms: set[str], max_tokens: int) -> str:
+    """Shorten a text to its passages matching the query best, in their original order.
+
+    Passages are paragraphs, or sentences when a paragraph is too long. Passages are
+    picked by the number of distinct query terms they contain, the earlier passage first
+    on ties, until `max_tokens` is reached.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    passages = [p.strip() for p in _PASSAGE_PATTERN.split(text) if p.strip()]
+    ranked = sorted(
+        range(len(passages)),
+        key=lambda i: (-len(query_terms.intersection(tokenize(passages[i]))), i),
+    )
+    chosen: list[int] = []
+    budget = max_tokens
+    for i in ranked:
+        cost = estimate_tokens(passages[i]) + estimate_tokens(PASSAGE_SEPARATOR)
+        if cost <= budget:
+            chosen.append(i)
+            budget -= cost
+    if not chosen:
+        # A single passage larger than the budget: keep its beginning.
+        return get_token_counter().truncate_text(passages[ranked[0]], max_tokens)
+    return PASSAGE_SEPARATOR.join(passages[i] for i in sorted(chosen))
+
+
+def pack_context(
+    question: str,
+    documents: Sequence[Document],
+    token_budget: int,
+    *,
+    max_documents: int = 20,
+    max_tokens_per_document: Optional[int] = None,
+    ranked: bool = False,
+) -> PackedContext:
+    """Select, order and truncate documents so that they fit in a token budget.
+
+    Args:
+        question (str): The user's question, used to rank documents and passages.
+        documents (Sequence[Document]): The retrieved documents, in retrieval order.
+        token_budget (int): Maximum number of tokens of the packed documents' content.
+        max_documents (int): Maximum number of documents packed.
+        max_tokens_per_document (Optional[int]): Documents longer than this are truncated
+            to their best passages. Defaults to a quarter of the budget.
+        ranked (bool): Whether the documents are already ordered by relevance, by the rerank
+            stage. Otherwise they are ranked by BM25 relevance to the question.
+
+    Returns:
+        PackedContext: The packed documents, their originals and what was saved.
+    """
+    report = PackingReport(
+        documents_in=len(documents),
+        tokens_in=sum(estimate_tokens(doc.page_content) for doc in documents),
+    )
+    if max_tokens_per_document is None:
+        max_tokens_per_document = max(MIN_DOCUMENT_TOKENS, token_budget // 4)
+
+    documents_terms = [tokenize(doc.page_content) for doc in documents]
+    kept = _deduplicate(documents_terms)
+    report.duplicates_dropped = len(documents) - len(kept)
+
+    query_terms = tokenize(question)
+    if not ranked:
+        scores = BM25Index([documents_terms[i] for i in kept]).scores(query_terms)
+        kept = [
+            i
+            for _, i in sorted(zip(scores, kept), key=lambda pair: (-pair[0], pair[1]))
+        ]
+
+    packed: list[Document] = []
+    sources: list[Document] = []
+    remaining = token_budget
+    for i in kept:
+        if len(packed) >= max_documents:
+            break
+        limit = min(max_tokens_per_document, remaining)
+        if limit < MIN_DOCUMENT_TOKENS:
+            report.documents_over_budget += 1
+            continue
+        doc = documents[i]
+        content = truncate_to_passages(doc.page_content, set(query_terms), limit)
+        if content != doc.page_content:
+            report.documents_truncated += 1
+        remaining -= estimate_tokens(content)
+        packed.append(Document(page_content=content, metadata=doc.metadata, id=doc.id))
+        sources.append(doc)
+
+    report.documents_packed = len(packed)
+    report.tokens_packed = sum(estimate_tokens(doc.page_content) for doc in packed)
+    context_packer_stats.record(report)
+    logger.debug(
+        "Packed %d of %d documents in %d tokens (%d saved)",
+        report.documents_packed,
+        report.documents_in,
+        report.tokens_packed,
+        report.tokens_saved,
+    )
+    return PackedContext(documents=packed, sources=sources, report=report)
+
+
+@dataclass
+class ContextPackerStats:
+    """Totals of the packing reports of the process."""
+
+    prompts: int = 0
+    documents_in: int = 0
+    documents_packed: int = 0
+    duplicates_dropped: int = 0
+    documents_truncated: int = 0
+    tokens_in: int = 0
+    tokens_packed: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, report: PackingReport) -> None:
+        with self._lock:
+            self.prompts += 1
+            self.documents_in += report.documents_in
+            self.documents_packed += report.documents_packed
+            self.duplicates_dropped += report.duplicates_dropped
+            self.documents_truncated += report.documents_truncated
+            self.tokens_in += report.tokens_in
+            self.tokens_packed += report.tokens_packed
+
+    def stats(self) -> dict[str, int]:
+        """Return the totals and the number of tokens saved."""
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "documents_in": self.documents_in,
+                "documents_packed": self.documents_packed,
+                "duplicates_dropped": self.duplicates_dropped,
+                "documents_truncated": self.documents_truncated,
+                "tokens_in": self.tokens_in,
+                "tokens_packed": self.tokens_packed,
+                "tokens_saved": self.tokens_in - self.tokens_packed,
+            }
+
+
+context_packer_stats = ContextPackerStats()
+register_stats("context_packer", context_packer_stats.stats)
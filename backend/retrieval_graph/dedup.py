@@ -0,0 +1,216 @@
+"""Suppression of duplicate documents retrieved by the research queries.
+
+Every plan step searches with several overlapping queries, so the same web article comes
+back many times: under the same URL with a different query-dependent snippet, or under
+another URL (a mirror, tracking parameters) with nearly the same text. Duplicates are
+collapsed into one canonical document:
+
+- web results with the same canonical URL are duplicates, library chunks share the URL of
+  their article and are only compared by content;
+- documents whose SimHash fingerprints differ by at most a few bits are near-duplicates.
+
+The canonical document is the best scored one of its group. It keeps the best `rrf_score`
+and `score`, and the `queries` and `retrieval_sources` of the whole group.
+"""
+
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Optional, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+from langchain_core.documents import Document
+
+from backend.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Texts with fewer words have too few shingles for a meaningful fingerprint.
+MIN_SIMHASH_WORDS = 20
+# Word bigrams: with longer shingles, a single edited word changes too many features for
+# the fingerprints of short snippets to stay close.
+SHINGLE_SIZE = 2
+_WORD_PATTERN = re.compile(r"\w+")
+_TRACKING_PARAMETERS = re.compile(r"^(utm_\w+|gclid|fbclid|ref|source)$")
+_SCORE_KEYS = ("rrf_score", "score")
+_MERGED_LIST_KEYS = ("queries", "retrieval_sources")
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so that the addresses of the same page compare equal.
+
+    The scheme and host are lowercased, `www.`, the fragment, tracking parameters and the
+    trailing slash are removed, and the remaining query parameters are sorted.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not _TRACKING_PARAMETERS.match(key)
+        )
+    )
+    return urlunsplit(
+        (parts.scheme.lower(), host, parts.path.rstrip("/") or "/", query, "")
+    )
+
+
+def simhash(text: str) -> Optional[int]:
+    """Return the 64-bit SimHash fingerprint of the word shingles of a text.
+
+    Shingles are hashed with the built-in `hash`, so fingerprints are only comparable
+    within a process.
+
+    Returns:
+        Optional[int]: The fingerprint, or None for texts too short to be fingerprinted.
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < MIN_SIMHASH_WORDS:
+        return None
+    count = len(words) - SHINGLE_SIZE + 1
+    hashes = np.fromiter(
+        (
+            hash(" ".join(words[i : i + SHINGLE_SIZE])) & 0xFFFFFFFFFFFFFFFF
+            for i in range(count)
+        ),
+        dtype=np.uint64,
+        count=count,
+    )
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(count, 64)
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > count
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+@dataclass
+class DeduplicationResult:
+    """The canonical documents and how many duplicates they replace."""
+
+    documents: list[Document]
+    url_duplicates: int = 0
+    near_duplicates: int = 0
+
+    @property
+    def suppressed(self) -> int:
+        return self.url_duplicates + self.near_duplicates
+
+
+def _best_score(doc: Document) -> float:
+    return max(
+        (doc.metadata[key] for key in _SCORE_KEYS if key in doc.metadata),
+        default=float("-inf"),
+    )
+
+
+def _canonical(group: list[Document]) -> Document:
+    best = max(group, key=_best_score)
+    if len(group) == 1:
+        return best
+    metadata = dict(best.metadata)
+    for key in _SCORE_KEYS:
+        scores = [doc.metadata[key] for doc in group if key in doc.metadata]
+        if scores:
+            metadata[key] = max(scores)
+    for key in _MERGED_LIST_KEYS:
+        merged = list(
+            dict.fromkeys(value for doc in group for value in doc.metadata.get(key, ()))
+        )
+        if merged:
+            metadata[key] = merged
+    return best.model_copy(update={"metadata": metadata})
+
+
+def deduplicate_documents(
+    documents: Sequence[Document], max_distance: int = 8
+) -> DeduplicationResult:
+    """Collapse the duplicates of a list of documents into canonical documents.
+
+    Args:
+        documents (Sequence[Document]): The documents, in retrieval order.
+        max_distance (int): The maximum number of differing SimHash bits of near-duplicates.
+            A negative value disables near-duplicate detection.
+
+    Returns:
+        DeduplicationResult: The canonical documents, in the order of the first document of
+        their group, and the number of duplicates suppressed.
+    """
+    result = DeduplicationResult(documents=[])
+    groups: list[list[Document]] = []
+    by_url: dict[str, int] = {}
+    fingerprints: list[tuple[int, int]] = []
+    for doc in documents:
+        url = doc.metadata.get("source")
+        url_key = (
+            canonical_url(url)
+            if url and "web" in doc.metadata.get("retrieval_sources", ())
+            else None
+        )
+        if url_key is not None and url_key in by_url:
+            groups[by_url[url_key]].append(doc)
+            result.url_duplicates += 1
+            continue
+
+        fingerprint = simhash(doc.page_content) if max_distance >= 0 else None
+        group = None
+        if fingerprint is not None:
+            group = next(
+                (
+                    index
+                    for other, index in fingerprints
+                    if (fingerprint ^ other).bit_count() <= max_distance
+                ),
+                None,
+            )
+        if group is not None:
+            groups[group].append(doc)
+            result.near_duplicates += 1
+        else:
+            group = len(groups)
+            groups.append([doc])
+            if fingerprint is not None:
+                fingerprints.append((fingerprint, group))
+        if url_key is not None:
+            by_url[url_key] = group
+
+    result.documents = [_canonical(group) for group in groups]
+    return result
+
+
+class DeduplicationStats:
+    """Counters of the documents deduplicated per turn."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.documents_in = 0
+        self.documents_out = 0
+        self.url_duplicates = 0
+        self.near_duplicates = 0
+        self.last_turn_suppressed = 0
+
+    def record(self, documents_in: int, result: DeduplicationResult) -> None:
+        with self._lock:
+            self.turns += 1
+            self.documents_in += documents_in
+            self.documents_out += len(result.documents)
+            self.url_duplicates += result.url_duplicates
+            self.near_duplicates += result.near_duplicates
+            self.last_turn_suppressed = result.suppressed
+
+    def stats(self) -> dict[str, int]:
+        """Return a copy of the counters."""
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "documents_in": self.documents_in,
+                "documents_out": self.documents_out,
+                "url_duplicates": self.url_duplicates,
+                "near_duplicates": self.near_duplicates,
+                "last_turn_suppressed": self.last_turn_suppressed,
+            }
+
+
+deduplication_stats = DeduplicationStats()
+register_stats("document_dedup", deduplication_stats.stats)
@@ -6,34 +6,181 @@ and key functions for processing & routing user queries, generating research pla
 conducting research, and formulating responses.
 """
 
+import asyncio
+import dataclasses
+import logging
+import time
 from typing import Literal, TypedDict, cast, Union
 
-from langchain_core.messages import BaseMessage
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, AnyMessage, BaseMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END, START, StateGraph
-from langgraph.types import Command
+from langgraph.types import Command, Send
 
+from backend.retrieval_graph import dedup, history, rerank
+from backend.retrieval_graph.answer_cache import get_answer_cache
 from backend.retrieval_graph.configuration import AgentConfiguration
+from backend.retrieval_graph.context_packer import pack_context
 from backend.retrieval_graph.researcher_graph.graph import graph as researcher_graph
+from backend.retrieval_graph.router_classifier import (
+    LLM_ONLY_LABELS,
+    get_router_classifier,
+    log_router_decision,
+)
 from backend.retrieval_graph.pet_manager.filter_graph import graph as pet_filter_graph
+from backend.retrieval_graph.pet_manager.speculation import SpeculativePetResolution
 from backend.retrieval_graph.state import (
     AgentState,
+    CachedAnswerState,
     InputState,
     Router,
     Pet,
+    ResearchStepState,
 )
-from backend.utils import format_docs, load_chat_model
+from backend.token_counter import get_token_counter
+from backend.utils import format_docs, get_last_human_message_text, load_chat_model
+
+logger = logging.getLogger(__name__)
+
+
+def _conversation(
+    state: AgentState, configuration: AgentConfiguration, model: str = ""
+) -> list[AnyMessage]:
+    """Return the token-bounded view of the conversation sent to a language model.
+
+    The history is counted with the tokenizer of `model`, the query model by default.
+    """
+    return history.history_view(
+        state.messages,
+        state.summary,
+        state.summarized_messages,
+        configuration.history_max_tokens,
+        get_token_counter(model or configuration.query_model),
+    ).messages
+
+
+def _is_first_question(messages: list[AnyMessage]) -> bool:
+    """Whether the last message of the user is the first one of the thread."""
+    return sum(message.type == "human" for message in messages) == 1
+
+
+background_summaries = history.BackgroundSummaries()
+
+
+async def _summarize(
+    summary: str,
+    messages: list[AnyMessage],
+    start: int,
+    end: int,
+    configuration: AgentConfiguration,
+) -> Union[history.SummaryRefresh, None]:
+    """Fold the messages leaving the verbatim window into the summary, with the query model.
+
+    Only the previous summary and the new turns to summarize are sent. A failed refresh is
+    started again by the next turn, the token budget of the history views bounds the
+    prompts meanwhile.
+    """
+    model = load_chat_model(configuration.query_model)
+    system_prompt = configuration.summarize_conversation_system_prompt.format(
+        summary=summary
+    )
+    begin = time.perf_counter()
+    try:
+        response = await model.ainvoke(
+            [
+                {"role": "system", "content": system_prompt},
+                HumanMessage(history.format_transcript(messages)),
+            ],
+            {"tags": ["langsmith:nostream"]},
+        )
+    except Exception:
+        logger.warning("Failed to refresh the conversation summary", exc_info=True)
+        return None
+    history.history_stats.record_summary(end - start, time.perf_counter() - begin)
+    return history.SummaryRefresh(start=start, end=end, summary=response.content)
+
+
+def _refresh_summary(
+    state: AgentState, configuration: AgentConfiguration, config: RunnableConfig
+) -> dict[str, Union[str, int]]:
+    """Adopt the summary refreshed since the last turn, and start the next refresh.
+
+    The summary is refreshed in the background, so no turn waits for the query model: the
+    turns leaving the verbatim window are folded into the summary by a later turn. Only
+    threads, whose state outlives the turn, are summarized.
+
+    Returns:
+        dict[str, Union[str, int]]: The 'summary' and 'summarized_messages' updates of the
+        state, empty when no refreshed summary is adopted.
+    """
+    history.history_stats.record_turn()
+    thread_id = config.get("configurable", {}).get("thread_id")
+    if thread_id is None:
+        return {}
+    thread_id = str(thread_id)
+    update: dict[str, Union[str, int]] = {}
+    refresh = background_summaries.pop(thread_id)
+    if refresh is not None and refresh.start == state.summarized_messages:
+        update = {"summary": refresh.summary, "summarized_messages": refresh.end}
+    summary = update.get("summary", state.summary)
+    # The current question is not a previous turn.
+    start, end = history.summary_range(
+        state.messages[:-1],
+        update.get("summarized_messages", state.summarized_messages),
+        configuration.history_max_turns,
+    )
+    if start < end:
+        background_summaries.start(
+            thread_id,
+            _summarize(summary, state.messages[start:end], start, end, configuration),
+        )
+    return update
+
+
+def _route_locally(
+    state: AgentState, configuration: AgentConfiguration
+) -> Union[Router, None]:
+    """Classify the question with the local router classifier, if it is confident enough.
+
+    The classifier only sees the question, so follow-up questions, which may depend on
+    the earlier turns, are left to the LLM router. So are the `more-info` and `general`
+    decisions, whose logic is used to answer the user.
+    """
+    if not configuration.router_model_path or not _is_first_question(state.messages):
+        return None
+    classifier = get_router_classifier(configuration.router_model_path)
+    if classifier is None:
+        return None
+    label, confidence = classifier.predict(get_last_human_message_text(state.messages))
+    if (
+        label in LLM_ONLY_LABELS
+        or confidence < configuration.router_confidence_threshold
+    ):
+        return None
+    return Router(
+        type=label,
+        logic=f"The question was classified as '{label}' with a confidence of {confidence:.2f}.",
+    )
 
 
 async def analyze_and_route_query(
     state: AgentState, *, config: RunnableConfig
 ) -> Command[
-    Literal["get_and_update_pet_info", "ask_for_more_info", "respond_to_general_query"]
+    Literal[
+        "get_and_update_pet_info",
+        "lookup_cached_answer",
+        "ask_for_more_info",
+        "respond_to_general_query",
+    ]
 ]:
     """Analyze the user's query and determine the appropriate routing.
 
     This function uses a language model to classify the user's query and decide how to route it
-    within the conversation flow.
+    within the conversation flow. With speculative pet resolution, the pets are resolved while
+    the language model classifies the query: the routes needing them then skip
+    `get_and_update_pet_info`, and the other routes cancel the resolution. The conversation
+    summary refreshed in the background since the last turn is adopted first.
 
     Args:
         state (AgentState): The current state of the agent, including conversation history.
@@ -44,16 +191,42 @@ async def analyze_and_route_query(
     """
 
     configuration = AgentConfiguration.from_runnable_config(config)
-    model = load_chat_model(configuration.query_model)
-
-    messages = [
-        {"role": "system", "content": configuration.router_system_prompt}
-    ] + state.messages
-
-    router = cast(
-        Router,
-        await model.with_structured_output(Router).ainvoke(messages),
-    )
+    summary_update = _refresh_summary(state, configuration, config)
+    if summary_update:
+        state = dataclasses.replace(state, **summary_update)
+    router = _route_locally(state, configuration)
+    speculation = None
+    if router is None:
+        model = load_chat_model(configuration.query_model)
+        conversation = _conversation(state, configuration)
+
+        messages = [
+            {"role": "system", "content": configuration.router_system_prompt}
+        ] + conversation
+
+        if configuration.speculative_pet_resolution:
+            speculation = SpeculativePetResolution(conversation, state.pets)
+        start = time.perf_counter()
+        try:
+            router = cast(
+                Router,
+                await model.with_structured_output(Router).ainvoke(messages),
+            )
+        except BaseException:
+            if speculation is not None:
+                await speculation.cancel()
+            raise
+        # Follow-up questions are not logged, the local classifier never routes them.
+        if configuration.router_decision_log_path and _is_first_question(
+            state.messages
+        ):
+            await asyncio.to_thread(
+                log_router_decision,
+                configuration.router_decision_log_path,
+                get_last_human_message_text(state.messages),
+                router,
+                (time.perf_counter() - start) * 1000,
+            )
 
     goto = None
     match router["type"]:
@@ -68,8 +241,16 @@ async def analyze_and_route_query(
         case _:
             goto = "respond_to_general_query"
 
+    update = {"router": router, **summary_update}
+    if speculation is not None:
+        if goto == "get_and_update_pet_info":
+            update["pets"] = await speculation.adopt(config)
+            goto = "lookup_cached_answer"
+        else:
+            await speculation.cancel()
+
     return Command(
-        update={"router": router},
+        update=update,
         goto=goto,
     )
 
@@ -93,7 +274,9 @@ async def ask_for_more_info(
     system_prompt = configuration.more_info_system_prompt.format(
         logic=state.router["logic"]
     )
-    messages = [{"role": "system", "content": system_prompt}] + state.messages
+    messages = [{"role": "system", "content": system_prompt}] + _conversation(
+        state, configuration
+    )
     response = await model.ainvoke(messages)
     return {"messages": [response]}
 
@@ -117,7 +300,9 @@ async def respond_to_general_query(
     system_prompt = configuration.general_system_prompt.format(
         logic=state.router["logic"]
     )
-    messages = [{"role": "system", "content": system_prompt}] + state.messages
+    messages = [{"role": "system", "content": system_prompt}] + _conversation(
+        state, configuration
+    )
     response = await model.ainvoke(messages)
     return {"messages": [response]}
 
@@ -129,11 +314,87 @@ async def get_and_update_pet_info(
 ) -> dict[str, list[Pet]]:
     """filter and update pet info."""
 
-    response = await pet_filter_graph.ainvoke({"messages": state.messages})
+    configuration = AgentConfiguration.from_runnable_config(config)
+    response = await pet_filter_graph.ainvoke(
+        {"messages": _conversation(state, configuration), "last_pets": state.pets}
+    )
     target_pets = response.get("result_pets", [])
     return {"pets": target_pets}
 
 
+def _answer_cacheable(state: AgentState, configuration: AgentConfiguration) -> bool:
+    """Whether the answer of the turn can come from, or go to, the answer cache.
+
+    The cache is keyed by the question alone, so only the first question of a thread,
+    which does not depend on earlier turns, is looked up and stored.
+    """
+    return (
+        configuration.answer_cache_enabled
+        and bool(state.pets)
+        and _is_first_question(state.messages)
+    )
+
+
+async def lookup_cached_answer(
+    state: AgentState, *, config: RunnableConfig
+) -> Command[Literal["create_research_plan", "emit_cached_answer"]]:
+    """Look the user's question up in the semantic answer cache.
+
+    On a hit the research is skipped and the cached answer is emitted with its sources.
+
+    Args:
+        state (AgentState): The current state of the agent, including the conversation and the pets.
+        config (RunnableConfig): Configuration with the answer cache settings.
+
+    Returns:
+        Command[Literal["create_research_plan", "emit_cached_answer"]]: A command routing to the research
+        plan on a miss, or sending the cached answer to `emit_cached_answer` on a hit.
+    """
+    configuration = AgentConfiguration.from_runnable_config(config)
+    if not _answer_cacheable(state, configuration):
+        return Command(goto="create_research_plan")
+
+    cache = get_answer_cache(
+        configuration.answer_cache_backend,
+        configuration.answer_cache_path,
+        configuration.answer_cache_max_entries,
+    )
+    cached = await cache.alookup(
+        get_last_human_message_text(state.messages),
+        state.pets[0],
+        threshold=configuration.answer_cache_similarity_threshold,
+        ttl_seconds=configuration.answer_cache_ttl_seconds,
+    )
+    if cached is None:
+        return Command(goto="create_research_plan")
+
+    return Command(
+        update={"steps": [], "documents": "delete"},
+        goto=Send(
+            "emit_cached_answer",
+            CachedAnswerState(answer=cached.answer, sources=cached.sources),
+        ),
+    )
+
+
+async def emit_cached_answer(
+    state: CachedAnswerState,
+) -> dict[str, Union[list[BaseMessage], list[Document], str]]:
+    """Emit a cached answer together with the documents it was based on.
+
+    Args:
+        state (CachedAnswerState): The cached answer and its sources.
+
+    Returns:
+        dict: A dictionary with the 'messages', 'answer' and 'documents' keys.
+    """
+    return {
+        "messages": [AIMessage(content=state.answer)],
+        "answer": state.answer,
+        "documents": [Document(**source) for source in state.sources],
+    }
+
+
 async def create_research_plan(
     state: AgentState, *, config: RunnableConfig
 ) -> dict[str, Union[list[str], str]]:
@@ -166,7 +427,7 @@ async def create_research_plan(
             "role": "ai",
             "content": f"<pet-information> {state.pets[0] if state.pets else 'no pet found information'} </pet-information>",
         },
-    ] + state.messages
+    ] + _conversation(state, configuration)
     response = cast(
         Plan, await model.ainvoke(messages, {"tags": ["langsmith:nostream"]})
     )
@@ -178,28 +439,45 @@ async def create_research_plan(
 
 
 async def conduct_research(
-    state: AgentState,
-) -> Command[Literal["respond"]]:
-    """Execute the first step of the research plan.
+    state: AgentState, *, config: RunnableConfig
+) -> Command[Literal["deduplicate_documents"]]:
+    """Execute the research plan.
+
+    In 'sequential' research mode this function takes the first step from the research plan and
+    uses it to conduct research. In 'parallel' research mode it sends up to
+    `max_concurrent_research_steps` steps to the `research_step` node at once.
 
-    This function takes the first step from the research plan and uses it to conduct research.
-    
     Args:
         state (AgentState): The current state of the agent, including the research plan steps.
+        config (RunnableConfig): Configuration with the research mode and concurrency limit.
 
     Returns:
-        Command[Literal["respond"]]: A command to update the state with the retrieved documents and removes the completed step.
+        Command[Literal["deduplicate_documents"]]: A command to update the state with the retrieved documents and removes the completed step.
         If add conduct_research to the literal, error will occur. Could be a bug.
 
     Behavior:
-        - Invokes the researcher_graph with the first step of the research plan.
-        - Updates the state with the retrieved documents and removes the completed step.
+        - Invokes the researcher_graph with the first step of the research plan, or fans the steps out to `research_step`.
+        - Updates the state with the retrieved documents and removes the completed or dispatched steps.
     """
 
     if len(state.steps) == 0:
         return Command(
             update={"documents": [], "steps": []},
-            goto="respond",
+            goto="deduplicate_documents",
+        )
+
+    configuration = AgentConfiguration.from_runnable_config(config)
+    if configuration.research_mode == "parallel":
+        # Each step runs as its own task, so every researcher_graph invocation gets its own
+        # checkpoint namespace. LangGraph applies the writes of the tasks in the order of the
+        # sends, which keeps the merge through reduce_docs deterministic in plan order.
+        batch_size = max(1, configuration.max_concurrent_research_steps)
+        return Command(
+            update={"steps": state.steps[batch_size:]},
+            goto=[
+                Send("research_step", ResearchStepState(step=step, pet=state.pets[0]))
+                for step in state.steps[:batch_size]
+            ],
         )
 
     result = await researcher_graph.ainvoke(
@@ -212,6 +490,19 @@ async def conduct_research(
     )
 
 
+async def research_step(state: ResearchStepState) -> dict[str, list[Document]]:
+    """Research a single step of the plan with the researcher graph.
+
+    Args:
+        state (ResearchStepState): The step to research and the pet it is researched for.
+
+    Returns:
+        dict[str, list[Document]]: A dictionary with a 'documents' key containing the retrieved documents.
+    """
+    result = await researcher_graph.ainvoke({"question": state.step, "pet": state.pet})
+    return {"documents": result["documents"]}
+
+
 def check_finished(state: AgentState) -> Literal["respond", "conduct_research"]:
     """Determine if the research process is complete or if more research is needed.
 
@@ -231,6 +522,61 @@ def check_finished(state: AgentState) -> Literal["respond", "conduct_research"]:
         return "respond"
 
 
+def deduplicate_documents(
+    state: AgentState, *, config: RunnableConfig
+) -> dict[str, list[Document]]:
+    """Suppress the duplicates among the documents retrieved by the research queries.
+
+    Web results with the same URL and near-duplicate documents are collapsed into one
+    canonical document, keeping the best score and every query that found it.
+
+    Args:
+        state (AgentState): The current state of the agent, including the retrieved documents.
+        config (RunnableConfig): Configuration with the near-duplicate distance.
+
+    Returns:
+        dict[str, list[Document]]: A dictionary with a 'context_documents' key containing the canonical documents.
+    """
+    configuration = AgentConfiguration.from_runnable_config(config)
+    result = dedup.deduplicate_documents(
+        state.documents, configuration.near_duplicate_max_distance
+    )
+    dedup.deduplication_stats.record(len(state.documents), result)
+    logger.debug(
+        "Suppressed %d duplicate documents of %d (%d by URL, %d near-duplicates)",
+        result.suppressed,
+        len(state.documents),
+        result.url_duplicates,
+        result.near_duplicates,
+    )
+    return {"context_documents": result.documents}
+
+
+def rerank_documents(
+    state: AgentState, *, config: RunnableConfig
+) -> dict[str, list[Document]]:
+    """Order the retrieved documents by their relevance to the question and to their plan step.
+
+    The documents arrive in the order the research branches finished in. They are reranked
+    with a BM25 index built over them, before `respond` keeps the best of them.
+
+    Args:
+        state (AgentState): The current state of the agent, including the deduplicated documents.
+        config (RunnableConfig): Configuration with the weight of the plan step.
+
+    Returns:
+        dict[str, list[Document]]: A dictionary with a 'context_documents' key containing the reranked documents.
+    """
+    configuration = AgentConfiguration.from_runnable_config(config)
+    return {
+        "context_documents": rerank.rerank_by_relevance(
+            get_last_human_message_text(state.messages),
+            state.context_documents,
+            step_weight=configuration.rerank_step_weight,
+        )
+    }
+
+
 async def respond(
     state: AgentState, *, config: RunnableConfig
 ) -> dict[str, Union[list[BaseMessage], str]]:
@@ -249,8 +595,17 @@ async def respond(
     configuration = AgentConfiguration.from_runnable_config(config)
     model = load_chat_model(configuration.response_model)
 
-    top_k = 20
-    context = format_docs(state.documents[:top_k])
+    packed = pack_context(
+        get_last_human_message_text(state.messages),
+        state.context_documents,
+        configuration.context_token_budget_by_model.get(
+            configuration.response_model, configuration.context_token_budget
+        ),
+        max_documents=configuration.context_max_documents,
+        max_tokens_per_document=configuration.context_max_tokens_per_document,
+        ranked=True,
+    )
+    context = format_docs(packed.documents)
     prompt = configuration.response_system_prompt.format(context=context)
     messages = [
         {"role": "system", "content": prompt},
@@ -258,8 +613,22 @@ async def respond(
             "role": "ai",
             "content": f"<pet-information> {state.pets[0] if state.pets else 'no pet found information'} </pet-information>",
         },
-    ] + state.messages
+    ] + _conversation(state, configuration, configuration.response_model)
     response = await model.ainvoke(messages)
+
+    if _answer_cacheable(state, configuration) and packed.sources:
+        cache = get_answer_cache(
+            configuration.answer_cache_backend,
+            configuration.answer_cache_path,
+            configuration.answer_cache_max_entries,
+        )
+        await cache.astore(
+            get_last_human_message_text(state.messages),
+            state.pets[0],
+            response.content,
+            packed.sources,
+        )
+
     return {"messages": [response], "answer": response.content}
 
 
@@ -270,15 +639,24 @@ builder.add_node(analyze_and_route_query)
 builder.add_node(ask_for_more_info)
 builder.add_node(respond_to_general_query)
 builder.add_node(get_and_update_pet_info)
+builder.add_node(lookup_cached_answer)
+builder.add_node(emit_cached_answer)
 builder.add_node(create_research_plan)
 builder.add_node(conduct_research)
+builder.add_node(research_step)
+builder.add_node(deduplicate_documents)
+builder.add_node(rerank_documents)
 builder.add_node(respond)
 
 builder.add_edge(START, "analyze_and_route_query")
 builder.add_edge("ask_for_more_info", END)
 builder.add_edge("respond_to_general_query", END)
-builder.add_edge("get_and_update_pet_info", "create_research_plan")
+builder.add_edge("get_and_update_pet_info", "lookup_cached_answer")
+builder.add_edge("emit_cached_answer", END)
 builder.add_edge("create_research_plan", "conduct_research")
+builder.add_edge("research_step", "conduct_research")
+builder.add_edge("deduplicate_documents", "rerank_documents")
+builder.add_edge("rerank_documents", "respond")
 builder.add_edge("respond", END)
 
 # Compile into a graph object that you can invoke and deploy.
@@ -0,0 +1,264 @@
+"""Compaction of the conversation history sent to the language models.
+
+Every LLM call of a turn (the router, the pet filters, the research planner and the
+response) gets the conversation as context. Sent whole, the prompts of a long thread grow
+without bound. The history is compacted instead:
+
+- the last turns of the conversation are kept verbatim, a turn being a human message and
+  the messages answering it;
+- older turns are folded into a rolling summary kept in the state. The summary is
+  refreshed in a background task, from the previous summary and the turns that left the
+  verbatim window only, and adopted by a later turn of the thread once it is done, so no
+  turn waits for it;
+- the view of the history given to a node is the summary followed by the turns not yet
+  summarized, and its oldest turns are dropped when it exceeds a token budget counted
+  with the token counter of the node's model. The current question is always sent.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Coroutine, Optional, Sequence
+
+from langchain_core.messages import AIMessage, AnyMessage
+
+from backend.metrics import register_stats
+from backend.token_counter import TokenCounter, get_token_counter
+from backend.utils import get_message_text
+
+logger = logging.getLogger(__name__)
+
+_TRANSCRIPT_ROLES = {"human": "User", "ai": "Assistant"}
+
+
+def turn_starts(messages: Sequence[AnyMessage]) -> list[int]:
+    """Return the index of the first message of every turn of a conversation.
+
+    A turn starts at a human message. Messages before the first human message belong to
+    the first turn.
+    """
+    starts = [i for i, message in enumerate(messages) if message.type == "human"]
+    if messages and (not starts or starts[0]):
+        starts.insert(0, 0)
+    return starts
+
+
+def summary_message(summary: str) -> AIMessage:
+    """Wrap a conversation summary in a message put before the verbatim turns."""
+    return AIMessage(
+        content=f"<conversation-summary> {summary} </conversation-summary>"
+    )
+
+
+def format_transcript(messages: Sequence[AnyMessage]) -> str:
+    """Format the user and assistant messages of a conversation as a plain transcript."""
+    return "\n\n".join(
+        f"{_TRANSCRIPT_ROLES[message.type]}: {get_message_text(message)}"
+        for message in messages
+        if message.type in _TRANSCRIPT_ROLES
+    )
+
+
+def summary_range(
+    messages: Sequence[AnyMessage], summarized_messages: int, max_turns: int
+) -> tuple[int, int]:
+    """Return the messages to fold into the summary to keep `max_turns` turns verbatim.
+
+    Args:
+        messages (Sequence[AnyMessage]): The conversation.
+        summarized_messages (int): The number of messages already covered by the summary.
+        max_turns (int): The number of last turns kept verbatim. A negative value disables
+            the summary.
+
+    Returns:
+        tuple[int, int]: The start and end indexes of the messages to summarize, equal
+        when there is nothing to summarize.
+    """
+    start = min(summarized_messages, len(messages))
+    if max_turns < 0:
+        return start, start
+    starts = turn_starts(messages)
+    if len(starts) <= max_turns:
+        return start, start
+    end = starts[-max_turns] if max_turns else len(messages)
+    return start, max(start, end)
+
+
+@dataclass
+class HistoryView:
+    """The history sent to a language model, and what it saves over the whole history."""
+
+    messages: list[AnyMessage]
+    tokens: int
+    tokens_full: int
+    """The tokens of the whole conversation."""
+    dropped_turns: int = 0
+    """The turns neither summarized nor sent, for the view to fit the token budget."""
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_full - self.tokens)
+
+
+class HistoryStats:
+    """Counters of the history views, of the tokens they save and of the summaries."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.views = 0
+        self.tokens_full = 0
+        self.tokens_sent = 0
+        self.dropped_turns = 0
+        self.turns = 0
+        self.summaries = 0
+        self.summarized_messages = 0
+        self.summary_seconds_total = 0.0
+
+    def record_view(self, view: HistoryView) -> None:
+        with self._lock:
+            self.views += 1
+            self.tokens_full += view.tokens_full
+            self.tokens_sent += view.tokens
+            self.dropped_turns += view.dropped_turns
+
+    def record_turn(self) -> None:
+        with self._lock:
+            self.turns += 1
+
+    def record_summary(self, messages: int, seconds: float) -> None:
+        with self._lock:
+            self.summaries += 1
+            self.summarized_messages += messages
+            self.summary_seconds_total += seconds
+
+    def stats(self) -> dict[str, float]:
+        """Return a copy of the counters, and the tokens saved per turn."""
+        with self._lock:
+            tokens_saved = self.tokens_full - self.tokens_sent
+            return {
+                "views": self.views,
+                "tokens_full": self.tokens_full,
+                "tokens_sent": self.tokens_sent,
+                "tokens_saved": tokens_saved,
+                "tokens_saved_per_turn": tokens_saved / self.turns
+                if self.turns
+                else 0.0,
+                "dropped_turns": self.dropped_turns,
+                "turns": self.turns,
+                "summaries": self.summaries,
+                "summarized_messages": self.summarized_messages,
+                "summary_seconds_total": self.summary_seconds_total,
+            }
+
+
+history_stats = HistoryStats()
+register_stats("history", history_stats.stats)
+
+
+def history_view(
+    messages: Sequence[AnyMessage],
+    summary: str = "",
+    summarized_messages: int = 0,
+    max_tokens: int = 0,
+    counter: Optional[TokenCounter] = None,
+) -> HistoryView:
+    """Build the token-bounded view of a conversation given to a language model.
+
+    Args:
+        messages (Sequence[AnyMessage]): The conversation.
+        summary (str): The rolling summary of the first messages of the conversation.
+        summarized_messages (int): The number of messages covered by the summary.
+        max_tokens (int): The token budget of the view, 0 for no budget. The oldest turns
+            are dropped until the view fits, except for the current one.
+        counter (Optional[TokenCounter]): The token counter of the model the view is sent
+            to, the default one if None.
+
+    Returns:
+        HistoryView: The summary and the turns not covered by it.
+    """
+    counter = counter or get_token_counter()
+    covered = min(summarized_messages, len(messages)) if summary else 0
+    head = [summary_message(summary)] if summary else []
+    head_tokens = counter.count_messages(head)
+    verbatim = messages[covered:]
+    kept = (
+        counter.budget(verbatim, max(1, max_tokens - head_tokens))
+        if max_tokens > 0
+        else list(verbatim)
+    )
+
+    view = HistoryView(
+        messages=head + kept,
+        tokens=head_tokens + counter.count_messages(kept),
+        tokens_full=counter.count_messages(messages),
+        dropped_turns=len(turn_starts(verbatim[: len(verbatim) - len(kept)])),
+    )
+    history_stats.record_view(view)
+    if view.dropped_turns:
+        logger.debug(
+            "Dropped %d turns over the history budget of %d tokens",
+            view.dropped_turns,
+            max_tokens,
+        )
+    return view
+
+
+@dataclass
+class SummaryRefresh:
+    """A summary of the conversation refreshed in the background."""
+
+    start: int
+    """The number of messages covered by the summary the refresh started from."""
+    end: int
+    """The number of messages covered by the refreshed summary."""
+    summary: str
+
+
+class BackgroundSummaries:
+    """The summary refreshes running in the background, by conversation thread.
+
+    A turn starts the refresh of its thread and returns without waiting for it. A later
+    turn of the thread adopts the refreshed summary if the refresh is done by then. The
+    refreshes are kept in the process, threads whose next turn is handled by another
+    process refresh their summary again.
+
+    Args:
+        max_threads (int): The maximum number of threads whose refresh is kept, the
+            oldest ones are cancelled beyond.
+    """
+
+    def __init__(self, max_threads: int = 1024) -> None:
+        self.max_threads = max_threads
+        self._tasks: OrderedDict[str, asyncio.Task] = OrderedDict()
+
+    def start(
+        self, thread_id: str, refresh: Coroutine[Any, Any, Optional[SummaryRefresh]]
+    ) -> bool:
+        """Run the refresh of a thread in the background, unless one is already running.
+
+        Returns:
+            bool: Whether the refresh was started.
+        """
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(thread_id)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            refresh.close()
+            return False
+        self._tasks[thread_id] = loop.create_task(refresh)
+        self._tasks.move_to_end(thread_id)
+        while len(self._tasks) > self.max_threads:
+            _, oldest = self._tasks.popitem(last=False)
+            oldest.cancel()
+        return True
+
+    def pop(self, thread_id: str) -> Optional[SummaryRefresh]:
+        """Return the refreshed summary of a thread once its refresh is done."""
+        task = self._tasks.get(thread_id)
+        if task is None or not task.done():
+            return None
+        del self._tasks[thread_id]
+        if task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
@@ -2,21 +2,24 @@
 This graph is used to filter the pets specified by the user from the store before the research.
 
 1. Get all the pets recorded in the database.
-2. Filter the pets recorded in the database.
-3. Filter the pets not recorded in the database.
-4. Add the new pets to the database.
-5. Assemble the filtered pets.
+2. Try to resolve the pets locally, skip to 6. if resolved.
+3. Filter the pets recorded in the database.
+4. Filter the pets not recorded in the database.
+5. Add the new pets to the database, unless the writes are left to the caller.
+6. Assemble the filtered pets.
 """
 
-from typing import List, Dict, cast
+from typing import List, Dict, Literal, cast
 from dataclasses import dataclass, field
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
+from langgraph.types import Command
 from langchain_core.messages import SystemMessage, AIMessage
 
 from backend.retrieval_graph.configuration import AgentConfiguration
 from backend.retrieval_graph.state import InputState, Pet, PetList
 from backend.retrieval_graph.pet_manager.tools import get_pets, add_or_update_pet
+from backend.retrieval_graph.pet_manager.resolver import pet_resolver
 from backend.utils import load_chat_model
 from backend.prompts_local.en import (
     FILTER_PETS_RECORDED_SYSTEM_PROMPT_STR,
@@ -29,6 +32,9 @@ from backend.prompts_local.en import (
 class PetInformationFilterState(InputState):
     """State of the pet information filter graph."""
 
+    last_pets: List[Pet] = field(default_factory=list)
+    """The pets resolved on the previous turn, used for pronoun carry-over."""
+
     pets_recorded: List[Dict] = field(default_factory=list)
 
     target_pets_recorded: List[Dict] = field(default_factory=list)
@@ -37,6 +43,9 @@ class PetInformationFilterState(InputState):
 
     result_pets: List[Pet] = field(default_factory=list)
 
+    write_new_pets: bool = True
+    """Whether the new pets are added to the store, or left to the caller with `store_new_pets`."""
+
 
 async def get_all_recorded_pets(
     state: PetInformationFilterState,
@@ -50,6 +59,33 @@ async def get_all_recorded_pets(
     return {"pets_recorded": pets}
 
 
+async def resolve_pets_locally(
+    state: PetInformationFilterState,
+    *,
+    config: RunnableConfig,
+) -> Command[Literal["filter_pets_recorded", "assembile_filter_pets"]]:
+    """Resolve the pets specified by the user by matching against the recorded pets.
+
+    Falls back to the LLM filters when the match is ambiguous, mentions a new animal
+    or carries new information about a pet.
+    """
+
+    configuration = AgentConfiguration.from_runnable_config(config)
+    if not configuration.local_pet_resolution:
+        return Command(goto="filter_pets_recorded")
+
+    resolution = pet_resolver.resolve(
+        state.messages, state.pets_recorded, state.last_pets
+    )
+    if resolution.needs_llm:
+        return Command(goto="filter_pets_recorded")
+
+    return Command(
+        update={"target_pets_recorded": resolution.pets, "new_pets": []},
+        goto="assembile_filter_pets",
+    )
+
+
 async def filter_pets_recorded(
     state: PetInformationFilterState,
     *,
@@ -102,6 +138,17 @@ async def filter_pets_not_recorded(
     return {"new_pets": pet_list.pets}
 
 
+async def store_new_pets(pets: List[Pet], config: RunnableConfig) -> None:
+    """Add the pets with a name and a species to the store with a tool."""
+
+    for pet in pets:
+        is_valid = []
+        for must_have_key in ("name", "species"):
+            is_valid.append(pet.get(must_have_key, "") != "")
+        if all(is_valid):
+            await add_or_update_pet.ainvoke(dict(pet), config=config)
+
+
 async def add_new_pets_to_storage(
     state: PetInformationFilterState,
     *,
@@ -109,12 +156,8 @@ async def add_new_pets_to_storage(
 ) -> Dict:
     """Add the new pets to the store with a tool."""
 
-    for pet in state.new_pets:
-        is_valid = []
-        for must_have_key in ("name", "species"):
-            is_valid.append(pet.get(must_have_key, "") != "")
-        if all(is_valid):
-            await add_or_update_pet.ainvoke(dict(pet), config=config)
+    if state.write_new_pets:
+        await store_new_pets(state.new_pets, config)
     return {}
 
 
@@ -137,13 +180,14 @@ async def assembile_filter_pets(
 builder = StateGraph(PetInformationFilterState)
 
 builder.add_node(get_all_recorded_pets)
+builder.add_node(resolve_pets_locally)
 builder.add_node(filter_pets_recorded)
 builder.add_node(filter_pets_not_recorded)
 builder.add_node(add_new_pets_to_storage)
 builder.add_node(assembile_filter_pets)
 
 builder.add_edge(START, "get_all_recorded_pets")
-builder.add_edge("get_all_recorded_pets", "filter_pets_recorded")
+builder.add_edge("get_all_recorded_pets", "resolve_pets_locally")
 builder.add_edge("filter_pets_recorded", "filter_pets_not_recorded")
 builder.add_edge("filter_pets_not_recorded", "add_new_pets_to_storage")
 builder.add_edge("add_new_pets_to_storage", "assembile_filter_pets")
@@ -1,9 +1,10 @@
 from typing import Annotated
 from langgraph.prebuilt import create_react_agent
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import SystemMessage, trim_messages
+from langchain_core.messages import SystemMessage
 from langchain_core.runnables import RunnableConfig
 
+from backend.token_counter import get_token_counter
 from backend.utils import load_chat_model
 from backend.retrieval_graph.pet_manager.tools import (
     add_or_update_pet,
@@ -21,15 +22,6 @@ tools = [
     delete_pet,
 ]
 
-llm_input_trimmer = trim_messages(
-    # token_counter=count_tokens_approximately,
-    token_counter=len,
-    max_tokens=32,
-    start_on="human",
-    end_on=("human", "tool"),
-    include_system=True,
-)
-
 
 async def get_pet_manager_graph():
     async def prepare_model_inputs(
@@ -37,7 +29,10 @@ async def get_pet_manager_graph():
         *,
         config: RunnableConfig,
     ):
-        messages_trimmed = await llm_input_trimmer.ainvoke(state.get("messages", []))
+        configuration = AgentConfiguration.from_runnable_config(config)
+        messages_trimmed = get_token_counter(configuration.query_model).budget(
+            state.get("messages", []), configuration.history_max_tokens
+        )
 
         prompt = ChatPromptTemplate.from_messages(
             [
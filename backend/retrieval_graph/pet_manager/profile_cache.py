@@ -0,0 +1,152 @@
+"""Read-through cache of the pets of each user, in front of the LangGraph store.
+
+The pets of the user are read on every turn routed to the research, and by the pet
+manager agent, while they rarely change. The cache keeps the pets read from the store
+per user, so that the turns whose pets have not changed do not read the store:
+
+- the pet tools invalidate the pets of a user after writing them. Every invalidation is
+  stamped with a version, and a read that started before the last invalidation of its
+  user is returned but not cached, so a concurrent write is never hidden;
+- writes made by other processes sharing the store are not seen until the pets expire,
+  after a configurable staleness window;
+- the cache holds a bounded number of users, the least recently read ones are evicted
+  first.
+
+The cache assumes that the process uses a single store, as deployed.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from langgraph.store.base import BaseStore
+
+from backend.metrics import register_stats
+
+DEFAULT_MAX_USERS = int(os.environ.get("PET_PROFILE_CACHE_MAX_USERS", "10000"))
+
+
+def pets_namespace(user_id: str) -> tuple[str, str]:
+    """Return the store namespace of the pets of a user."""
+    return ("pets", user_id)
+
+
+class PetProfileCache:
+    """A bounded LRU cache of the pets of each user, invalidated on writes.
+
+    Args:
+        max_users (int): Maximum number of users whose pets are kept.
+    """
+
+    def __init__(self, max_users: int = DEFAULT_MAX_USERS) -> None:
+        if max_users < 1:
+            raise ValueError("Pet profile cache max_users should be at least 1")
+
+        self.max_users = max_users
+        # user_id -> (read at, pets)
+        self._pets: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+        self._version = 0
+        # The version of the last invalidation of each user, only needed while reads that
+        # may have started before it are in flight.
+        self._invalidated: dict[str, int] = {}
+        self._reads_in_flight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.discarded = 0
+        """Reads not cached because their user was invalidated while they ran."""
+        self.evictions = 0
+
+    def _cached(self, user_id: str, ttl_seconds: float) -> Optional[list[dict]]:
+        # Called with the lock held.
+        entry = self._pets.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > ttl_seconds:
+            del self._pets[user_id]
+            self.expired += 1
+            return None
+        self._pets.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def _end_read(self, user_id: str, version: int, pets: Optional[list[dict]]) -> None:
+        with self._lock:
+            self._reads_in_flight -= 1
+            if pets is not None:
+                if self._invalidated.get(user_id, -1) > version:
+                    self.discarded += 1
+                else:
+                    self._pets[user_id] = (time.monotonic(), pets)
+                    self._pets.move_to_end(user_id)
+                    while len(self._pets) > self.max_users:
+                        self._pets.popitem(last=False)
+                        self.evictions += 1
+            if not self._reads_in_flight:
+                self._invalidated.clear()
+
+    async def aget(
+        self, store: BaseStore, user_id: str, ttl_seconds: float
+    ) -> list[dict]:
+        """Return the pets of a user, read from the store on a miss.
+
+        Args:
+            store (BaseStore): The store the pets are read from on a miss.
+            user_id (str): The user.
+            ttl_seconds (float): How long pets read from the store are reused. 0 always
+                reads the store.
+
+        Returns:
+            list[dict]: Copies of the pets of the user, safe to modify.
+        """
+        with self._lock:
+            pets = self._cached(user_id, ttl_seconds) if ttl_seconds > 0 else None
+            if pets is None:
+                self.misses += 1
+                self._reads_in_flight += 1
+                version = self._version
+
+        if pets is None:
+            try:
+                pets = [
+                    item.value for item in await store.asearch(pets_namespace(user_id))
+                ]
+            finally:
+                self._end_read(user_id, version, pets if ttl_seconds > 0 else None)
+        return [dict(pet) for pet in pets]
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop the pets of a user after a write, and stop in-flight reads from caching them."""
+        with self._lock:
+            self._version += 1
+            self._pets.pop(user_id, None)
+            if self._reads_in_flight:
+                self._invalidated[user_id] = self._version
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop the pets of every user."""
+        with self._lock:
+            self._pets.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit/miss counters and the number of users cached."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "discarded": self.discarded,
+                "evictions": self.evictions,
+                "size": len(self._pets),
+                "max_users": self.max_users,
+            }
+
+
+pet_profile_cache = PetProfileCache()
+register_stats("pet_profile_cache", pet_profile_cache.stats)
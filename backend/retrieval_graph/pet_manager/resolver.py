@@ -0,0 +1,298 @@
+"""Deterministic local resolution of the pets a user is talking about.
+
+Most turns simply name a pet that is already recorded ("Milo has been
+scratching a lot") or keep talking about the pet of the previous turn ("she
+still won't eat"). Those cases can be resolved with plain string matching
+against the recorded pets, so the two structured LLM filters of the pet filter
+graph only run when the message is ambiguous, mentions an animal we don't know
+yet, or carries new information about a pet that has to be merged.
+"""
+
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from difflib import get_close_matches
+from typing import Any, Iterable, Optional, Sequence
+
+from langchain_core.messages import AnyMessage
+
+from backend.metrics import register_stats
+from backend.utils import get_last_human_message_text
+
+SPECIES_KEYWORDS: dict[str, frozenset[str]] = {
+    "dog": frozenset(
+        {"dog", "dogs", "doggy", "doggo", "puppy", "puppies", "pup", "pups", "canine"}
+    ),
+    "cat": frozenset({"cat", "cats", "kitty", "kitten", "kittens", "feline"}),
+    "rabbit": frozenset({"rabbit", "rabbits", "bunny", "bunnies"}),
+    "bird": frozenset(
+        {"bird", "birds", "parrot", "budgie", "parakeet", "cockatiel", "canary"}
+    ),
+    "hamster": frozenset({"hamster", "hamsters"}),
+    "guinea pig": frozenset({"guinea"}),
+    "ferret": frozenset({"ferret", "ferrets"}),
+    "fish": frozenset({"fish", "goldfish", "betta"}),
+    "horse": frozenset({"horse", "horses", "pony", "foal"}),
+    "turtle": frozenset({"turtle", "turtles", "tortoise"}),
+    "snake": frozenset({"snake", "snakes", "python"}),
+    "lizard": frozenset({"lizard", "lizards", "gecko", "iguana"}),
+    "rat": frozenset({"rat", "rats"}),
+    "mouse": frozenset({"mouse", "mice"}),
+    "gerbil": frozenset({"gerbil", "gerbils"}),
+    "chinchilla": frozenset({"chinchilla", "chinchillas"}),
+    "hedgehog": frozenset({"hedgehog", "hedgehogs"}),
+}
+
+# "it" and "its" are left out: they refer to anything ("is it safe to...").
+PRONOUNS = frozenset({"he", "him", "his", "she", "her", "hers"})
+
+# Words that refer to an animal without saying which one, they prevent the carry-over.
+ANIMAL_WORDS = frozenset({"animal", "animals", "pet", "pets", "critter", "critters"})
+
+# Popular pet names that are also common words. They only match capitalized, as in
+# "Is Happy eating enough?" but not in "I'm happy with the food", and never fuzzily.
+# Capitalized at the start of a sentence, as in "Will he be ok?", they may be either, so
+# the message goes to the LLM.
+COMMON_WORD_NAMES = frozenset(
+    {
+        "angel",
+        "baby",
+        "bean",
+        "bear",
+        "biscuit",
+        "blue",
+        "boots",
+        "buddy",
+        "button",
+        "chance",
+        "cookie",
+        "duke",
+        "ginger",
+        "happy",
+        "honey",
+        "hunter",
+        "king",
+        "lady",
+        "lucky",
+        "max",
+        "may",
+        "muffin",
+        "patch",
+        "peanut",
+        "pepper",
+        "precious",
+        "princess",
+        "pumpkin",
+        "queen",
+        "rusty",
+        "scout",
+        "shadow",
+        "smokey",
+        "socks",
+        "spot",
+        "sugar",
+        "sunny",
+        "tiger",
+        "will",
+    }
+)
+
+# Words that suggest the user is talking about an animal that is not recorded yet.
+NEW_PET_MARKERS = frozenset(
+    {"new", "another", "adopt", "adopted", "adopting", "rescued", "second"}
+)
+
+# Messages carrying facts about a pet have to go through the LLM so they get merged.
+_UPDATE_PATTERN = re.compile(
+    r"\b\d+(?:\.\d+)?\s*(?:years?|yrs?|months?|weeks?|kg|kgs|kilos?|kilograms?|lbs?|pounds?)\b"
+    r"|\b(?:weighs?|allergic|diagnosed|neutered|spayed|renamed)\b"
+)
+_WORD_PATTERN = re.compile(r"[a-z][a-z'-]*")
+_SENTENCE_END = re.compile(r"(?:^|[.?!])[\s\"'(]*$")
+
+FUZZY_NAME_CUTOFF = 0.85
+FUZZY_NAME_MIN_LENGTH = 4
+
+
+@dataclass
+class PetResolution:
+    """The outcome of a local pet resolution."""
+
+    pets: list[dict[str, Any]] = field(default_factory=list)
+    """The recorded pets the user is talking about, when resolved locally."""
+    needs_llm: bool = False
+    """Whether the LLM pet filters have to run instead."""
+    reason: str = ""
+    """Why the message was, or could not be, resolved locally."""
+
+
+def _species_group(species: Optional[str]) -> Optional[str]:
+    if not species:
+        return None
+    species = species.strip().lower()
+    for group, keywords in SPECIES_KEYWORDS.items():
+        if species == group or species in keywords:
+            return group
+    return species
+
+
+def _contains_phrase(text: str, phrase: str) -> bool:
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def _same_pet(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    return (a.get("name") or "").lower() == (b.get("name") or "").lower() and (
+        _species_group(a.get("species")) == _species_group(b.get("species"))
+    )
+
+
+class PetResolver:
+    """Resolve the pets of a message against the recorded pets without an LLM call.
+
+    The resolver keeps counters of how many messages were resolved on the fast
+    path and how many had to fall back to the LLM filters, broken down by reason.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Counter[str] = Counter()
+
+    def resolve(
+        self,
+        messages: Sequence[AnyMessage],
+        pets_recorded: Sequence[dict[str, Any]],
+        last_pets: Iterable[dict[str, Any]] = (),
+    ) -> PetResolution:
+        """Resolve the pets referenced by the last human message.
+
+        Args:
+            messages (Sequence[AnyMessage]): The conversation, the last human message is resolved.
+            pets_recorded (Sequence[dict[str, Any]]): The pets recorded in the store for the user.
+            last_pets (Iterable[dict[str, Any]]): The pets resolved on the previous turn, used for
+                pronoun carry-over.
+
+        Returns:
+            PetResolution: The resolved pets, or `needs_llm` set when the LLM filters have to run.
+        """
+        resolution = self._resolve(messages, pets_recorded, list(last_pets))
+        with self._lock:
+            self.counters["llm_path" if resolution.needs_llm else "fast_path"] += 1
+            self.counters[f"reason:{resolution.reason}"] += 1
+        return resolution
+
+    def stats(self) -> dict[str, int]:
+        """Return the fast-path and LLM-path counters."""
+        with self._lock:
+            return {
+                "fast_path": self.counters["fast_path"],
+                "llm_path": self.counters["llm_path"],
+                **{
+                    key: value
+                    for key, value in self.counters.items()
+                    if key.startswith("reason:")
+                },
+            }
+
+    def _resolve(
+        self,
+        messages: Sequence[AnyMessage],
+        pets_recorded: Sequence[dict[str, Any]],
+        last_pets: list[dict[str, Any]],
+    ) -> PetResolution:
+        original = get_last_human_message_text(messages)
+        text = original.lower()
+        if not text:
+            return PetResolution(needs_llm=True, reason="no_message")
+
+        if _UPDATE_PATTERN.search(text):
+            return PetResolution(needs_llm=True, reason="update")
+
+        words = _WORD_PATTERN.findall(text)
+        word_set = set(words)
+        if word_set & NEW_PET_MARKERS:
+            return PetResolution(needs_llm=True, reason="new_pet")
+
+        mentioned_species = {
+            group for group, keywords in SPECIES_KEYWORDS.items() if word_set & keywords
+        }
+
+        named, sentence_start = self._match_names(original, words, pets_recorded)
+        if sentence_start:
+            return PetResolution(needs_llm=True, reason="common_word_name")
+        if named:
+            names = {(pet.get("name") or "").lower() for pet in named}
+            if len(names) != len(named):
+                # Two recorded pets share a name.
+                return PetResolution(needs_llm=True, reason="ambiguous")
+            named_species = {_species_group(pet.get("species")) for pet in named}
+            if mentioned_species - named_species:
+                # Another kind of animal is mentioned next to the named pets.
+                return PetResolution(needs_llm=True, reason="new_pet")
+            return PetResolution(pets=named, reason="name")
+
+        by_breed = [
+            pet
+            for pet in pets_recorded
+            if pet.get("breed") and _contains_phrase(text, pet["breed"].lower())
+        ]
+        by_species = [
+            pet
+            for pet in pets_recorded
+            if _species_group(pet.get("species")) in mentioned_species
+        ]
+        candidates = by_breed or by_species
+        if candidates:
+            if len(candidates) > 1:
+                return PetResolution(needs_llm=True, reason="ambiguous")
+            return PetResolution(
+                pets=candidates, reason="breed" if by_breed else "species"
+            )
+        if mentioned_species or word_set & ANIMAL_WORDS:
+            return PetResolution(needs_llm=True, reason="new_pet")
+
+        if word_set & PRONOUNS and last_pets:
+            carried = [
+                pet
+                for pet in pets_recorded
+                if any(_same_pet(pet, last) for last in last_pets)
+            ]
+            if len(carried) == 1:
+                return PetResolution(pets=carried, reason="pronoun")
+            return PetResolution(needs_llm=True, reason="ambiguous")
+
+        return PetResolution(needs_llm=True, reason="no_match")
+
+    @staticmethod
+    def _match_names(
+        original: str, words: list[str], pets_recorded: Sequence[dict[str, Any]]
+    ) -> tuple[list[dict[str, Any]], bool]:
+        """Return the named pets, and whether a common-word name starts a sentence."""
+        text = original.lower()
+        named = []
+        sentence_start = False
+        for pet in pets_recorded:
+            name = (pet.get("name") or "").strip().lower()
+            if not name:
+                continue
+            if name in COMMON_WORD_NAMES:
+                capitalized = (
+                    rf"\b{re.escape(name[0].upper())}(?i:{re.escape(name[1:])})\b"
+                )
+                for match in re.finditer(capitalized, original):
+                    if _SENTENCE_END.search(original, 0, match.start()):
+                        sentence_start = True
+                    else:
+                        named.append(pet)
+                        break
+            elif _contains_phrase(text, name) or (
+                len(name) >= FUZZY_NAME_MIN_LENGTH
+                and " " not in name
+                and get_close_matches(name, words, n=1, cutoff=FUZZY_NAME_CUTOFF)
+            ):
+                named.append(pet)
+        return named, sentence_start
+
+
+pet_resolver = PetResolver()
+register_stats("pet_resolver", pet_resolver.stats)
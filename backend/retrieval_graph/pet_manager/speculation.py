@@ -0,0 +1,126 @@
+"""Speculative pet resolution, run while the router classifies the question.
+
+Three of the five routes (health, behavior and disease) resolve the user's pets before the
+research. With speculation, the pet filter graph starts at the same time as the LLM router
+and its result is adopted when the route needs it, so the two latencies overlap instead of
+adding up. The speculative run does not write to the store: the new pets it found are only
+stored once its result is adopted, and a run whose route does not need pets is cancelled
+without side effects.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from langchain_core.messages import AnyMessage
+from langchain_core.runnables import RunnableConfig
+
+from backend.metrics import register_stats
+from backend.retrieval_graph.pet_manager.filter_graph import graph as pet_filter_graph
+from backend.retrieval_graph.pet_manager.filter_graph import store_new_pets
+from backend.retrieval_graph.state import Pet
+
+logger = logging.getLogger(__name__)
+
+
+class PetSpeculationStats:
+    """Counters of the adopted and wasted speculative pet resolutions."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.wasted = 0
+        self.wasted_completed = 0
+        """Wasted resolutions that had already completed when they were cancelled."""
+        self.wasted_seconds_total = 0.0
+        self.saved_seconds_total = 0.0
+        """Time the adopted resolutions ran while the router was running."""
+
+    def record_start(self) -> None:
+        with self._lock:
+            self.started += 1
+
+    def record_hit(self, overlap_seconds: float) -> None:
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds_total += overlap_seconds
+
+    def record_waste(self, seconds: float, completed: bool) -> None:
+        with self._lock:
+            self.wasted += 1
+            self.wasted_completed += completed
+            self.wasted_seconds_total += seconds
+
+    def stats(self) -> dict[str, float]:
+        """Return a copy of the counters."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "wasted": self.wasted,
+                "wasted_completed": self.wasted_completed,
+                "wasted_seconds_total": self.wasted_seconds_total,
+                "saved_seconds_total": self.saved_seconds_total,
+            }
+
+
+pet_speculation_stats = PetSpeculationStats()
+register_stats("pet_speculation", pet_speculation_stats.stats)
+
+
+class SpeculativePetResolution:
+    """A pet filter graph run started before knowing whether its result is needed.
+
+    It must be created in a running event loop, from the node it runs for: the run
+    inherits the node's config. Every resolution must be either adopted or cancelled.
+
+    Args:
+        messages (List[AnyMessage]): The conversation.
+        last_pets (List[Pet]): The pets resolved on the previous turn.
+    """
+
+    def __init__(self, messages: List[AnyMessage], last_pets: List[Pet]) -> None:
+        self._start = time.perf_counter()
+        self._end: Optional[float] = None
+        self._task = asyncio.create_task(
+            pet_filter_graph.ainvoke(
+                {"messages": messages, "last_pets": last_pets, "write_new_pets": False}
+            )
+        )
+        self._task.add_done_callback(self._record_end)
+        pet_speculation_stats.record_start()
+
+    def _record_end(self, task: asyncio.Task) -> None:
+        self._end = time.perf_counter()
+
+    async def adopt(self, config: RunnableConfig) -> List[Pet]:
+        """Wait for the resolution and store the new pets it found.
+
+        Args:
+            config (RunnableConfig): The config of the node, identifying the user.
+
+        Returns:
+            List[Pet]: The pets specified by the user.
+        """
+        # The resolution ran concurrently with the router until now, or until it completed.
+        overlap = (self._end or time.perf_counter()) - self._start
+        result = await self._task
+        await store_new_pets(result.get("new_pets", []), config)
+        pet_speculation_stats.record_hit(overlap)
+        return result.get("result_pets", [])
+
+    async def cancel(self) -> None:
+        """Cancel the resolution, nothing it found is stored."""
+        completed = self._task.done()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+        except Exception:
+            logger.debug("Wasted speculative pet resolution failed", exc_info=True)
+        pet_speculation_stats.record_waste(time.perf_counter() - self._start, completed)
@@ -1,11 +1,17 @@
-from typing import Annotated, Optional, List, cast, Dict
+from typing import Annotated, Optional, List, Dict
 from langchain_core.runnables import RunnableConfig
 from langgraph.store.base import BaseStore
 from langchain_core.tools import tool
 from langgraph.prebuilt import InjectedStore
 from langgraph.config import get_store
 
+from backend.metrics import instrument_store
 from backend.prompts_local.en import *
+from backend.retrieval_graph.configuration import AgentConfiguration
+from backend.retrieval_graph.pet_manager.profile_cache import (
+    pet_profile_cache,
+    pets_namespace,
+)
 
 
 # TODO 现在对Store的访问可能有Race Condition的隐患，后续需要加上类似的读写锁的办法控制。
@@ -24,16 +30,12 @@ async def add_or_update_pet(
     config: RunnableConfig,
     # store: Annotated[BaseStore, InjectedStore()],
 ):
-    store = get_store()
+    store = instrument_store(get_store())
 
     user_id = config.get("metadata", {}).get("user_id")
     if not user_id:
         return
 
-    namespace = ("pets", user_id)
-
-    pets = await store.asearch(namespace)
-
     cur_pet = {
         "name": name,
         "species": species,
@@ -45,7 +47,8 @@ async def add_or_update_pet(
     }
 
     if cur_pet["name"] and cur_pet["species"]:
-        await store.aput(namespace, f"pet_{name}", cur_pet)
+        await store.aput(pets_namespace(user_id), f"pet_{name}", cur_pet)
+        pet_profile_cache.invalidate(user_id)
 
 
 @tool(description=TOOL_GET_PETS_DESCRIPTION)
@@ -54,15 +57,12 @@ async def get_pets(*, config: RunnableConfig) -> List[Dict]:
     if not user_id:
         return []
 
-    store = get_store()
-
-    namespace = ("pets", user_id)
-
-    pets = await store.asearch(namespace)
-
-    result = [pet.value for pet in pets]
-
-    return result
+    configuration = AgentConfiguration.from_runnable_config(config)
+    return await pet_profile_cache.aget(
+        instrument_store(get_store()),
+        user_id,
+        configuration.pet_profile_cache_ttl_seconds,
+    )
 
 
 @tool(description=TOOL_DELETE_PET_DESCRIPTION)
@@ -79,20 +79,34 @@ async def delete_pet(
     if not user_id:
         return NO_PET_FOUND_STR
 
-    namespace = ("pets", user_id)
+    store = instrument_store(store)
+    namespace = pets_namespace(user_id)
 
+    # The pets are read from the store, not from the cache: the deleted key must exist.
     pets = await store.asearch(namespace)
-    matches = []
-    index = 0
-    for index, pet in enumerate(pets):
-        pet = cast(dict, pet)
-        for kd, vd in {"name": name, "species": species, "breed": breed, "age": age}:
-            matches.append(vd == pet.get(kd, None))
-        if all(matches):
-            break
-    if not all(matches):
+    criteria = {
+        key: value
+        for key, value in {
+            "name": name,
+            "species": species,
+            "breed": breed,
+            "age": age,
+        }.items()
+        if value is not None
+    }
+    match = next(
+        (
+            pet
+            for pet in pets
+            if criteria
+            and all(pet.value.get(key) == value for key, value in criteria.items())
+        ),
+        None,
+    )
+    if match is None:
         return NO_PET_FOUND_STR
 
-    await store.adelete(namespace, f"pet_{pets[index]['name']}")
+    await store.adelete(namespace, match.key)
+    pet_profile_cache.invalidate(user_id)
 
     return PET_DELETED_STR
@@ -25,3 +25,5 @@ GENERAL_SYSTEM_PROMPT = GENERAL_SYSTEM_PROMPT_STR
 RESPONSE_SYSTEM_PROMPT = RESPONSE_SYSTEM_PROMPT_STR
 
 GET_AND_UPDATE_PET_INFO_SYSTEM_PROMPT = GET_AND_UPDATE_PET_INFO_SYSTEM_PROMPT_STR
+
+SUMMARIZE_CONVERSATION_SYSTEM_PROMPT = SUMMARIZE_CONVERSATION_SYSTEM_PROMPT_STR
@@ -0,0 +1,209 @@
+"""Lexical reranking of the retrieved documents, in process and on the CPU.
+
+The documents of a turn reach `respond` in the order the research branches finished in.
+They are reranked by the BM25 score of each document against the user's question, plus a
+weighted score against the research plan step that retrieved it. The BM25 index is built
+over the retrieved documents only, which is small enough to take a few milliseconds.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from typing import Sequence
+
+from langchain_core.documents import Document
+
+from backend.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Letters and digits of any script, so that "pancréatite" is one term.
+_WORD_PATTERN = re.compile(r"[^\W_]+")
+_STOPWORDS = frozenset(
+    {
+        "a",
+        "an",
+        "and",
+        "are",
+        "as",
+        "at",
+        "be",
+        "but",
+        "by",
+        "can",
+        "do",
+        "does",
+        "for",
+        "from",
+        "has",
+        "have",
+        "how",
+        "i",
+        "if",
+        "in",
+        "is",
+        "it",
+        "its",
+        "my",
+        "of",
+        "on",
+        "or",
+        "should",
+        "so",
+        "than",
+        "that",
+        "the",
+        "their",
+        "them",
+        "then",
+        "there",
+        "these",
+        "this",
+        "to",
+        "was",
+        "what",
+        "when",
+        "which",
+        "who",
+        "why",
+        "will",
+        "with",
+        "you",
+        "your",
+    }
+)
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_PATTERN.findall(text.casefold())
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into casefolded alphanumeric terms, without stopwords."""
+    return [word for word in _words(text) if word not in _STOPWORDS]
+
+
+class BM25Index:
+    """An Okapi BM25 index over a small set of tokenized documents.
+
+    Term frequencies are only counted for the terms of the queries scored, and cached: a
+    few queries over a few dozen documents cost much less than counting every term.
+
+    Args:
+        documents_terms (list[list[str]]): The terms of each document.
+        k1 (float): The term frequency saturation.
+        b (float): The document length normalization.
+    """
+
+    def __init__(
+        self, documents_terms: list[list[str]], k1: float = 1.5, b: float = 0.75
+    ) -> None:
+        self.documents_terms = documents_terms
+        n = len(documents_terms)
+        average_length = sum(map(len, documents_terms)) / n if n else 0.0
+        # The length normalization of each document, computed once for every query.
+        self.norms = [
+            k1 * (1 - b + b * len(terms) / average_length) if average_length else k1
+            for terms in documents_terms
+        ]
+        self.k1 = k1
+        self._frequencies: dict[str, list[int]] = {}
+
+    def _term_frequencies(self, term: str) -> list[int]:
+        frequencies = self._frequencies.get(term)
+        if frequencies is None:
+            frequencies = [terms.count(term) for terms in self.documents_terms]
+            self._frequencies[term] = frequencies
+        return frequencies
+
+    def scores(self, query_terms: list[str]) -> list[float]:
+        """Return the BM25 score of every document for a query."""
+        n = len(self.documents_terms)
+        scores = [0.0] * n
+        for term in set(query_terms):
+            frequencies = self._term_frequencies(term)
+            df = n - frequencies.count(0)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i, frequency in enumerate(frequencies):
+                if frequency:
+                    scores[i] += (
+                        idf * frequency * (self.k1 + 1) / (frequency + self.norms[i])
+                    )
+        return scores
+
+
+class RerankStats:
+    """Counters of the reranked documents and of the time spent reranking them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.documents = 0
+        self.seconds_total = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, documents: int, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.documents += documents
+            self.seconds_total += seconds
+            self.last_ms = seconds * 1000
+            self.max_ms = max(self.max_ms, self.last_ms)
+
+    def stats(self) -> dict[str, float]:
+        """Return a copy of the counters."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "documents": self.documents,
+                "seconds_total": self.seconds_total,
+                "last_ms": self.last_ms,
+                "max_ms": self.max_ms,
+            }
+
+
+rerank_stats = RerankStats()
+register_stats("rerank", rerank_stats.stats)
+
+
+def rerank_by_relevance(
+    question: str, documents: Sequence[Document], step_weight: float = 0.5
+) -> list[Document]:
+    """Order documents by their BM25 relevance to the question and to their plan step.
+
+    The plan step of a document is its `research_step` metadata. Ties keep the retrieval
+    order.
+
+    Args:
+        question (str): The user's question.
+        documents (Sequence[Document]): The retrieved documents.
+        step_weight (float): The weight of the score against the plan step, relative to the
+            score against the question.
+
+    Returns:
+        list[Document]: The documents, most relevant first.
+    """
+    start = time.perf_counter()
+    # Documents are split like the queries, but keep their stopwords: they only count in
+    # the document length.
+    index = BM25Index([_words(doc.page_content) for doc in documents])
+    scores = index.scores(tokenize(question))
+    if step_weight:
+        step_scores: dict[str, list[float]] = {}
+        for i, doc in enumerate(documents):
+            step = doc.metadata.get("research_step")
+            if not step:
+                continue
+            if step not in step_scores:
+                step_scores[step] = index.scores(tokenize(step))
+            scores[i] += step_weight * step_scores[step][i]
+    order = sorted(range(len(documents)), key=lambda i: (-scores[i], i))
+    elapsed = time.perf_counter() - start
+    rerank_stats.record(len(documents), elapsed)
+    logger.debug("Reranked %d documents in %.2f ms", len(documents), elapsed * 1000)
+    return [documents[i] for i in order]
@@ -14,10 +14,15 @@ from langchain_community.retrievers import TavilySearchAPIRetriever
 
 from backend import retrieval
 from backend.retrieval_graph.configuration import AgentConfiguration
+from backend.retrieval_graph.researcher_graph.hybrid import hybrid_retrieve
+from backend.retrieval_graph.researcher_graph.search_cache import get_search_cache
 from backend.retrieval_graph.researcher_graph.state import QueryState, ResearcherState
 from backend.utils import load_chat_model
 
 
+_web_retriever = TavilySearchAPIRetriever(k=3)
+
+
 async def generate_queries(
     state: ResearcherState, *, config: RunnableConfig
 ) -> Command[Literal["retrieve_documents"]]:
@@ -49,17 +54,26 @@ async def generate_queries(
 
     return Command(
         goto=[
-            Send("retrieve_documents", QueryState(query=q)) for q in response["queries"]
+            Send("retrieve_documents", QueryState(query=q, step=state.question))
+            for q in response["queries"]
         ]
     )
 
 
+async def _search_library(query: str, config: RunnableConfig) -> list[Document]:
+    async with retrieval.amake_retriever(config) as library_retriever:
+        return await library_retriever.ainvoke(query, config)
+
+
 async def retrieve_documents(
     state: QueryState, *, config: RunnableConfig
 ) -> dict[str, Union[list[Document], str]]:
     """Retrieve documents based on a given query.
 
-    This function uses a retriever to fetch relevant documents for a given query.
+    This function queries the library vector store and the web search concurrently, each under
+    its own deadline, and merges their results with reciprocal rank fusion. Sources that are late
+    or fail are dropped. Each document records the query it was retrieved with in its `queries`
+    metadata, and the plan step of the query in its `research_step` metadata.
 
     Args:
         state (QueryState): The current state containing the query string.
@@ -69,22 +83,38 @@ async def retrieve_documents(
         dict[str, list[Document]]: A dictionary with a 'documents' key containing the list of retrieved documents.
     """
 
-    docs = []
-
-    # async with retrieval.amake_retriever(config) as library_retriever:
-    #     library_docs = await library_retriever.ainvoke(state.query, config)
-    #     docs.extend(library_docs)
-
-    web_retriever = TavilySearchAPIRetriever(k=3)
-    retrival_chain = web_retriever
-    web_docs = await retrival_chain.ainvoke(state.query, config)
-    docs.extend(web_docs)
-
-    # with retrieval.make_retriever(config) as library_retriever:
-    #     library_docs = await library_retriever.ainvoke(state.query, config)
-    #     docs.extend(library_docs)
-
-    return {"documents": docs}
+    configuration = AgentConfiguration.from_runnable_config(config)
+    searches = {}
+    if "library" in configuration.retrieval_sources:
+        searches["library"] = (
+            lambda: _search_library(state.query, config),
+            configuration.library_retrieval_deadline_seconds,
+        )
+    if "web" in configuration.retrieval_sources:
+        search_cache = get_search_cache(
+            configuration.search_cache_ttl_seconds,
+            configuration.search_cache_max_entries,
+            configuration.search_cache_path,
+        )
+        searches["web"] = (
+            lambda: search_cache.aget_or_fetch(
+                state.query, lambda: _web_retriever.ainvoke(state.query, config)
+            ),
+            configuration.web_retrieval_deadline_seconds,
+        )
+
+    docs = await hybrid_retrieve(state.query, searches, rrf_k=configuration.rrf_k)
+
+    # The query is recorded on copies, sources may return the same objects every time.
+    provenance = {"queries": [state.query]}
+    if state.step:
+        provenance["research_step"] = state.step
+    return {
+        "documents": [
+            doc.model_copy(update={"metadata": {**doc.metadata, **provenance}})
+            for doc in docs
+        ]
+    }
 
 
 def retrieve_in_parallel(state: ResearcherState) -> list[Send]:
@@ -103,7 +133,8 @@ def retrieve_in_parallel(state: ResearcherState) -> list[Send]:
         - Each Send object targets the "retrieve_documents" node with the corresponding query.
     """
     return [
-        Send("retrieve_documents", QueryState(query=query)) for query in state.queries
+        Send("retrieve_documents", QueryState(query=query, step=state.question))
+        for query in state.queries
     ]
 
 
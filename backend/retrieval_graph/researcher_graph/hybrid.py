@@ -0,0 +1,185 @@
+"""Multi-source retrieval with per-source deadlines and reciprocal rank fusion.
+
+The library vector store and the web search are queried concurrently. Each
+source runs under its own deadline; a source that is late or fails is dropped
+from the result instead of failing the research step. The ranked lists of the
+sources that answered in time are merged with reciprocal rank fusion (RRF).
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from langchain_core.documents import Document
+
+from backend.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SourceResult:
+    """The outcome of querying one retrieval source."""
+
+    source: str
+    status: str
+    """One of 'ok', 'timeout' or 'error'."""
+    latency_ms: float
+    documents: list[Document]
+
+
+def _document_key(doc: Document) -> str:
+    # Several chunks of one library article share a source, so the content is part of the key.
+    content_hash = hashlib.sha1(doc.page_content.encode()).hexdigest()
+    return f"{doc.metadata.get('source', '')}|{content_hash}"
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: dict[str, list[Document]], k: int = 60
+) -> list[Document]:
+    """Merge ranked document lists with reciprocal rank fusion.
+
+    Documents are identified by their `source` metadata and their content. A copy of the
+    first occurrence of a document is returned, annotated with its fused score in
+    `rrf_score` and the sources that returned it in `retrieval_sources`. The input
+    documents are left unchanged.
+
+    Args:
+        ranked_lists (dict[str, list[Document]]): The ranked results of each source, by source name.
+        k (int): The RRF rank constant, higher values flatten the contribution of the top ranks.
+
+    Returns:
+        list[Document]: The fused documents, best first.
+    """
+    scores: dict[str, float] = defaultdict(float)
+    found_by: dict[str, list[str]] = defaultdict(list)
+    documents: dict[str, Document] = {}
+    for source, ranked in ranked_lists.items():
+        for rank, doc in enumerate(ranked, start=1):
+            key = _document_key(doc)
+            scores[key] += 1.0 / (k + rank)
+            if source not in found_by[key]:
+                found_by[key].append(source)
+            documents.setdefault(key, doc)
+
+    return [
+        documents[key].model_copy(
+            update={
+                "metadata": {
+                    **documents[key].metadata,
+                    "rrf_score": scores[key],
+                    "retrieval_sources": found_by[key],
+                }
+            }
+        )
+        for key in sorted(scores, key=lambda key: scores[key], reverse=True)
+    ]
+
+
+class HybridRetrievalStats:
+    """Per-source latency, outcome and contribution counters of the hybrid retrieval."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.sources: dict[str, dict[str, float]] = defaultdict(
+            lambda: {
+                "queries": 0,
+                "ok": 0,
+                "timeout": 0,
+                "error": 0,
+                "latency_ms_total": 0.0,
+                "documents_returned": 0,
+                "documents_contributed": 0,
+            }
+        )
+
+    def record(self, results: list[SourceResult], fused: list[Document]) -> None:
+        contributed: dict[str, int] = defaultdict(int)
+        for doc in fused:
+            for source in doc.metadata.get("retrieval_sources", []):
+                contributed[source] += 1
+        with self._lock:
+            for result in results:
+                stats = self.sources[result.source]
+                stats["queries"] += 1
+                stats[result.status] += 1
+                stats["latency_ms_total"] += result.latency_ms
+                stats["documents_returned"] += len(result.documents)
+                stats["documents_contributed"] += contributed[result.source]
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Return a copy of the counters of every source."""
+        with self._lock:
+            return {source: dict(stats) for source, stats in self.sources.items()}
+
+
+hybrid_retrieval_stats = HybridRetrievalStats()
+register_stats("hybrid_retrieval", hybrid_retrieval_stats.stats, nested_label="source")
+
+
+async def _query_source(
+    source: str,
+    search: Callable[[], Awaitable[list[Document]]],
+    deadline_seconds: float,
+) -> SourceResult:
+    start = time.perf_counter()
+    try:
+        documents = await asyncio.wait_for(search(), timeout=deadline_seconds)
+        status = "ok"
+    except TimeoutError:
+        documents, status = [], "timeout"
+    except Exception:
+        logger.warning("Retrieval source %r failed", source, exc_info=True)
+        documents, status = [], "error"
+    return SourceResult(
+        source=source,
+        status=status,
+        latency_ms=(time.perf_counter() - start) * 1000,
+        documents=documents,
+    )
+
+
+async def hybrid_retrieve(
+    query: str,
+    searches: dict[str, tuple[Callable[[], Awaitable[list[Document]]], float]],
+    *,
+    rrf_k: int = 60,
+    stats: Optional[HybridRetrievalStats] = hybrid_retrieval_stats,
+) -> list[Document]:
+    """Query every source concurrently under its deadline and fuse the results.
+
+    Args:
+        query (str): The query, used for logging.
+        searches (dict[str, tuple[Callable[[], Awaitable[list[Document]]], float]]): For each source
+            name, a function running the search and the deadline of the source in seconds.
+        rrf_k (int): The RRF rank constant.
+        stats (Optional[HybridRetrievalStats]): Where the per-source statistics are recorded.
+
+    Returns:
+        list[Document]: The fused documents of the sources that answered in time.
+    """
+    results = await asyncio.gather(
+        *(
+            _query_source(source, search, deadline)
+            for source, (search, deadline) in searches.items()
+        )
+    )
+    fused = reciprocal_rank_fusion(
+        {result.source: result.documents for result in results}, k=rrf_k
+    )
+    if stats is not None:
+        stats.record(results, fused)
+    logger.debug(
+        "Hybrid retrieval for %r: %s",
+        query,
+        ", ".join(
+            f"{r.source}={r.status} {r.latency_ms:.0f}ms {len(r.documents)} docs"
+            for r in results
+        ),
+    )
+    return fused
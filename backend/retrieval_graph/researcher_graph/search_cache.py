@@ -0,0 +1,267 @@
+"""Single-flight TTL cache for web search results.
+
+Different users, and different steps of the same plan, often issue the same
+search query within minutes of each other. The cache keeps the results of
+`retrieve_documents` searches keyed by the normalized query, in a bounded
+in-memory tier and an optional SQLite tier on disk. Concurrent identical
+queries are coalesced: only the first one goes upstream, the others await its
+result. The SQLite tier is read and written in worker threads, off the event loop.
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from langchain_core.documents import Document
+
+from backend.metrics import register_stats
+
+# Expired results are never returned, so they are only deleted from disk once in a while.
+SWEEP_INTERVAL_SECONDS = 5 * 60
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase the query, collapse whitespace and strip surrounding punctuation."""
+    return re.sub(r"\s+", " ", query.lower()).strip(" ?!.,;:\"'")
+
+
+class _DiskTier:
+    """SQLite storage for search results that outlives the process."""
+
+    def __init__(
+        self, path: str, sweep_interval_seconds: float = SWEEP_INTERVAL_SECONDS
+    ):
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_results (
+                query TEXT PRIMARY KEY,
+                documents TEXT NOT NULL,
+                fetch_seconds REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple[float, list[Document], float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, documents, fetch_seconds FROM search_results WHERE query = ?",
+                (key,),
+            ).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        documents = [Document(**document) for document in json.loads(row[1])]
+        return row[0], documents, row[2]
+
+    def put(
+        self,
+        key: str,
+        expires_at: float,
+        documents: list[Document],
+        fetch_seconds: float,
+    ) -> None:
+        payload = json.dumps(
+            [
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in documents
+            ],
+            default=str,
+        )
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)",
+                (key, payload, fetch_seconds, expires_at),
+            )
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.sweep_interval_seconds
+                self._conn.execute(
+                    "DELETE FROM search_results WHERE expires_at < ?", (now,)
+                )
+
+
+class SearchCache:
+    """A TTL cache of search results with single-flight coalescing.
+
+    Args:
+        ttl_seconds (float): How long search results are reused.
+        max_entries (int): Maximum number of queries kept in memory.
+        disk_path (Optional[str]): Path of a SQLite database used as a second tier.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 15 * 60,
+        max_entries: int = 2048,
+        disk_path: Optional[str] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("Search cache max_entries should be at least 1")
+
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, tuple[float, list[Document], float]] = (
+            OrderedDict()
+        )
+        self._disk = _DiskTier(disk_path) if disk_path else None
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.time_saved_seconds = 0.0
+
+    async def aget_or_fetch(
+        self, query: str, fetch: Callable[[], Awaitable[list[Document]]]
+    ) -> list[Document]:
+        """Return the cached results for a query, or fetch them once for all concurrent callers.
+
+        Args:
+            query (str): The search query.
+            fetch (Callable[[], Awaitable[list[Document]]]): Runs the upstream search on a miss.
+
+        Returns:
+            list[Document]: Copies of the search results, safe to modify.
+        """
+        key = normalize_query(query)
+        cached = await self._aget(key)
+        if cached is not None:
+            return [doc.model_copy(deep=True) for doc in cached]
+
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight.get_loop() is loop:
+            self.coalesced += 1
+            start = time.perf_counter()
+            try:
+                documents, fetch_seconds = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leading request was cancelled, search on our own.
+                return await self.aget_or_fetch(query, fetch)
+            self.time_saved_seconds += max(
+                0.0, fetch_seconds - (time.perf_counter() - start)
+            )
+            return [doc.model_copy(deep=True) for doc in documents]
+
+        self.misses += 1
+        future = loop.create_future()
+        self._inflight[key] = future
+        start = time.perf_counter()
+        try:
+            documents = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting for it.
+            future.exception()
+            raise
+        else:
+            fetch_seconds = time.perf_counter() - start
+            future.set_result((documents, fetch_seconds))
+            await self._aput(key, documents, fetch_seconds)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        return [doc.model_copy(deep=True) for doc in documents]
+
+    async def _aget(self, key: str) -> Optional[list[Document]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] < now:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.time_saved_seconds += entry[2]
+                return entry[1]
+
+        if self._disk is None:
+            return None
+        entry = await asyncio.to_thread(self._disk.get, key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self.time_saved_seconds += entry[2]
+            self._store_in_memory(key, entry)
+        return entry[1]
+
+    async def _aput(
+        self, key: str, documents: list[Document], fetch_seconds: float
+    ) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store_in_memory(key, (expires_at, documents, fetch_seconds))
+        if self._disk is not None:
+            await asyncio.to_thread(
+                self._disk.put, key, expires_at, documents, fetch_seconds
+            )
+
+    def _store_in_memory(
+        self, key: str, entry: tuple[float, list[Document], float]
+    ) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        """Return the hit/miss counters, the hit rate and the upstream time saved."""
+        lookups = self.hits + self.disk_hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+            "time_saved_seconds": self.time_saved_seconds,
+            "size": len(self._memory),
+        }
+
+
+_caches: dict[tuple[float, int, str], SearchCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_search_cache(
+    ttl_seconds: float, max_entries: int, disk_path: str
+) -> SearchCache:
+    """Return the process-wide search cache for a configuration.
+
+    Args:
+        ttl_seconds (float): How long search results are reused.
+        max_entries (int): Maximum number of queries kept in memory.
+        disk_path (str): Path of the SQLite tier, or an empty string to keep results in memory only.
+    """
+    key = (ttl_seconds, max_entries, disk_path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SearchCache(ttl_seconds, max_entries, disk_path or None)
+            register_stats(
+                "search_cache",
+                _caches[key].stats,
+                {
+                    "ttl_seconds": str(ttl_seconds),
+                    "max_entries": str(max_entries),
+                    "path": disk_path,
+                },
+            )
+        return _caches[key]
@@ -16,6 +16,8 @@ class QueryState:
     """Private state for the retrieve_documents node in the researcher graph."""
 
     query: str
+    step: str = ""
+    """The step of the research plan the query was generated for."""
 
 
 @dataclass(kw_only=True)
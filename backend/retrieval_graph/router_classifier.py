@@ -0,0 +1,344 @@
+"""Local fast-path classifier for the query router.
+
+`analyze_and_route_query` asks an LLM to pick one of the `Router` types on
+every turn, before anything else can start. Most questions are easy to route,
+so a small linear model over hashed word and character n-grams decides the
+confident cases locally in well under a millisecond, and only the uncertain
+ones go to the LLM. The model only sees the question: follow-up questions, and
+the `more-info` and `general` decisions whose logic is used to answer, are
+always left to the LLM.
+
+The model learns from the decisions of the LLM router: set
+`router_decision_log_path` in the configuration to log them, then train (or
+refresh) the model and benchmark it from the command line:
+
+    python -m backend.retrieval_graph.router_classifier train --log router_decisions.jsonl --out router_model.json
+    python -m backend.retrieval_graph.router_classifier benchmark --log router_decisions.jsonl --model router_model.json
+
+Running processes pick up a refreshed model file on their next turn.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from itertools import pairwise
+from typing import Any, Iterable, Optional
+
+N_FEATURES = 1 << 18
+LLM_ONLY_LABELS = ("more-info", "general")
+"""The router types never decided locally, the answer depends on the logic of the LLM."""
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def extract_features(text: str, n_features: int = N_FEATURES) -> Counter[int]:
+    """Hash the word unigrams/bigrams and character trigrams of a text into feature ids."""
+    text = text.lower()
+    words = _WORD_PATTERN.findall(text)
+    grams = [f"w:{w}" for w in words]
+    grams += [f"b:{a} {b}" for a, b in pairwise(words)]
+    padded = f" {' '.join(words)} "
+    grams += [f"c:{padded[i : i + 3]}" for i in range(len(padded) - 2)]
+    return Counter(zlib.crc32(gram.encode()) % n_features for gram in grams)
+
+
+def _softmax(scores: list[float]) -> list[float]:
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class RouterClassifier:
+    """A multinomial logistic regression over hashed n-gram features.
+
+    Args:
+        labels (list[str]): The router types the model can predict.
+        weights (Optional[dict[int, list[float]]]): Per-feature weights, one per label.
+        bias (Optional[list[float]]): Per-label bias.
+        n_features (int): Size of the hashed feature space.
+    """
+
+    def __init__(
+        self,
+        labels: list[str],
+        weights: Optional[dict[int, list[float]]] = None,
+        bias: Optional[list[float]] = None,
+        n_features: int = N_FEATURES,
+    ):
+        self.labels = labels
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(labels)
+        self.n_features = n_features
+
+    def predict_proba(self, text: str) -> dict[str, float]:
+        """Return the probability of every label for a text."""
+        features = extract_features(text, self.n_features)
+        scores = list(self.bias)
+        for feature, count in features.items():
+            weights = self.weights.get(feature)
+            if weights is None:
+                continue
+            for i, weight in enumerate(weights):
+                scores[i] += weight * count
+        return dict(zip(self.labels, _softmax(scores)))
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Return the most likely label for a text and its probability."""
+        probabilities = self.predict_proba(text)
+        label = max(probabilities, key=probabilities.__getitem__)
+        return label, probabilities[label]
+
+    @classmethod
+    def train(
+        cls,
+        examples: list[tuple[str, str]],
+        *,
+        epochs: int = 10,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+        seed: int = 0,
+    ) -> "RouterClassifier":
+        """Train a model with AdaGrad on (text, label) examples."""
+        labels = sorted({label for _, label in examples})
+        index = {label: i for i, label in enumerate(labels)}
+        model = cls(labels)
+        weights: dict[int, list[float]] = defaultdict(lambda: [0.0] * len(labels))
+        grad_squares: dict[int, list[float]] = defaultdict(lambda: [1e-8] * len(labels))
+        bias_grad_squares = [1e-8] * len(labels)
+        featurized = [
+            (extract_features(text), index[label]) for text, label in examples
+        ]
+
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(featurized)
+            for features, target in featurized:
+                scores = list(model.bias)
+                for feature, count in features.items():
+                    for i, weight in enumerate(weights[feature]):
+                        scores[i] += weight * count
+                probabilities = _softmax(scores)
+                for i, probability in enumerate(probabilities):
+                    error = probability - (1.0 if i == target else 0.0)
+                    bias_grad_squares[i] += error * error
+                    model.bias[i] -= (
+                        learning_rate * error / math.sqrt(bias_grad_squares[i])
+                    )
+                    for feature, count in features.items():
+                        weight = weights[feature]
+                        grad = error * count + l2 * weight[i]
+                        grad_squares[feature][i] += grad * grad
+                        weight[i] -= (
+                            learning_rate * grad / math.sqrt(grad_squares[feature][i])
+                        )
+
+        model.weights = dict(weights)
+        return model
+
+    def save(self, path: str) -> None:
+        """Write the model to a JSON file, atomically replacing any previous version."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "labels": self.labels,
+                    "n_features": self.n_features,
+                    "bias": self.bias,
+                    "weights": {
+                        str(feature): [round(w, 6) for w in weights]
+                        for feature, weights in self.weights.items()
+                    },
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RouterClassifier":
+        """Read a model written by `save`."""
+        with open(path) as f:
+            data = json.load(f)
+        return cls(
+            labels=data["labels"],
+            weights={int(k): v for k, v in data["weights"].items()},
+            bias=data["bias"],
+            n_features=data["n_features"],
+        )
+
+
+_models: dict[str, tuple[float, RouterClassifier]] = {}
+_models_lock = threading.Lock()
+
+
+def get_router_classifier(path: str) -> Optional[RouterClassifier]:
+    """Return the model stored at `path`, reloading it when the file changed.
+
+    Returns None when there is no model file.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _models_lock:
+        cached = _models.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, RouterClassifier.load(path))
+            _models[path] = cached
+        return cached[1]
+
+
+def log_router_decision(
+    path: str, text: str, router: dict[str, Any], latency_ms: float
+) -> None:
+    """Append a decision of the LLM router to the JSON lines log used for training."""
+    record = {
+        "text": text,
+        "type": router["type"],
+        "logic": router.get("logic", ""),
+        "latency_ms": round(latency_ms, 1),
+        "ts": time.time(),
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_router_decisions(path: str) -> list[dict[str, Any]]:
+    """Read the decisions logged by `log_router_decision`."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _split(
+    records: list[dict[str, Any]], test_fraction: float, seed: int
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    records = list(records)
+    random.Random(seed).shuffle(records)
+    n_test = int(len(records) * test_fraction)
+    return records[n_test:], records[:n_test]
+
+
+def benchmark(
+    model: RouterClassifier,
+    records: Iterable[dict[str, Any]],
+    thresholds: Iterable[float] = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95),
+    llm_latency_ms: Optional[float] = None,
+) -> list[dict[str, float]]:
+    """Measure coverage, accuracy and expected routing latency per confidence threshold.
+
+    Args:
+        model (RouterClassifier): The model to benchmark.
+        records (Iterable[dict[str, Any]]): Logged decisions of the LLM router, used as ground truth.
+        thresholds (Iterable[float]): The confidence thresholds to evaluate.
+        llm_latency_ms (Optional[float]): Latency of the LLM router. Defaults to the mean logged latency.
+
+    Returns:
+        list[dict[str, float]]: One row per threshold.
+    """
+    records = list(records)
+    if not records:
+        return []
+    if llm_latency_ms is None:
+        llm_latency_ms = sum(r.get("latency_ms", 0.0) for r in records) / len(records)
+
+    predictions = []
+    start = time.perf_counter()
+    for record in records:
+        predictions.append(model.predict(record["text"]))
+    local_latency_ms = (time.perf_counter() - start) * 1000 / len(records)
+
+    rows = []
+    for threshold in thresholds:
+        local = [
+            (label, record["type"])
+            for (label, confidence), record in zip(predictions, records)
+            if confidence >= threshold and label not in LLM_ONLY_LABELS
+        ]
+        coverage = len(local) / len(records)
+        rows.append(
+            {
+                "threshold": threshold,
+                "coverage": coverage,
+                "local_accuracy": (
+                    sum(label == truth for label, truth in local) / len(local)
+                    if local
+                    else 0.0
+                ),
+                "overall_accuracy": (
+                    sum(label == truth for label, truth in local)
+                    + len(records)
+                    - len(local)
+                )
+                / len(records),
+                "mean_latency_ms": local_latency_ms + (1 - coverage) * llm_latency_ms,
+            }
+        )
+    rows.append(
+        {
+            "threshold": float("inf"),
+            "coverage": 0.0,
+            "local_accuracy": 0.0,
+            "overall_accuracy": 1.0,
+            "mean_latency_ms": llm_latency_ms,
+        }
+    )
+    return rows
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser(
+        "train", help="Train or refresh the model from logged router decisions."
+    )
+    train_parser.add_argument("--log", required=True)
+    train_parser.add_argument("--out", required=True)
+    train_parser.add_argument("--epochs", type=int, default=10)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="Report accuracy versus latency per confidence threshold."
+    )
+    benchmark_parser.add_argument("--log", required=True)
+    benchmark_parser.add_argument(
+        "--model", help="Model to benchmark. Trains on a split of the log if omitted."
+    )
+    benchmark_parser.add_argument("--test-fraction", type=float, default=0.2)
+    benchmark_parser.add_argument("--llm-latency-ms", type=float)
+
+    args = parser.parse_args(argv)
+    records = read_router_decisions(args.log)
+
+    if args.command == "train":
+        model = RouterClassifier.train(
+            [(r["text"], r["type"]) for r in records], epochs=args.epochs
+        )
+        model.save(args.out)
+        print(f"Trained on {len(records)} decisions, labels: {model.labels}")
+        return
+
+    if args.model:
+        model, test_records = RouterClassifier.load(args.model), records
+    else:
+        train_records, test_records = _split(records, args.test_fraction, seed=0)
+        model = RouterClassifier.train([(r["text"], r["type"]) for r in train_records])
+
+    print(
+        f"{'threshold':>10} {'coverage':>9} {'local acc':>10} {'overall acc':>12} {'latency ms':>11}"
+    )
+    for row in benchmark(model, test_records, llm_latency_ms=args.llm_latency_ms):
+        print(
+            f"{row['threshold']:>10.2f} {row['coverage']:>9.1%} {row['local_accuracy']:>10.1%} "
+            f"{row['overall_accuracy']:>12.1%} {row['mean_latency_ms']:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
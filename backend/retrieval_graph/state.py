@@ -89,6 +89,26 @@ class PetList(BaseModel):
     pets: list[Pet]
 
 
+@dataclass(kw_only=True)
+class ResearchStepState:
+    """Private state for the research_step node, one per step of the research plan."""
+
+    step: str
+    """The step of the research plan to research."""
+    pet: Pet
+    """The pet the research is conducted for."""
+
+
+@dataclass(kw_only=True)
+class CachedAnswerState:
+    """Private state for the emit_cached_answer node."""
+
+    answer: str
+    """The cached answer to emit."""
+    sources: list[dict]
+    """The documents the cached answer was based on, as page_content/metadata dicts."""
+
+
 # This is the primary state of your agent, where you can store any information
 
 
@@ -102,7 +122,13 @@ class AgentState(InputState):
     """A list of steps in the research plan."""
     documents: Annotated[list[Document], reduce_docs] = field(default_factory=list)
     """Populated by the retriever. This is a list of documents that the agent can reference."""
+    context_documents: list[Document] = field(default_factory=list)
+    """The retrieved documents with their duplicates suppressed, the candidates of the response context."""
     answer: str = field(default="")
     """Final answer. Useful for evaluations"""
     query: str = field(default="")
     pets: list[Pet] = field(default_factory=list)
+    summary: str = field(default="")
+    """A rolling summary of the turns of the conversation older than the ones sent verbatim."""
+    summarized_messages: int = field(default=0)
+    """The number of messages, from the start of the conversation, covered by the summary."""
@@ -0,0 +1,19 @@
+"""Custom HTTP routes served by the LangGraph server next to the graph API.
+
+Registered under `http.app` in `langgraph.json`.
+"""
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from backend.metrics import CONTENT_TYPE, registry
+
+
+async def metrics(request: Request) -> Response:
+    """Expose the in-process metrics in the Prometheus text format."""
+    return Response(registry.render(), headers={"Content-Type": CONTENT_TYPE})
+
+
+app = Starlette(routes=[Route("/metrics", metrics, methods=["GET"])])
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage
+
+from backend.retrieval_graph.answer_cache import (
+    AnswerCacheBackend,
+    InMemoryAnswerCacheBackend,
+    SemanticAnswerCache,
+    SQLiteAnswerCacheBackend,
+)
+from backend.retrieval_graph.graph import lookup_cached_answer
+from backend.retrieval_graph.state import AgentState
+
+DOG = {"species": "dog", "breed": "Beagle", "age": 3}
+CAT = {"species": "cat", "breed": "", "age": 3}
+SOURCES = [Document(page_content="Grapes are toxic.", metadata={"source": "avma"})]
+
+# Normalized question -> embedding. "grapes" and "raisins" are close, "walks" is not.
+VECTORS = {
+    "can my dog eat grapes": [1.0, 0.0, 0.0],
+    "can my dog eat grape": [0.99, 0.14, 0.0],
+    "can my dog eat raisins": [0.9, 0.43, 0.0],
+    "how long should walks be": [0.0, 0.0, 1.0],
+}
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        return VECTORS[text]
+
+
+def _backend(kind: str, path: Path, max_entries: int = 100) -> AnswerCacheBackend:
+    if kind == "sqlite":
+        return SQLiteAnswerCacheBackend(str(path / "answers.sqlite3"), max_entries)
+    return InMemoryAnswerCacheBackend(max_entries)
+
+
+BACKENDS = ["memory", "sqlite"]
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_lookup_above_the_similarity_threshold(kind: str, tmp_path: Path) -> None:
+    async def scenario() -> None:
+        cache = SemanticAnswerCache(_backend(kind, tmp_path), FakeEmbeddings())
+        await cache.astore("Can my dog eat grapes?", DOG, "No.", SOURCES)
+
+        hit = await cache.alookup(
+            "can my dog eat GRAPE", DOG, threshold=0.95, ttl_seconds=60
+        )
+        assert hit is not None and hit.answer == "No."
+        assert hit.sources == [
+            {"page_content": "Grapes are toxic.", "metadata": {"source": "avma"}}
+        ]
+        # Similar but under the threshold, and unrelated questions, miss.
+        for question in ["Can my dog eat raisins?", "How long should walks be?"]:
+            assert (
+                await cache.alookup(question, DOG, threshold=0.95, ttl_seconds=60)
+                is None
+            )
+        assert cache.stats() == {"hits": 1, "misses": 2, "expired": 0, "indexed": 1}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_lookup_is_partitioned_by_pet_profile(kind: str, tmp_path: Path) -> None:
+    async def scenario() -> None:
+        embeddings = FakeEmbeddings()
+        cache = SemanticAnswerCache(_backend(kind, tmp_path), embeddings)
+        await cache.astore("Can my dog eat grapes?", DOG, "No.", SOURCES)
+
+        assert (
+            await cache.alookup(
+                "Can my dog eat grapes?", CAT, threshold=0.95, ttl_seconds=60
+            )
+            is None
+        )
+        # A profile without answers is a miss without embedding the question.
+        assert embeddings.calls == 1
+        # The age bucket is part of the profile.
+        assert (
+            await cache.alookup(
+                "Can my dog eat grapes?",
+                {**DOG, "age": 12},
+                threshold=0.95,
+                ttl_seconds=60,
+            )
+            is None
+        )
+        assert await cache.alookup(
+            "Can my dog eat grapes?", {**DOG, "age": 5}, threshold=0.95, ttl_seconds=60
+        )
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_expired_answers_are_removed(kind: str, tmp_path: Path) -> None:
+    async def scenario() -> None:
+        backend = _backend(kind, tmp_path)
+        cache = SemanticAnswerCache(backend, FakeEmbeddings())
+        await cache.astore("Can my dog eat grapes?", DOG, "No.", SOURCES)
+        await cache.astore("How long should walks be?", DOG, "An hour.", SOURCES)
+        old = backend.entries("dog|beagle|adult")[0]
+        backend.delete([old.id])
+        old.created_at = time.time() - 120
+        await asyncio.to_thread(cache._store, "dog|beagle|adult", old)
+
+        assert (
+            await cache.alookup(
+                "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+            )
+            is None
+        )
+        assert [entry.answer for entry in backend.entries("dog|beagle|adult")] == [
+            "An hour."
+        ]
+        assert cache.stats()["expired"] == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_least_recently_used_answers_are_evicted(kind: str, tmp_path: Path) -> None:
+    async def scenario() -> None:
+        cache = SemanticAnswerCache(
+            _backend(kind, tmp_path, max_entries=2), FakeEmbeddings()
+        )
+        await cache.astore("Can my dog eat grapes?", DOG, "No grapes.", SOURCES)
+        await cache.astore("How long should walks be?", DOG, "An hour.", SOURCES)
+        # Using the first answer makes the second one the least recently used.
+        assert await cache.alookup(
+            "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+        )
+        await cache.astore("Can my dog eat raisins?", CAT, "No raisins.", SOURCES)
+
+        assert (
+            await cache.alookup(
+                "How long should walks be?", DOG, threshold=0.95, ttl_seconds=60
+            )
+            is None
+        )
+        assert await cache.alookup(
+            "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+        )
+        assert await cache.alookup(
+            "Can my dog eat raisins?", CAT, threshold=0.95, ttl_seconds=60
+        )
+        assert cache.stats()["indexed"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_answers_are_shared_between_caches(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        first = SemanticAnswerCache(_backend("sqlite", tmp_path), FakeEmbeddings())
+        second = SemanticAnswerCache(_backend("sqlite", tmp_path), FakeEmbeddings())
+        assert (
+            await second.alookup(
+                "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+            )
+            is None
+        )
+
+        await first.astore("Can my dog eat grapes?", DOG, "No.", SOURCES)
+        # Answers added by another process are read on the next lookup.
+        hit = await second.alookup(
+            "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+        )
+        assert hit is not None and hit.answer == "No."
+
+        # Answers removed by another process are dropped from the index on a hit.
+        first.backend.delete([hit.id])
+        assert (
+            await second.alookup(
+                "Can my dog eat grapes?", DOG, threshold=0.95, ttl_seconds=60
+            )
+            is None
+        )
+        assert second.stats()["indexed"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_max_entries_should_be_positive() -> None:
+    with pytest.raises(ValueError):
+        InMemoryAnswerCacheBackend(0)
+
+
+def test_follow_up_questions_skip_the_cache() -> None:
+    state = AgentState(
+        messages=[
+            HumanMessage("My dog ate grapes."),
+            AIMessage("How many?"),
+            HumanMessage("Can he eat them?"),
+        ],
+        pets=[DOG],
+    )
+    config = {"configurable": {"answer_cache_enabled": True}}
+
+    command = asyncio.run(lookup_cached_answer(state, config=config))
+
+    assert command.goto == "create_research_plan"
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Optional, Self
+
+import pytest
+
+from backend.avma_sitemaploader import AVMASitemapLoader, _AdaptiveHostLimiter
+
+SITEMAP = "https://www.avma.org/sitemap.xml"
+
+
+class FakeResponse:
+    def __init__(self, status: int, retry_after: Optional[str] = None) -> None:
+        self.status = status
+        self.headers = {"Retry-After": retry_after} if retry_after else {}
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        return None
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise RuntimeError(f"HTTP {self.status}")
+
+    async def text(self) -> str:
+        return "<urlset/>"
+
+
+class FakeSession:
+    def __init__(self, statuses: list[tuple[int, Optional[str]]]) -> None:
+        self.responses = [FakeResponse(*status) for status in statuses]
+
+    def get(self, url: str) -> FakeResponse:
+        return self.responses.pop(0)
+
+
+def test_host_limiter_halves_on_throttling_and_grows_back() -> None:
+    limiter = _AdaptiveHostLimiter(8)
+
+    limiter.on_throttled()
+    assert limiter.limit == 4
+    for _ in range(3):
+        limiter.on_throttled()
+    assert limiter.limit == 1
+
+    limiter.on_success()
+    assert limiter.limit == 2
+    limiter.on_success()
+    assert limiter.limit == 2
+    limiter.on_success()
+    assert limiter.limit == 3
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_host_limiter_bounds_concurrent_requests() -> None:
+    limiter = _AdaptiveHostLimiter(8)
+    limiter.on_throttled()
+    active, peak = 0, 0
+
+    async def request() -> None:
+        nonlocal active, peak
+        async with limiter:
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.001)
+            active -= 1
+
+    async def scenario() -> None:
+        await asyncio.gather(*(request() for _ in range(20)))
+
+    asyncio.run(scenario())
+    assert peak == 4
+
+
+def test_throttled_sitemaps_are_retried_with_backoff(monkeypatch) -> None:
+    loader = AVMASitemapLoader(SITEMAP, crawl_backoff_seconds=0.5)
+    limiter = _AdaptiveHostLimiter(8)
+    session = FakeSession([(429, "3"), (503, None), (200, None)])
+    delays = []
+
+    async def sleep(delay: float) -> None:
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    text = asyncio.run(loader._afetch_sitemap(session, SITEMAP, limiter))
+
+    assert text == "<urlset/>"
+    # Retry-After is honored, otherwise the backoff doubles on every attempt.
+    assert delays == [3.0, 1.0]
+    assert limiter.limit == 2
+
+
+def test_sitemaps_still_throttled_after_the_retries_fail(monkeypatch) -> None:
+    loader = AVMASitemapLoader(SITEMAP, crawl_max_retries=1, crawl_backoff_seconds=0)
+    session = FakeSession([(429, None), (429, None)])
+
+    async def sleep(delay: float) -> None:
+        return None
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    with pytest.raises(ValueError, match="still throttled after 2 attempts"):
+        asyncio.run(loader._afetch_sitemap(session, SITEMAP, _AdaptiveHostLimiter(8)))
+    with pytest.raises(RuntimeError, match="HTTP 404"):
+        asyncio.run(
+            loader._afetch_sitemap(
+                FakeSession([(404, None)]), SITEMAP, _AdaptiveHostLimiter(8)
+            )
+        )
+
+
+def _pages(n: int) -> list[tuple[dict, str]]:
+    return [
+        (
+            {"loc": f"https://www.avma.org/page-{i}", "lastmod": "2026-01-01"},
+            f"<html><body><p>Page {i}</p></body></html>",
+        )
+        for i in range(n)
+    ]
+
+
+def test_parse_pages_in_process() -> None:
+    loader = AVMASitemapLoader(SITEMAP)
+
+    documents = list(loader.parse_pages(_pages(3)))
+
+    assert [doc.page_content for doc in documents] == ["Page 0", "Page 1", "Page 2"]
+    assert documents[1].metadata == {
+        "source": "https://www.avma.org/page-1",
+        "loc": "https://www.avma.org/page-1",
+        "lastmod": "2026-01-01",
+    }
+
+
+def test_parse_pages_in_worker_processes_streams_in_order() -> None:
+    loader = AVMASitemapLoader(SITEMAP, parse_workers=2, parse_chunksize=2)
+    consumed = 0
+
+    def pages():
+        nonlocal consumed
+        for page in _pages(40):
+            consumed += 1
+            yield page
+
+    try:
+        documents = loader.parse_pages(pages())
+        first = next(documents)
+        # At most two chunks per worker are in flight.
+        assert consumed <= 2 * 2 * 2 + 2
+        rest = list(documents)
+    finally:
+        loader.close()
+
+    assert [first.page_content, *(doc.page_content for doc in rest)] == [
+        f"Page {i}" for i in range(40)
+    ]
+    assert rest[-1].metadata["source"] == "https://www.avma.org/page-39"
@@ -0,0 +1,55 @@
+from langchain_core.documents import Document
+
+from backend.retrieval_graph.context_packer import (
+    estimate_tokens,
+    pack_context,
+    truncate_to_passages,
+)
+
+QUESTION = "What diet should my cat with kidney disease eat?"
+KIDNEY = "Cats with kidney disease need a renal diet that is low in phosphorus."
+WALKS = "Dogs need a walk every day to stay healthy and calm at home."
+
+
+def test_ranks_by_relevance_and_drops_duplicates() -> None:
+    documents = [
+        Document(page_content=WALKS, metadata={"source": "a"}),
+        Document(page_content=KIDNEY, metadata={"source": "b"}),
+        Document(page_content=WALKS.upper(), metadata={"source": "c"}),
+    ]
+
+    packed = pack_context(QUESTION, documents, 1000)
+
+    assert [doc.metadata["source"] for doc in packed.documents] == ["b", "a"]
+    assert packed.sources == [documents[1], documents[0]]
+    assert packed.report.duplicates_dropped == 1
+
+
+def test_truncates_around_matching_passages_within_budget() -> None:
+    filler = [f"Paragraph {i} is about grooming and brushing." for i in range(100)]
+    long_document = Document(
+        page_content="\n\n".join(filler[:50] + [KIDNEY] + filler[50:]),
+        metadata={"source": "long"},
+    )
+    documents = [long_document, Document(page_content=WALKS)]
+
+    packed = pack_context(QUESTION, documents, 120, max_tokens_per_document=100)
+
+    assert KIDNEY in packed.documents[0].page_content
+    assert packed.sources[0] is long_document
+    assert packed.report.documents_truncated == 1
+    assert packed.report.tokens_packed <= 120
+    assert packed.report.tokens_saved == packed.report.tokens_in - sum(
+        estimate_tokens(doc.page_content) for doc in packed.documents
+    )
+
+
+def test_truncates_a_single_passage_by_counted_tokens() -> None:
+    # CJK text counts about one token per character, not per four.
+    text = "猫" * 400
+
+    truncated = truncate_to_passages(text, {"diet"}, 100)
+
+    assert estimate_tokens(truncated) <= 100
+    assert text.startswith(truncated)
+    assert len(truncated) >= 90
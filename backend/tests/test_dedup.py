@@ -0,0 +1,81 @@
+import random
+
+from langchain_core.documents import Document
+
+from backend.retrieval_graph.dedup import canonical_url, deduplicate_documents, simhash
+from backend.utils import reduce_docs
+
+
+def _text(seed: int, words: int = 600) -> str:
+    return " ".join(
+        f"word{n}" for n in random.Random(seed).choices(range(1000), k=words)
+    )
+
+
+def _web(url: str, content: str, query: str, score: float) -> Document:
+    return Document(
+        page_content=content,
+        metadata={
+            "source": url,
+            "rrf_score": score,
+            "retrieval_sources": ["web"],
+            "queries": [query],
+        },
+    )
+
+
+def test_canonical_url() -> None:
+    assert (
+        canonical_url("HTTPS://www.Example.com/cats/?utm_source=x&b=2&a=1#top")
+        == "https://example.com/cats?a=1&b=2"
+    )
+
+
+def test_simhash_of_near_duplicates() -> None:
+    text = _text(1)
+    edited = text + " word1"
+    assert simhash("too short") is None
+    assert (simhash(text) ^ simhash(edited)).bit_count() <= 8
+    assert (simhash(text) ^ simhash(_text(2))).bit_count() > 16
+
+
+def test_collapses_url_and_near_duplicates_into_the_best_scored() -> None:
+    article = _text(1)
+    documents = [
+        _web("https://example.com/cats", "Snippet for query a.", "a", 0.01),
+        _web("https://www.example.com/cats/", "Snippet for query b.", "b", 0.03),
+        _web("https://mirror.example/cats", article, "c", 0.02),
+        _web("https://other.example/cats", article + " Copyright.", "a", 0.04),
+        # Library chunks of one article share its URL, they are only compared by content.
+        Document(
+            page_content=_text(3),
+            metadata={"source": "https://library/1", "retrieval_sources": ["library"]},
+        ),
+        Document(
+            page_content=_text(4),
+            metadata={"source": "https://library/1", "retrieval_sources": ["library"]},
+        ),
+    ]
+
+    result = deduplicate_documents(documents)
+
+    assert result.url_duplicates == 1
+    assert result.near_duplicates == 1
+    assert [doc.page_content for doc in result.documents] == [
+        "Snippet for query b.",
+        article + " Copyright.",
+        documents[4].page_content,
+        documents[5].page_content,
+    ]
+    assert result.documents[0].metadata["queries"] == ["a", "b"]
+    assert result.documents[1].metadata["queries"] == ["c", "a"]
+    assert result.documents[1].metadata["rrf_score"] == 0.04
+    assert documents[0].metadata["queries"] == ["a"]
+
+
+def test_reduce_docs_keeps_the_queries_of_dropped_duplicates() -> None:
+    first = reduce_docs([], [_web("https://a", "same", "a", 0.1)])
+    merged = reduce_docs(first, [_web("https://a", "same", "b", 0.1)])
+
+    assert [doc.metadata["queries"] for doc in merged] == [["a", "b"]]
+    assert first[0].metadata["queries"] == ["a"]
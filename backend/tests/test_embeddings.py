@@ -0,0 +1,88 @@
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+from backend.embeddings import CachedEmbeddings, EmbeddingCache, get_embedding_cache
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, dimensions: Optional[int] = None) -> None:
+        self.dimensions = dimensions
+        self.embedded: list[str] = []
+
+    def _vector(self, text: str) -> list[float]:
+        return [float(len(text)), float(self.dimensions or 0), 1.0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.embedded.append(text)
+        return [-x for x in self._vector(text)]
+
+
+def test_batches_only_embed_the_misses() -> None:
+    underlying = CountingEmbeddings()
+    model = CachedEmbeddings(underlying, "openai/small", cache=EmbeddingCache())
+
+    first = model.embed_documents(["grapes", "raisins", "grapes"])
+    second = model.embed_documents(["raisins", "chocolate"])
+
+    # Identical texts of a batch are embedded once.
+    assert underlying.embedded == ["grapes", "raisins", "chocolate"]
+    assert first == [[6.0, 0.0, 1.0], [7.0, 0.0, 1.0], [6.0, 0.0, 1.0]]
+    assert second == [[7.0, 0.0, 1.0], [9.0, 0.0, 1.0]]
+    stats = model.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+
+
+def test_vectors_are_keyed_by_model_dimensions_and_kind() -> None:
+    cache = EmbeddingCache()
+    small = CountingEmbeddings()
+    small_512 = CountingEmbeddings(dimensions=512)
+    large = CountingEmbeddings()
+    models = [
+        CachedEmbeddings(small, "openai/small", cache=cache),
+        CachedEmbeddings(small_512, "openai/small", cache=cache),
+        CachedEmbeddings(large, "openai/large", cache=cache),
+    ]
+
+    for model in models:
+        model.embed_documents(["grapes"])
+    assert [m.underlying.embedded for m in models] == [["grapes"]] * 3
+
+    # Queries are cached apart from documents.
+    assert models[0].embed_query("grapes") == [-6.0, -0.0, -1.0]
+    assert models[0].embed_query("grapes") == [-6.0, -0.0, -1.0]
+    assert small.embedded == ["grapes", "grapes"]
+
+
+def test_disk_tier_is_shared_across_processes(tmp_path: Path) -> None:
+    path = str(tmp_path / "embeddings.sqlite3")
+    CachedEmbeddings(
+        CountingEmbeddings(), "openai/small", cache=EmbeddingCache(path)
+    ).embed_documents(["grapes"])
+
+    underlying = CountingEmbeddings()
+    cache = EmbeddingCache(path, max_memory_entries=1)
+    model = CachedEmbeddings(underlying, "openai/small", cache=cache)
+
+    async def scenario() -> list[list[float]]:
+        return await model.aembed_documents(["grapes", "raisins"])
+
+    assert asyncio.run(scenario()) == [[6.0, 0.0, 1.0], [7.0, 0.0, 1.0]]
+    assert underlying.embedded == ["raisins"]
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_default_cache_lives_in_the_data_directory(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("PETOPETA_DATA_DIR", str(tmp_path))
+    monkeypatch.delenv("EMBEDDING_CACHE_PATH", raising=False)
+
+    get_embedding_cache(max_memory_entries=7).put_many({})
+
+    assert (tmp_path / "embedding_cache.sqlite3").exists()
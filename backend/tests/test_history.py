@@ -0,0 +1,133 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from backend.retrieval_graph import graph as retrieval_graph
+from backend.retrieval_graph.configuration import AgentConfiguration
+from backend.retrieval_graph.history import (
+    BackgroundSummaries,
+    format_transcript,
+    history_view,
+    summary_range,
+    turn_starts,
+)
+from backend.retrieval_graph.state import AgentState
+from backend.token_counter import TokenCounter
+
+counter = TokenCounter(encoding=None)
+
+
+def _conversation(turns: int, answer_words: int = 10) -> list:
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(f"Question {turn}?"))
+        messages.append(AIMessage(" ".join(["answer"] * answer_words)))
+    return messages
+
+
+def test_turn_starts() -> None:
+    messages = [AIMessage("Hello!"), *_conversation(2)]
+
+    assert turn_starts(messages) == [0, 1, 3]
+    assert turn_starts([]) == []
+
+
+def test_summary_range_keeps_the_last_turns_verbatim() -> None:
+    messages = _conversation(5)
+
+    assert summary_range(messages, 0, max_turns=3) == (0, 4)
+    # Incremental: only the turns summarized since the last refresh.
+    assert summary_range(messages, 2, max_turns=3) == (2, 4)
+    assert summary_range(messages, 4, max_turns=3) == (4, 4)
+    assert summary_range(messages, 0, max_turns=5) == (0, 0)
+    assert summary_range(messages, 0, max_turns=0) == (0, 10)
+    assert summary_range(messages, 0, max_turns=-1) == (0, 0)
+
+
+def test_history_view_replaces_the_summarized_turns() -> None:
+    messages = _conversation(5)
+
+    view = history_view(
+        messages, "The user has a cat.", summarized_messages=4, counter=counter
+    )
+
+    assert "The user has a cat." in view.messages[0].content
+    assert view.messages[1:] == messages[4:]
+    assert view.tokens_full == counter.count_messages(messages)
+    assert view.tokens_saved > 0
+    # Without a summary, nothing is replaced.
+    assert history_view(messages, "", 4, counter=counter).messages == messages
+
+
+def test_history_view_drops_the_oldest_turns_over_the_budget() -> None:
+    messages = _conversation(4, answer_words=200)
+    turn_tokens = counter.count_messages(messages[:2])
+
+    view = history_view(messages, max_tokens=2 * turn_tokens + 1, counter=counter)
+
+    assert view.messages == messages[4:]
+    assert view.dropped_turns == 2
+    assert view.tokens <= 2 * turn_tokens + 1
+    # The current question is always sent.
+    assert (
+        history_view(messages, max_tokens=1, counter=counter).messages == messages[6:]
+    )
+
+
+def test_format_transcript() -> None:
+    assert (
+        format_transcript(_conversation(1, answer_words=1))
+        == "User: Question 0?\n\nAssistant: answer"
+    )
+
+
+class FakeSummaryModel:
+    def __init__(self) -> None:
+        self.transcripts: list[str] = []
+        self.release = asyncio.Event()
+
+    async def ainvoke(self, messages: list, config: dict) -> AIMessage:
+        self.transcripts.append(messages[-1].content)
+        await self.release.wait()
+        return AIMessage(f"Summary {len(self.transcripts)}")
+
+
+def test_summaries_are_refreshed_in_the_background(monkeypatch) -> None:
+    model = FakeSummaryModel()
+    monkeypatch.setattr(retrieval_graph, "load_chat_model", lambda name: model)
+    monkeypatch.setattr(retrieval_graph, "background_summaries", BackgroundSummaries())
+    configuration = AgentConfiguration(history_max_turns=1)
+
+    def refresh(turns: int, summarized_messages: int = 0, thread_id="t") -> dict:
+        state = AgentState(
+            messages=[*_conversation(turns), HumanMessage(f"Question {turns}?")],
+            summarized_messages=summarized_messages,
+        )
+        config = {"configurable": {"thread_id": thread_id}}
+        return retrieval_graph._refresh_summary(state, configuration, config)
+
+    async def scenario() -> None:
+        assert refresh(1) == {}
+        # The turn does not wait for the refresh it starts.
+        assert refresh(2) == {}
+        await asyncio.sleep(0)
+        assert len(model.transcripts) == 1
+        assert "Question 0?" in model.transcripts[0]
+        assert "Question 1?" not in model.transcripts[0]
+
+        # A running refresh is neither adopted nor started again.
+        assert refresh(3) == {}
+        model.release.set()
+        await asyncio.sleep(0.01)
+        assert refresh(3) == {"summary": "Summary 1", "summarized_messages": 2}
+        await asyncio.sleep(0)
+        # The next refresh starts from the adopted summary.
+        assert len(model.transcripts) == 2
+        assert "Question 0?" not in model.transcripts[1]
+        assert "Question 1?" in model.transcripts[1]
+
+        # Turns without a thread have no state to keep a summary in.
+        assert refresh(3, thread_id=None) == {}
+        assert len(model.transcripts) == 2
+
+    asyncio.run(scenario())
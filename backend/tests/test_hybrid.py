@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from langchain_core.documents import Document
+
+from backend.retrieval_graph.researcher_graph.hybrid import (
+    HybridRetrievalStats,
+    hybrid_retrieve,
+    reciprocal_rank_fusion,
+)
+
+
+def _doc(source: str, content: str = "") -> Document:
+    return Document(page_content=content or source, metadata={"source": source})
+
+
+def _search(documents: list[Document], delay: float = 0.0, error: bool = False):
+    async def search() -> list[Document]:
+        await asyncio.sleep(delay)
+        if error:
+            raise RuntimeError("source is down")
+        return documents
+
+    return search
+
+
+def test_reciprocal_rank_fusion_merges_and_copies() -> None:
+    library = [_doc("a"), _doc("b")]
+    web = [_doc("b"), _doc("c")]
+
+    fused = reciprocal_rank_fusion({"library": library, "web": web}, k=60)
+
+    assert [doc.metadata["source"] for doc in fused] == ["b", "a", "c"]
+    assert fused[0].metadata["retrieval_sources"] == ["library", "web"]
+    assert fused[0].metadata["rrf_score"] == 1 / 62 + 1 / 61
+    assert fused[1].metadata["rrf_score"] == 1 / 61
+    # The input documents are left unchanged.
+    assert library[1].metadata == {"source": "b"}
+    assert fused[0] is not library[1]
+
+
+def test_chunks_of_one_source_are_kept_apart() -> None:
+    fused = reciprocal_rank_fusion(
+        {"library": [_doc("a", "first"), _doc("a", "second")], "web": []}
+    )
+
+    assert [doc.page_content for doc in fused] == ["first", "second"]
+
+
+def test_late_and_failing_sources_are_dropped() -> None:
+    stats = HybridRetrievalStats()
+
+    async def scenario() -> list[Document]:
+        return await hybrid_retrieve(
+            "grapes",
+            {
+                "library": (_search([_doc("a")]), 1.0),
+                "web": (_search([_doc("b")], delay=5.0), 0.05),
+                "broken": (_search([_doc("c")], error=True), 1.0),
+            },
+            stats=stats,
+        )
+
+    start = time.perf_counter()
+    fused = asyncio.run(scenario())
+
+    # The research step waits for the deadline of the late source, not its search.
+    assert time.perf_counter() - start < 1.0
+    assert [doc.metadata["source"] for doc in fused] == ["a"]
+    sources = stats.stats()
+    assert sources["library"]["ok"] == 1
+    assert sources["library"]["documents_contributed"] == 1
+    assert sources["web"]["timeout"] == 1
+    assert sources["web"]["latency_ms_total"] < 1000
+    assert sources["broken"]["error"] == 1
+    assert sources["broken"]["documents_returned"] == 0
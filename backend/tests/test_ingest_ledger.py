@@ -0,0 +1,129 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from backend.ingest import delete_vanished_pages
+from backend.ingest_ledger import (
+    IngestionLedger,
+    IngestionReport,
+    chunk_vector_id,
+    ledger_database_url,
+)
+
+URL = "https://www.avma.org/resources/grapes"
+OTHER_URL = "https://www.avma.org/resources/walks"
+
+
+class RecordingVectorStore:
+    def __init__(self) -> None:
+        self.deleted: list[str] = []
+
+    def delete(self, ids: list[str]) -> None:
+        self.deleted.extend(ids)
+
+
+def _chunks(*texts: str) -> list[Document]:
+    return [Document(page_content=text) for text in texts]
+
+
+def _ingest(
+    ledger: IngestionLedger, url: str, lastmod: str, chunks: list[Document]
+) -> tuple[IngestionReport, list[str]]:
+    report = IngestionReport()
+    page, pending, vanished = ledger.plan_page(url, lastmod, chunks, report)
+    ledger.forget_chunks(url, vanished)
+    ledger.record_chunks(pending)
+    for chunk in pending:
+        chunk.page.chunk_written()
+    ledger.record_page(page)
+    return report, vanished
+
+
+def test_unchanged_pages_are_skipped(tmp_path: Path) -> None:
+    ledger = IngestionLedger(str(tmp_path / "ledger.sqlite3"), "docs")
+    assert ledger.unchanged_chunks(URL, "2026-01-01") is None
+
+    report, _ = _ingest(ledger, URL, "2026-01-01", _chunks("grapes", "raisins"))
+
+    assert str(report) == "2 added, 0 updated, 0 skipped, 0 deleted"
+    assert ledger.unchanged_chunks(URL, "2026-01-01") == 2
+    assert ledger.unchanged_chunks(URL, "2026-02-01") is None
+    # Pages without a lastmod are always fetched again.
+    assert ledger.unchanged_chunks(URL, None) is None
+    # The ledger survives the process, and is partitioned by collection.
+    assert (
+        IngestionLedger(str(tmp_path / "ledger.sqlite3"), "docs").unchanged_chunks(
+            URL, "2026-01-01"
+        )
+        == 2
+    )
+    assert (
+        IngestionLedger(str(tmp_path / "ledger.sqlite3"), "other").unchanged_chunks(
+            URL, "2026-01-01"
+        )
+        is None
+    )
+
+
+def test_only_changed_chunks_are_written(tmp_path: Path) -> None:
+    ledger = IngestionLedger(str(tmp_path / "ledger.sqlite3"), "docs")
+    _ingest(ledger, URL, "2026-01-01", _chunks("grapes", "raisins", "chocolate"))
+
+    report = IngestionReport()
+    page, pending, vanished = ledger.plan_page(
+        URL, "2026-02-01", _chunks("grapes", "currants"), report
+    )
+
+    assert str(report) == "0 added, 1 updated, 1 skipped, 0 deleted"
+    assert [(chunk.position, chunk.document.page_content) for chunk in pending] == [
+        (1, "currants")
+    ]
+    # The vector of a changed chunk is overwritten in place.
+    assert pending[0].vector_id == chunk_vector_id(URL, 1) == pending[0].document.id
+    assert vanished == [chunk_vector_id(URL, 2)]
+    assert page.remaining == 1
+    # The lastmod is only recorded once every chunk of the page is written.
+    assert ledger.unchanged_chunks(URL, "2026-02-01") is None
+
+
+def test_vanished_pages_are_deleted_only_when_the_whole_sitemap_is_loaded(
+    tmp_path: Path,
+) -> None:
+    ledger = IngestionLedger(str(tmp_path / "ledger.sqlite3"), "docs")
+    _ingest(ledger, URL, "2026-01-01", _chunks("grapes"))
+    _ingest(ledger, OTHER_URL, "2026-01-01", _chunks("short walks", "long walks"))
+    entries = [{"loc": f" {URL} "}]
+    vectorstore, report = RecordingVectorStore(), IngestionReport()
+
+    delete_vanished_pages(
+        SimpleNamespace(blocksize=1), entries, vectorstore, ledger, report
+    )
+    assert vectorstore.deleted == []
+    assert ledger.unchanged_chunks(OTHER_URL, "2026-01-01") == 2
+
+    delete_vanished_pages(
+        SimpleNamespace(blocksize=None), entries, vectorstore, ledger, report
+    )
+    assert vectorstore.deleted == [
+        chunk_vector_id(OTHER_URL, 0),
+        chunk_vector_id(OTHER_URL, 1),
+    ]
+    assert report.deleted == 2
+    assert ledger.unchanged_chunks(OTHER_URL, "2026-01-01") is None
+    assert ledger.vanished_pages([URL]) == {}
+
+
+def test_ledger_database_url() -> None:
+    # The ledger shares the async URL of the vector store, through a sync driver.
+    assert (
+        ledger_database_url("postgresql+asyncpg://u:p@db:5432/vectors").drivername
+        == "postgresql+psycopg"
+    )
+    assert (
+        ledger_database_url("postgresql://u:p@db/vectors").drivername
+        == "postgresql+psycopg"
+    )
+    assert (
+        ledger_database_url("/data/ledger.sqlite3").database == "/data/ledger.sqlite3"
+    )
@@ -0,0 +1,104 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from backend.ingest_pipeline import Pipeline, PipelineError, Stage
+
+
+def test_items_flow_through_the_stages_in_order() -> None:
+    written = []
+
+    def double(item: int):
+        yield item
+        yield item
+
+    def write(batch: list[int]):
+        written.extend(batch)
+        yield len(batch)
+
+    stats = Pipeline(
+        range(10),
+        [Stage("double", double), Stage("write", write, batch_size=3)],
+        queue_size=2,
+        progress_interval_seconds=None,
+    ).run()
+
+    assert written == [n for n in range(10) for _ in range(2)]
+    assert (stats["double"].items_in, stats["double"].items_out) == (10, 20)
+    # The last, partial batch is flushed.
+    assert (stats["write"].items_in, stats["write"].items_out) == (20, 7)
+
+
+def test_slow_stages_hold_back_the_source() -> None:
+    lock = threading.Lock()
+    counts = {"produced": 0, "consumed": 0, "ahead": 0}
+
+    def source():
+        for n in range(200):
+            with lock:
+                counts["produced"] += 1
+                counts["ahead"] = max(
+                    counts["ahead"], counts["produced"] - counts["consumed"]
+                )
+            yield n
+
+    def slow(item: int):
+        time.sleep(0.001)
+        with lock:
+            counts["consumed"] += 1
+        return []
+
+    Pipeline(
+        source(),
+        [Stage("pass", lambda item: [item]), Stage("slow", slow, queue_size=1)],
+        queue_size=2,
+        progress_interval_seconds=None,
+    ).run()
+
+    assert counts["consumed"] == 200
+    # Two queues, the item of each stage and the item being produced.
+    assert counts["ahead"] <= 2 + 1 + 1 + 1 + 1
+
+
+def test_a_failing_stage_stops_the_pipeline() -> None:
+    processed = []
+
+    def fail_on_five(item: int):
+        if item == 5:
+            raise ValueError("bad item")
+        processed.append(item)
+        return [item]
+
+    pipeline = Pipeline(
+        itertools.count(),
+        [Stage("check", fail_on_five, workers=2), Stage("sink", lambda item: [])],
+        queue_size=4,
+        progress_interval_seconds=None,
+    )
+
+    with pytest.raises(PipelineError) as info:
+        pipeline.run()
+
+    assert isinstance(info.value.__cause__, ValueError)
+    # The endless source is not drained.
+    assert len(processed) < 1000
+
+
+def test_a_failing_source_stops_the_pipeline() -> None:
+    def source():
+        yield 1
+        raise OSError("sitemap unavailable")
+
+    with pytest.raises(PipelineError) as info:
+        Pipeline(
+            source(), [Stage("sink", lambda item: [])], progress_interval_seconds=None
+        ).run()
+
+    assert isinstance(info.value.__cause__, OSError)
+
+
+def test_queue_sizes_should_be_positive() -> None:
+    with pytest.raises(ValueError):
+        Pipeline([], [Stage("sink", lambda item: [], queue_size=0)])
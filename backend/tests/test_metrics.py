@@ -0,0 +1,122 @@
+import asyncio
+from dataclasses import dataclass
+
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.store.memory import InMemoryStore
+
+from backend.metrics import (
+    MetricsRegistry,
+    instrument_store,
+    llm_duration_seconds,
+    node_duration_seconds,
+    store_duration_seconds,
+)
+
+
+def _count(histogram, **labels) -> int:
+    key = tuple(labels[name] for name in histogram.labelnames)
+    counts, _ = histogram._values.get(key, ([0], [0.0]))
+    return sum(counts)
+
+
+def test_render_histogram_and_counter() -> None:
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("op",), (0.1, 1.0))
+    errors = registry.counter("errors_total", "Errors.", ("op",))
+    latency.observe(0.05, op="a")
+    latency.observe(0.5, op="a")
+    latency.observe(5.0, op="a")
+    errors.inc(op='say "hi"')
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{op="a",le="0.1"} 1',
+        'latency_seconds_bucket{op="a",le="1.0"} 2',
+        'latency_seconds_bucket{op="a",le="+Inf"} 3',
+        'latency_seconds_sum{op="a"} 5.55',
+        'latency_seconds_count{op="a"} 3',
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{op="say \\"hi\\""} 1.0',
+    ]
+
+
+def test_render_stats() -> None:
+    registry = MetricsRegistry()
+    registry.register_stats(
+        "cache", lambda: {"hits": 3, "reason:x": 1, "name": "skipped"}, {"path": "a"}
+    )
+    registry.register_stats(
+        "sources",
+        lambda: {"web": {"ok": 2}, "library": {"ok": 1}},
+        nested_label="source",
+    )
+
+    assert registry.render().splitlines() == [
+        "# TYPE petopeta_cache_hits gauge",
+        'petopeta_cache_hits{path="a"} 3',
+        "# TYPE petopeta_cache_reason_x gauge",
+        'petopeta_cache_reason_x{path="a"} 1',
+        "# TYPE petopeta_sources_ok gauge",
+        'petopeta_sources_ok{source="web"} 2',
+        'petopeta_sources_ok{source="library"} 1',
+    ]
+
+
+@dataclass
+class _State:
+    text: str = ""
+
+
+def test_graph_nodes_and_llm_calls_are_timed_once() -> None:
+    model = GenericFakeChatModel(messages=iter([AIMessage("a"), AIMessage("b")]))
+
+    async def ask(state: _State) -> dict:
+        return {"text": (await model.ainvoke("hi")).content}
+
+    inner_builder = StateGraph(_State)
+    inner_builder.add_node("metrics_test_ask", ask)
+    inner_builder.add_edge(START, "metrics_test_ask")
+    inner_builder.add_edge("metrics_test_ask", END)
+    inner = inner_builder.compile()
+
+    async def delegate(state: _State) -> dict:
+        return {"text": (await inner.ainvoke({}))["text"]}
+
+    outer_builder = StateGraph(_State)
+    outer_builder.add_node("metrics_test_delegate", delegate)
+    outer_builder.add_node("metrics_test_ask", ask)
+    outer_builder.add_edge(START, "metrics_test_delegate")
+    outer_builder.add_edge("metrics_test_delegate", "metrics_test_ask")
+    outer_builder.add_edge("metrics_test_ask", END)
+    outer = outer_builder.compile()
+
+    llm_calls = _count(llm_duration_seconds, model="unknown")
+    asyncio.run(outer.ainvoke({}))
+
+    assert _count(node_duration_seconds, node="metrics_test_delegate") == 1
+    assert _count(node_duration_seconds, node="metrics_test_ask") == 1
+    # Nodes of a graph invoked from a node are named after the calling node as well.
+    assert (
+        _count(node_duration_seconds, node="metrics_test_delegate/metrics_test_ask")
+        == 1
+    )
+    assert _count(llm_duration_seconds, model="unknown") == llm_calls + 2
+
+
+def test_instrumented_store() -> None:
+    store = instrument_store(InMemoryStore())
+    assert instrument_store(store) is store
+    searches = _count(store_duration_seconds, operation="search")
+    puts = _count(store_duration_seconds, operation="put")
+
+    async def run() -> list:
+        await store.aput(("pets", "u"), "pet_a", {"name": "a"})
+        return await store.asearch(("pets", "u"))
+
+    assert [item.value for item in asyncio.run(run())] == [{"name": "a"}]
+    assert _count(store_duration_seconds, operation="search") == searches + 1
+    assert _count(store_duration_seconds, operation="put") == puts + 1
@@ -0,0 +1,45 @@
+import pytest
+
+from backend.model_pool import ChatModelPool
+
+
+class FakeModel:
+    def __init__(self, model: str, model_provider: str, **kwargs) -> None:
+        self.model = model
+        self.kwargs = kwargs
+
+
+def test_reuses_clients_by_provider_model_and_kwargs() -> None:
+    pool = ChatModelPool(max_size=4, factory=FakeModel)
+
+    first = pool.get("openai", "gpt-4o", temperature=0)
+    assert pool.get("openai", "gpt-4o", temperature=0) is first
+    assert pool.get("openai", "gpt-4o", temperature=1) is not first
+    assert pool.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "size": 2,
+        "max_size": 4,
+        "live_connections": 0,
+    }
+
+
+def test_evicts_the_least_recently_used_client() -> None:
+    pool = ChatModelPool(max_size=2, factory=FakeModel)
+
+    a = pool.get("openai", "a")
+    pool.get("openai", "b")
+    pool.get("openai", "a")
+    pool.get("openai", "c")
+
+    assert pool.get("openai", "a") is a
+    assert pool.stats()["evictions"] == 1
+    # "b" was the least recently used client.
+    pool.get("openai", "b")
+    assert pool.stats()["misses"] == 4
+
+
+def test_rejects_an_empty_pool() -> None:
+    with pytest.raises(ValueError):
+        ChatModelPool(max_size=0)
@@ -0,0 +1,85 @@
+import random
+import warnings
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+
+from backend.parser import avma_docs_extractor, avma_docs_extractor_lxml
+
+PAGES_DIR = Path(__file__).parent / "data" / "avma_pages"
+PAGES = sorted(PAGES_DIR.glob("*.html"))
+# The loader parses article pages (.xml URLs) with the "xml" parser, others with "lxml".
+PARSERS = ["xml", "lxml"]
+
+
+def bs4_extract(markup: str, parser: str) -> str:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", XMLParsedAsHTMLWarning)
+        return avma_docs_extractor(BeautifulSoup(markup, parser))
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("page", PAGES, ids=lambda page: page.stem)
+def test_lxml_extractor_matches_bs4_on_corpus(page: Path, parser: str) -> None:
+    markup = page.read_text()
+    assert avma_docs_extractor_lxml(markup, parser) == bs4_extract(markup, parser)
+
+
+def test_lxml_extractor_output() -> None:
+    markup = (PAGES_DIR / "tabs_and_code.html").read_text()
+    output = avma_docs_extractor_lxml(markup, "lxml")
+    assert "Dogs\nGive `5 mg/kg` twice daily." in output
+    assert "```python\ndef dose(weight_kg):\n    return weight_kg * 5\n```" in output
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("markup", ["", "   ", "plain text", "<p>no root"])
+def test_lxml_extractor_matches_bs4_on_degenerate_markup(
+    markup: str, parser: str
+) -> None:
+    assert avma_docs_extractor_lxml(markup, parser) == bs4_extract(markup, parser)
+
+
+_FUZZ_TAGS = [
+    "h1", "h3", "a", "img", "strong", "b", "em", "i", "br", "code", "pre", "p",
+    "ul", "ol", "li", "div", "table", "thead", "tbody", "tr", "td", "th", "button",
+    "span", "nav", "footer", "aside", "script", "style", "textarea", "rt",
+    "template", "section", "x:nav", "y:span",
+]  # fmt: skip
+_FUZZ_STRINGS = [
+    "hello", " ", "\n  ", "\t", "world &amp; co", "&nbsp;x", "<!-- c -->",
+    "<!--\n-->", "<?php x ?>", "<![CDATA[cd]]>", "  a  ", "é",
+]  # fmt: skip
+_FUZZ_ATTRIBUTES = [
+    'class="content-box"', 'class="x content-box y"', 'class="tabs-container"',
+    'class="token-line"', 'class="token-line z"', 'class="language-py foo"',
+    'class="language-c-sharp"', 'class=" "', 'role="tab"', 'role="tabpanel"',
+    'href="/u"', 'alt="al" src="s.png"',
+]  # fmt: skip
+
+
+def _random_markup(rng: random.Random, depth: int = 0) -> str:
+    parts = []
+    for _ in range(rng.randint(0, 5)):
+        if depth > 5 or rng.random() < 0.4:
+            parts.append(rng.choice(_FUZZ_STRINGS))
+            continue
+        tag = rng.choice(_FUZZ_TAGS)
+        attributes = " ".join(rng.sample(_FUZZ_ATTRIBUTES, k=rng.choice([0, 0, 1, 2])))
+        parts.append(f"<{tag} {attributes}>{_random_markup(rng, depth + 1)}</{tag}>")
+    return "".join(parts)
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("seed", range(200))
+def test_lxml_extractor_matches_bs4_on_random_markup(seed: int, parser: str) -> None:
+    rng = random.Random(seed)
+    namespace = rng.choice(["", ' xmlns="http://www.w3.org/1999/xhtml"'])
+    boxes = "".join(
+        f'<div class="{rng.choice(["content-box", "a content-box", "other"])}">'
+        f"{_random_markup(rng)}</div>"
+        for _ in range(rng.randint(1, 3))
+    )
+    markup = f"<html{namespace}>\n <body>\n{boxes}\n</body></html>"
+    assert avma_docs_extractor_lxml(markup, parser) == bs4_extract(markup, parser)
@@ -0,0 +1,109 @@
+import asyncio
+
+from langgraph.store.memory import InMemoryStore
+
+from backend.prompts_local.en import NO_PET_FOUND_STR, PET_DELETED_STR
+from backend.retrieval_graph.pet_manager.profile_cache import PetProfileCache
+from backend.retrieval_graph.pet_manager.tools import delete_pet
+
+MILO = {"name": "Milo", "species": "cat"}
+REX = {"name": "Rex", "species": "dog"}
+
+
+class CountingStore(InMemoryStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.searches = 0
+
+    async def asearch(self, *args, **kwargs):
+        self.searches += 1
+        return await super().asearch(*args, **kwargs)
+
+
+def test_reads_the_store_once_until_invalidated() -> None:
+    async def scenario() -> None:
+        store = CountingStore()
+        await store.aput(("pets", "u"), "pet_Milo", MILO)
+        cache = PetProfileCache()
+
+        assert await cache.aget(store, "u", 60) == [MILO]
+        pets = await cache.aget(store, "u", 60)
+        assert store.searches == 1
+        pets[0]["name"] = "changed"
+        assert await cache.aget(store, "u", 60) == [MILO]
+
+        await store.aput(("pets", "u"), "pet_Rex", REX)
+        cache.invalidate("u")
+        assert len(await cache.aget(store, "u", 60)) == 2
+        assert store.searches == 2
+        # A zero staleness window always reads the store.
+        await cache.aget(store, "u", 0)
+        assert store.searches == 3
+        assert cache.stats()["hits"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_read_racing_a_write_is_not_cached() -> None:
+    async def scenario() -> None:
+        store = CountingStore()
+        cache = PetProfileCache()
+        release = asyncio.Event()
+        search = store.asearch
+
+        async def slow_search(*args, **kwargs):
+            result = await search(*args, **kwargs)
+            await release.wait()
+            return result
+
+        store.asearch = slow_search
+        read = asyncio.create_task(cache.aget(store, "u", 60))
+        await asyncio.sleep(0)
+        await store.aput(("pets", "u"), "pet_Milo", MILO)
+        cache.invalidate("u")
+        release.set()
+
+        assert await read == []
+        store.asearch = search
+        assert await cache.aget(store, "u", 60) == [MILO]
+        assert cache.stats()["discarded"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_evicts_the_least_recently_read_user() -> None:
+    async def scenario() -> None:
+        store = CountingStore()
+        cache = PetProfileCache(max_users=2)
+        for user in ("a", "b", "a", "c", "a"):
+            await cache.aget(store, user, 60)
+
+        assert store.searches == 3
+        assert cache.stats()["evictions"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_delete_pet_matches_on_the_given_fields() -> None:
+    async def scenario() -> None:
+        store = InMemoryStore()
+        await store.aput(("pets", "u"), "pet_Milo", MILO)
+        await store.aput(("pets", "u"), "pet_Rex", REX)
+        config = {"metadata": {"user_id": "u"}}
+
+        async def delete(**fields) -> str:
+            arguments = {"name": None, "species": None, "breed": None, "age": None}
+            return await delete_pet.ainvoke(
+                {**arguments, **fields, "store": store}, config=config
+            )
+
+        assert await delete(name="Rex", species="cat") == NO_PET_FOUND_STR
+        assert await delete() == NO_PET_FOUND_STR
+        assert [item.key for item in await store.asearch(("pets", "u"))] == [
+            "pet_Milo",
+            "pet_Rex",
+        ]
+        assert await delete(name="Rex") == PET_DELETED_STR
+        assert [item.key for item in await store.asearch(("pets", "u"))] == ["pet_Milo"]
+
+    asyncio.run(scenario())
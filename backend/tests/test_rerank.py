@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+
+from backend.retrieval_graph.rerank import BM25Index, rerank_by_relevance, tokenize
+
+
+def _doc(name: str, content: str, step: str = "") -> Document:
+    metadata = {"name": name}
+    if step:
+        metadata["research_step"] = step
+    return Document(page_content=content, metadata=metadata)
+
+
+def test_tokenize() -> None:
+    assert tokenize("What is the Renal-diet for my cat's kidneys?") == [
+        "renal",
+        "diet",
+        "cat",
+        "s",
+        "kidneys",
+    ]
+    assert tokenize("Pancréatite du chien — ÉTAPE_2") == [
+        "pancréatite",
+        "du",
+        "chien",
+        "étape",
+        "2",
+    ]
+
+
+def test_bm25_scores() -> None:
+    index = BM25Index([["kidney", "diet"], ["kidney"], ["walk", "walk"]])
+    scores = index.scores(["kidney", "diet"])
+
+    assert scores[0] > scores[1] > scores[2] == 0.0
+
+
+def test_rerank_by_question_then_plan_step() -> None:
+    documents = [
+        _doc("walks", "Dogs need daily walks.", step="How much exercise?"),
+        _doc(
+            "grooming",
+            "Grooming and brushing keep the coat healthy.",
+            step="Grooming a cat",
+        ),
+        _doc("diet", "A renal diet helps cats with kidney disease."),
+        _doc("unrelated", "Parrots can learn words.", step="Grooming a cat"),
+    ]
+
+    reranked = rerank_by_relevance("Which diet for my cat's kidney disease?", documents)
+
+    # "grooming" only matches through its plan step, ties keep the retrieval order.
+    assert [doc.metadata["name"] for doc in reranked] == [
+        "diet",
+        "grooming",
+        "walks",
+        "unrelated",
+    ]
+    assert [
+        doc.metadata["name"]
+        for doc in rerank_by_relevance("kidney diet", documents, step_weight=0)
+    ] == ["diet", "walks", "grooming", "unrelated"]
+
+
+def test_accented_query_terms_match_the_documents() -> None:
+    documents = [
+        _doc("walks", "Les chiens ont besoin de promenades."),
+        _doc("pancreatitis", "La pancréatite du chien: régime pauvre en graisses."),
+    ]
+
+    reranked = rerank_by_relevance("Pancréatite, quel régime ?", documents)
+
+    assert [doc.metadata["name"] for doc in reranked] == ["pancreatitis", "walks"]
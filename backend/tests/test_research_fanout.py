@@ -0,0 +1,40 @@
+import asyncio
+
+from langgraph.types import Send
+
+from backend.retrieval_graph.graph import conduct_research
+from backend.retrieval_graph.state import AgentState
+
+PET = {"name": "Milo", "species": "cat"}
+
+
+def _conduct(steps: list[str], max_concurrent: int):
+    state = AgentState(messages=[], steps=steps, pets=[PET])
+    config = {
+        "configurable": {
+            "research_mode": "parallel",
+            "max_concurrent_research_steps": max_concurrent,
+        }
+    }
+    return asyncio.run(conduct_research(state, config=config))
+
+
+def test_fans_out_at_most_max_concurrent_steps() -> None:
+    command = _conduct([f"step {i}" for i in range(5)], max_concurrent=2)
+
+    assert all(isinstance(send, Send) for send in command.goto)
+    assert [send.arg.step for send in command.goto] == ["step 0", "step 1"]
+    assert command.update == {"steps": ["step 2", "step 3", "step 4"]}
+
+
+def test_sends_every_step_under_the_limit() -> None:
+    command = _conduct(["a", "b"], max_concurrent=4)
+
+    assert [send.arg.step for send in command.goto] == ["a", "b"]
+    assert command.update == {"steps": []}
+
+
+def test_goes_to_deduplication_without_steps() -> None:
+    command = _conduct([], max_concurrent=4)
+
+    assert command.goto == "deduplicate_documents"
@@ -0,0 +1,84 @@
+from langchain_core.messages import HumanMessage
+
+from backend.retrieval_graph.pet_manager.resolver import PetResolver
+
+MILO = {"name": "Milo", "species": "cat", "breed": "siamese"}
+REX = {"name": "Rex", "species": "dog", "breed": "beagle"}
+LUNA = {"name": "Luna", "species": "dog", "breed": "poodle"}
+HAPPY = {"name": "Happy", "species": "rabbit", "breed": ""}
+RECORDED = [MILO, REX, LUNA, HAPPY]
+
+
+def _resolve(text: str, recorded=RECORDED, last_pets=()):
+    return PetResolver().resolve([HumanMessage(text)], recorded, last_pets)
+
+
+def test_exact_and_fuzzy_names() -> None:
+    resolution = _resolve("Milo has been scratching a lot")
+    assert (resolution.pets, resolution.reason) == ([MILO], "name")
+
+    assert _resolve("Should Lunna get a bath?").pets == [LUNA]
+    assert _resolve("What about Milo and Rex?").pets == [MILO, REX]
+
+
+def test_common_word_names_only_match_capitalized() -> None:
+    assert _resolve("Is Happy eating enough hay?").pets == [HAPPY]
+    resolution = _resolve("I'm not happy with this food")
+    assert resolution.needs_llm
+    assert resolution.reason == "no_match"
+
+
+def test_common_word_names_starting_a_sentence_go_to_the_llm() -> None:
+    will = {"name": "Will", "species": "dog", "breed": ""}
+    may = {"name": "May", "species": "cat", "breed": ""}
+    recorded = [will, may, MILO]
+
+    for text in (
+        "Will he be ok after eating chocolate?",
+        "He ate chocolate. Will he be ok?",
+        "May I give her some milk?",
+        "Happy is not eating hay",
+    ):
+        resolution = _resolve(text, recorded=[*recorded, HAPPY], last_pets=[MILO])
+        assert (resolution.needs_llm, resolution.reason) == (True, "common_word_name")
+
+    assert _resolve("Should Will get a bath?", recorded=recorded).pets == [will]
+
+
+def test_breed_and_species() -> None:
+    assert _resolve("Is a siamese prone to asthma?").pets == [MILO]
+    assert _resolve("Can my cat eat tuna?").pets == [MILO]
+    # Two recorded dogs.
+    resolution = _resolve("Can my dog eat tuna?")
+    assert (resolution.needs_llm, resolution.reason) == (True, "ambiguous")
+
+
+def test_pronoun_carry_over() -> None:
+    resolution = _resolve("She still won't eat", last_pets=[MILO])
+    assert (resolution.pets, resolution.reason) == ([MILO], "pronoun")
+
+    # "it" refers to anything, and other animals are not carried over.
+    assert _resolve("Is it safe to feed raw meat?", last_pets=[MILO]).needs_llm
+    assert _resolve("She found a hedgehog in the garden", last_pets=[MILO]).needs_llm
+    assert _resolve("Her pet sitter is late", last_pets=[MILO]).needs_llm
+
+
+def test_falls_back_to_the_llm() -> None:
+    assert _resolve("Milo weighs 5 kg now").reason == "update"
+    assert _resolve("We adopted a new kitten").reason == "new_pet"
+    assert _resolve("Milo and the parrot fight").reason == "new_pet"
+    twins = [MILO, {"name": "Milo", "species": "dog"}]
+    assert _resolve("Milo is sneezing", recorded=twins).reason == "ambiguous"
+
+
+def test_counts_the_paths() -> None:
+    resolver = PetResolver()
+    resolver.resolve([HumanMessage("Milo is sneezing")], RECORDED)
+    resolver.resolve([HumanMessage("We adopted a new kitten")], RECORDED)
+
+    assert resolver.stats() == {
+        "fast_path": 1,
+        "llm_path": 1,
+        "reason:name": 1,
+        "reason:new_pet": 1,
+    }
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_openai import OpenAIEmbeddings
+
+from backend import retrieval
+from backend.embeddings import CachedEmbeddings, EmbeddingCache
+from backend.retrieval import RetrieverRegistry, embedding_model_key
+
+
+def _cached(model: str, dimensions: Optional[int] = None) -> CachedEmbeddings:
+    return CachedEmbeddings(
+        OpenAIEmbeddings(model=model, dimensions=dimensions, api_key="test"),
+        model_name=f"openai/{model}",
+        cache=EmbeddingCache(),
+    )
+
+
+def test_embedding_model_key() -> None:
+    assert (
+        embedding_model_key(_cached("text-embedding-3-small"))
+        == "openai/text-embedding-3-small|default"
+    )
+    assert (
+        embedding_model_key(_cached("text-embedding-3-small", 512))
+        == "openai/text-embedding-3-small|512"
+    )
+    assert (
+        embedding_model_key(
+            OpenAIEmbeddings(model="text-embedding-3-large", api_key="test")
+        )
+        == "text-embedding-3-large|default"
+    )
+    assert embedding_model_key(FakeEmbeddings(size=3)) == "FakeEmbeddings|default"
+
+
+def test_pg_vectorstores_are_shared_per_table_and_model(monkeypatch) -> None:
+    created = []
+
+    async def create(engine, table_name, embedding_service):
+        created.append((table_name, embedding_service))
+        return object()
+
+    monkeypatch.setattr(retrieval.PGVectorStore, "create", create)
+    registry = RetrieverRegistry()
+    monkeypatch.setattr(registry, "pg_engine", lambda: None)
+    small, large = _cached("text-embedding-3-small"), _cached("text-embedding-3-large")
+
+    async def scenario() -> None:
+        first = await registry.apg_vectorstore("docs", small)
+        assert (
+            await registry.apg_vectorstore("docs", _cached("text-embedding-3-small"))
+            is first
+        )
+        assert await registry.apg_vectorstore("docs", large) is not first
+        assert await registry.apg_vectorstore("other", small) is not first
+
+    asyncio.run(scenario())
+    assert [(table, model.model_name) for table, model in created] == [
+        ("docs", "openai/text-embedding-3-small"),
+        ("docs", "openai/text-embedding-3-large"),
+        ("other", "openai/text-embedding-3-small"),
+    ]
@@ -0,0 +1,95 @@
+import json
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from backend.retrieval_graph.configuration import AgentConfiguration
+from backend.retrieval_graph.graph import _route_locally
+from backend.retrieval_graph.router_classifier import (
+    RouterClassifier,
+    benchmark,
+    main,
+    read_router_decisions,
+)
+from backend.retrieval_graph.state import AgentState
+
+DECISIONS = [
+    ("My dog is vomiting after eating grapes", "health"),
+    ("My cat has diarrhea and will not eat", "health"),
+    ("Is my puppy sick, he is coughing", "health"),
+    ("Why does my dog bark at night", "behavior"),
+    ("My cat scratches the sofa all the time", "behavior"),
+    ("How do I stop my puppy from biting", "behavior"),
+    ("What is the weather today", "general"),
+    ("Tell me a joke", "general"),
+    ("Who won the football game", "general"),
+]
+
+
+def _write_log(path: Path) -> None:
+    with path.open("w") as f:
+        for text, label in DECISIONS:
+            f.write(json.dumps({"text": text, "type": label, "latency_ms": 800}) + "\n")
+
+
+def _state(*messages: str) -> AgentState:
+    return AgentState(
+        messages=[
+            HumanMessage(text) if i % 2 == 0 else AIMessage(text)
+            for i, text in enumerate(messages)
+        ]
+    )
+
+
+def test_predict_learns_the_logged_decisions() -> None:
+    model = RouterClassifier.train(DECISIONS, epochs=30)
+
+    for text, label in DECISIONS:
+        assert model.predict(text)[0] == label
+    probabilities = model.predict_proba("my dog is vomiting")
+    assert set(probabilities) == {"behavior", "general", "health"}
+    assert abs(sum(probabilities.values()) - 1) < 1e-9
+
+
+def test_train_from_log_and_reload(tmp_path: Path) -> None:
+    log, out = tmp_path / "decisions.jsonl", tmp_path / "router_model.json"
+    _write_log(log)
+
+    main(["train", "--log", str(log), "--out", str(out), "--epochs", "30"])
+
+    model = RouterClassifier.load(str(out))
+    assert model.labels == ["behavior", "general", "health"]
+    assert model.predict("My cat has diarrhea and will not eat")[0] == "health"
+    rows = benchmark(model, read_router_decisions(str(log)), thresholds=[0.0])
+    # General decisions are left to the LLM router.
+    assert rows[0]["coverage"] == 6 / 9
+    assert rows[-1]["mean_latency_ms"] == 800
+
+
+def test_route_locally_falls_back_to_the_llm(tmp_path: Path) -> None:
+    path = tmp_path / "router_model.json"
+    RouterClassifier.train(DECISIONS, epochs=30).save(str(path))
+    model = RouterClassifier.load(str(path))
+    question = "My dog barks and vomits"
+    label, confidence = model.predict(question)
+    assert label != "general" and confidence < 0.99
+    configuration = AgentConfiguration(
+        router_model_path=str(path), router_confidence_threshold=confidence
+    )
+
+    router = _route_locally(_state(question), configuration)
+    assert router is not None and router["type"] == label
+    # Under the confidence threshold.
+    configuration.router_confidence_threshold = confidence + 0.01
+    assert _route_locally(_state(question), configuration) is None
+    configuration.router_confidence_threshold = 0.0
+    # General questions, follow-up questions and missing models go to the LLM.
+    assert _route_locally(_state("Tell me a joke"), configuration) is None
+    assert (
+        _route_locally(
+            _state("My cat is sick", "What happened?", question), configuration
+        )
+        is None
+    )
+    configuration.router_model_path = str(tmp_path / "missing.json")
+    assert _route_locally(_state(question), configuration) is None
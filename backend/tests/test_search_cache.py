@@ -0,0 +1,168 @@
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from langchain_core.documents import Document
+
+from backend.retrieval_graph.researcher_graph.search_cache import (
+    SearchCache,
+    _DiskTier,
+    normalize_query,
+)
+
+
+class Search:
+    def __init__(self, delay: float = 0.01, error: Optional[Exception] = None) -> None:
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self) -> list[Document]:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [
+            Document(
+                page_content="Grapes are toxic to dogs.",
+                metadata={"url": "https://example.com", "tags": ["dog"]},
+            )
+        ]
+
+
+def test_normalize_query() -> None:
+    assert normalize_query("  Can my DOG eat\n grapes? ") == "can my dog eat grapes"
+
+
+def test_concurrent_identical_queries_are_fetched_once() -> None:
+    async def scenario() -> None:
+        cache = SearchCache()
+        search = Search()
+
+        results = await asyncio.gather(
+            cache.aget_or_fetch("Can my dog eat grapes?", search),
+            cache.aget_or_fetch("can my dog eat grapes", search),
+            cache.aget_or_fetch("CAN MY DOG EAT GRAPES!", search),
+        )
+
+        assert search.calls == 1
+        assert results[0] == results[1] == results[2]
+        stats = cache.stats()
+        assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 2, 0)
+        await cache.aget_or_fetch("can my dog eat grapes", search)
+        assert search.calls == 1
+        assert cache.stats()["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_results_are_isolated_copies() -> None:
+    async def scenario() -> None:
+        cache = SearchCache()
+        search = Search()
+
+        leader, follower = await asyncio.gather(
+            cache.aget_or_fetch("grapes", search),
+            cache.aget_or_fetch("grapes", search),
+        )
+        leader[0].metadata["tags"].append("changed")
+        follower[0].page_content = "changed"
+
+        cached = await cache.aget_or_fetch("grapes", search)
+        assert cached[0].page_content == "Grapes are toxic to dogs."
+        assert cached[0].metadata["tags"] == ["dog"]
+        assert follower[0].metadata["tags"] == ["dog"]
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_waiter_and_are_not_cached() -> None:
+    async def scenario() -> None:
+        cache = SearchCache()
+        failing = Search(error=RuntimeError("search is down"))
+
+        results = await asyncio.gather(
+            cache.aget_or_fetch("grapes", failing),
+            cache.aget_or_fetch("grapes", failing),
+            return_exceptions=True,
+        )
+
+        assert failing.calls == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+        search = Search()
+        assert await cache.aget_or_fetch("grapes", search)
+        assert search.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiters_fetch_again_when_the_leader_is_cancelled() -> None:
+    async def scenario() -> None:
+        cache = SearchCache()
+        search = Search(delay=0.05)
+
+        leader = asyncio.create_task(cache.aget_or_fetch("grapes", search))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.aget_or_fetch("grapes", search))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        assert await follower
+        assert search.calls == 2
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_expired_results_are_fetched_again() -> None:
+    async def scenario() -> None:
+        cache = SearchCache(ttl_seconds=0)
+        search = Search(delay=0)
+
+        await cache.aget_or_fetch("grapes", search)
+        await asyncio.sleep(0.01)
+        await cache.aget_or_fetch("grapes", search)
+
+        assert search.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_outlives_the_memory_tier(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        path = str(tmp_path / "search.sqlite3")
+        search = Search(delay=0)
+        await SearchCache(disk_path=path).aget_or_fetch("grapes", search)
+
+        cache = SearchCache(disk_path=path)
+        documents = await cache.aget_or_fetch("Grapes?", search)
+
+        assert search.calls == 1
+        assert documents[0].metadata == {
+            "url": "https://example.com",
+            "tags": ["dog"],
+        }
+        assert cache.stats()["disk_hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_sweeps_expired_results_periodically(tmp_path: Path) -> None:
+    disk = _DiskTier(str(tmp_path / "search.sqlite3"), sweep_interval_seconds=60)
+    documents = [Document(page_content="Grapes are toxic to dogs.")]
+
+    def rows() -> int:
+        return disk._conn.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+
+    disk.put("raisins", float("inf"), documents, 1.0)
+    disk.put("grapes", 0.0, documents, 1.0)
+    # Expired results are not returned, and only swept on the next interval.
+    assert disk.get("grapes") is None
+    assert rows() == 2
+
+    disk._next_sweep = 0.0
+    disk.put("chocolate", float("inf"), documents, 1.0)
+    assert rows() == 2
+    assert disk.get("raisins") is not None
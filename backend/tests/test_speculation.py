@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend.retrieval_graph import graph as retrieval_graph
+from backend.retrieval_graph.pet_manager import speculation
+from backend.retrieval_graph.pet_manager.speculation import (
+    SpeculativePetResolution,
+    pet_speculation_stats,
+)
+from backend.retrieval_graph.state import AgentState
+
+MILO = {"name": "Milo", "species": "cat"}
+REX = {"name": "Rex", "species": "dog"}
+MESSAGES = [HumanMessage("Rex, my new dog, is limping")]
+
+
+class FakeFilterGraph:
+    def __init__(self, delay: float = 0.0, error: bool = False) -> None:
+        self.delay = delay
+        self.error = error
+        self.inputs = []
+        self.finished = False
+
+    async def ainvoke(self, inputs: dict) -> dict:
+        self.inputs.append(inputs)
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise RuntimeError("pet filter failed")
+        self.finished = True
+        return {"result_pets": [REX], "new_pets": [REX]}
+
+
+@pytest.fixture
+def stored(monkeypatch) -> list:
+    stored = []
+
+    async def store_new_pets(pets: list, config: dict) -> None:
+        stored.append((pets, config))
+
+    monkeypatch.setattr(speculation, "store_new_pets", store_new_pets)
+    return stored
+
+
+def _stats_delta(before: dict) -> dict:
+    return {
+        key: value - before[key]
+        for key, value in pet_speculation_stats.stats().items()
+        if key in ("started", "hits", "wasted", "wasted_completed")
+    }
+
+
+def test_adopted_resolutions_store_their_new_pets(monkeypatch, stored) -> None:
+    graph = FakeFilterGraph(delay=0.01)
+    monkeypatch.setattr(speculation, "pet_filter_graph", graph)
+    before = pet_speculation_stats.stats()
+    config = {"configurable": {"user_id": "u"}}
+
+    async def scenario() -> list:
+        resolution = SpeculativePetResolution(MESSAGES, [MILO])
+        # The router runs meanwhile.
+        await asyncio.sleep(0.02)
+        return await resolution.adopt(config)
+
+    assert asyncio.run(scenario()) == [REX]
+    # The speculative run does not write the store itself.
+    assert graph.inputs == [
+        {"messages": MESSAGES, "last_pets": [MILO], "write_new_pets": False}
+    ]
+    assert stored == [([REX], config)]
+    assert _stats_delta(before) == {
+        "started": 1,
+        "hits": 1,
+        "wasted": 0,
+        "wasted_completed": 0,
+    }
+
+
+def test_cancelled_resolutions_store_nothing(monkeypatch, stored) -> None:
+    graph = FakeFilterGraph(delay=1.0)
+    monkeypatch.setattr(speculation, "pet_filter_graph", graph)
+    before = pet_speculation_stats.stats()
+
+    async def scenario() -> None:
+        resolution = SpeculativePetResolution(MESSAGES, [MILO])
+        await asyncio.sleep(0)
+        await resolution.cancel()
+
+    asyncio.run(scenario())
+
+    assert not graph.finished
+    assert stored == []
+    assert _stats_delta(before) == {
+        "started": 1,
+        "hits": 0,
+        "wasted": 1,
+        "wasted_completed": 0,
+    }
+
+
+def test_completed_and_failed_resolutions_can_be_cancelled(monkeypatch, stored) -> None:
+    before = pet_speculation_stats.stats()
+
+    async def scenario(graph: FakeFilterGraph) -> None:
+        monkeypatch.setattr(speculation, "pet_filter_graph", graph)
+        resolution = SpeculativePetResolution(MESSAGES, [])
+        await asyncio.sleep(0.01)
+        await resolution.cancel()
+
+    asyncio.run(scenario(FakeFilterGraph()))
+    asyncio.run(scenario(FakeFilterGraph(error=True)))
+
+    assert stored == []
+    assert _stats_delta(before) == {
+        "started": 2,
+        "hits": 0,
+        "wasted": 2,
+        "wasted_completed": 2,
+    }
+
+
+def test_cancelling_the_node_still_propagates(monkeypatch, stored) -> None:
+    monkeypatch.setattr(speculation, "pet_filter_graph", FakeFilterGraph(delay=1.0))
+
+    async def node() -> None:
+        resolution = SpeculativePetResolution(MESSAGES, [])
+        try:
+            await asyncio.sleep(1.0)
+        finally:
+            await resolution.cancel()
+
+    async def scenario() -> None:
+        task = asyncio.create_task(node())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert stored == []
+
+
+class FakeRouterModel:
+    def __init__(self, route: str) -> None:
+        self.route = route
+
+    def with_structured_output(self, schema: type) -> "FakeRouterModel":
+        return self
+
+    async def ainvoke(self, messages: list) -> dict:
+        await asyncio.sleep(0.01)
+        return {"type": self.route, "logic": "test"}
+
+
+@pytest.mark.parametrize(
+    ("route", "goto", "pets"),
+    [
+        ("health", "lookup_cached_answer", [REX]),
+        ("general", "respond_to_general_query", None),
+    ],
+)
+def test_router_adopts_or_cancels_the_speculation(
+    monkeypatch, stored, route: str, goto: str, pets
+) -> None:
+    graph = FakeFilterGraph(delay=0.05)
+    monkeypatch.setattr(speculation, "pet_filter_graph", graph)
+    monkeypatch.setattr(
+        retrieval_graph, "load_chat_model", lambda name: FakeRouterModel(route)
+    )
+    config = {"configurable": {"speculative_pet_resolution": True}}
+
+    command = asyncio.run(
+        retrieval_graph.analyze_and_route_query(
+            AgentState(messages=MESSAGES, pets=[MILO]), config=config
+        )
+    )
+
+    assert command.goto == goto
+    assert command.update.get("pets") == pets
+    assert graph.finished == (pets is not None)
+    assert len(stored) == (pets is not None)
@@ -0,0 +1,73 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from backend.token_counter import (
+    MESSAGE_OVERHEAD_TOKENS,
+    TokenCounter,
+    approximate_tokens,
+    encoding_name,
+)
+
+
+def test_approximate_tokens() -> None:
+    assert approximate_tokens("") == 0
+    assert approximate_tokens("a" * 10) == 3
+    # CJK characters count about one token each.
+    assert approximate_tokens("我的猫不吃东西") == 7
+
+
+def test_encoding_name() -> None:
+    assert encoding_name("openai/gpt-4o") == "o200k_base"
+    assert encoding_name("openai/gpt-4") == "cl100k_base"
+    assert encoding_name("xai/grok-3") == "o200k_base"
+
+
+def test_counts_are_memoized_per_message_id_and_content() -> None:
+    counter = TokenCounter(encoding=None)
+    message = HumanMessage("How much should my cat eat?", id="1")
+
+    assert counter.count_message(message) == 7 + MESSAGE_OVERHEAD_TOKENS
+    counter.count_message(message)
+    assert (counter.hits, counter.misses) == (1, 1)
+
+    counter.count_message(HumanMessage("How much should my dog eat?", id="1"))
+    assert counter.misses == 2
+
+
+def test_counts_are_memoized_by_content_digest(monkeypatch) -> None:
+    counter = TokenCounter(encoding=None)
+    long_text = "kidney " * 100
+
+    # Texts are not keyed by their salted, 64-bit built-in hash.
+    monkeypatch.setattr("builtins.hash", lambda value: 0)
+    assert counter.count_text(long_text) == approximate_tokens(long_text)
+    assert counter.count_text(long_text + "diet") != counter.count_text(long_text)
+    assert counter.count_text("cat") != counter.count_text("a cat")
+    assert counter.count_text(long_text) == approximate_tokens(long_text)
+    assert (counter.hits, counter.misses) == (2, 4)
+
+
+def test_budget_keeps_the_last_turns() -> None:
+    counter = TokenCounter(encoding=None)
+    messages = [
+        HumanMessage("first " * 50),
+        AIMessage("", tool_calls=[{"name": "get_pets", "args": {}, "id": "call"}]),
+        ToolMessage("no pet found", tool_call_id="call"),
+        HumanMessage("second"),
+        AIMessage("answer"),
+    ]
+
+    assert counter.budget(messages, 0) == messages
+    assert counter.budget(messages, 100) == messages[3:]
+    # The last turn is kept over the budget, and never split.
+    assert counter.budget(messages, 1) == messages[3:]
+    assert counter.budget(messages[:3], 1) == messages[:3]
+    assert counter.dropped_messages == 6
+
+
+def test_truncate_text_keeps_the_beginning_within_the_budget() -> None:
+    counter = TokenCounter(encoding=None)
+
+    assert counter.truncate_text("short", 10) == "short"
+    assert counter.truncate_text("a" * 100, 10) == "a" * 40
+    assert counter.truncate_text("我的猫不吃东西", 3) == "我的猫"
+    assert counter.truncate_text("anything", 0) == ""
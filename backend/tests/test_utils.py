@@ -0,0 +1,47 @@
+from langchain_core.documents import Document
+
+from backend.utils import DocumentCollection, reduce_docs
+
+
+def _contents(documents: list[Document]) -> list[str]:
+    return [doc.page_content for doc in documents]
+
+
+def test_reduce_docs_deduplicates_by_uuid_and_content() -> None:
+    state = reduce_docs(
+        None,
+        [
+            "a",
+            {"page_content": "b", "metadata": {"uuid": "b", "source": "x"}},
+            Document(page_content="c"),
+        ],
+    )
+    state = reduce_docs(
+        state,
+        [
+            Document(page_content="b2", metadata={"uuid": "b"}),
+            Document(page_content="c"),
+            Document(page_content="d"),
+        ],
+    )
+    state = reduce_docs(state, "e")
+
+    assert isinstance(state, DocumentCollection)
+    assert _contents(state) == ["a", "b", "c", "d", "e"]
+    assert state[1].metadata == {"uuid": "b", "source": "x"}
+    assert all(doc.metadata.get("uuid") for doc in state)
+    assert reduce_docs(state, "delete") == []
+
+
+def test_reduce_docs_leaves_existing_states_unchanged() -> None:
+    base = reduce_docs([Document(page_content="a", metadata={"uuid": "a"})], ["b"])
+    first = reduce_docs(base, ["c"])
+    # Merging into an older state again, as after a fork, must not see "c".
+    second = reduce_docs(base, ["d", "c"])
+    # A state restored from a checkpoint is a plain list.
+    restored = reduce_docs(list(second), ["a", "e"])
+
+    assert _contents(base) == ["a", "b"]
+    assert _contents(first) == ["a", "b", "c"]
+    assert _contents(second) == ["a", "b", "d", "c"]
+    assert _contents(restored) == ["a", "b", "d", "c", "e"]
@@ -0,0 +1,260 @@
+"""Process-wide token counting of the texts and messages sent to the language models.
+
+The graph nodes budget their prompts in tokens: the conversation history, the retrieved
+documents packed in the response context, the inputs of the pet manager agent. They all
+count with this module:
+
+- OpenAI models are counted with their tiktoken encoding. The other providers (xAI,
+  Anthropic, Google) only count tokens through their APIs, which is too slow for a budget,
+  so their texts are counted with the `o200k_base` encoding, the closest local BPE
+  tokenizer;
+- encodings are loaded in a background thread, as tiktoken downloads them on first use.
+  Until an encoding is loaded, or when it cannot be (offline, tiktoken not installed),
+  tokens are approximated from the characters of the text;
+- counts are memoized by message id and content hash, so a message is tokenized once per
+  thread however many nodes and turns send it again.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Sequence, Union
+
+from langchain_core.messages import AnyMessage
+
+from backend.metrics import register_stats
+from backend.utils import get_message_text
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken comes with langchain-openai
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "o200k_base"
+CACHE_SIZE = int(os.environ.get("TOKEN_COUNTER_CACHE_SIZE", "16384"))
+# Texts up to this length are memoized by themselves, longer ones by a digest of their
+# content.
+SHORT_TEXT_LENGTH = 64
+# The role and separator tokens added by the chat templates to every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+# BPE tokenizers take about 4 characters of English text per token, and about one token
+# per CJK character.
+CHARS_PER_TOKEN = 4
+_WIDE_CHARACTERS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+_encodings: dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+
+
+def approximate_tokens(text: str) -> int:
+    """Approximate the number of tokens of a text from its characters."""
+    if text.isascii():
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    wide = len(_WIDE_CHARACTERS.findall(text))
+    return math.ceil((len(text) - wide) / CHARS_PER_TOKEN) + wide
+
+
+def encoding_name(model: str) -> str:
+    """Return the name of the tiktoken encoding counting the tokens of a model.
+
+    Args:
+        model (str): The model, in provider/model-name form.
+    """
+    provider, _, name = model.partition("/")
+    if provider == "openai" and tiktoken is not None:
+        try:
+            return tiktoken.encoding_name_for_model(name)
+        except KeyError:
+            pass
+    return DEFAULT_ENCODING
+
+
+def _load_encoding(name: str) -> None:
+    # Failed downloads raise OSErrors (requests errors included), unknown or corrupted
+    # encodings ValueErrors.
+    try:
+        encoding = tiktoken.get_encoding(name)
+    except (OSError, ValueError) as e:
+        logger.warning(
+            "The %s tokenizer could not be loaded, token counts are approximated: %s",
+            name,
+            e,
+        )
+        return
+    with _encodings_lock:
+        _encodings[name] = encoding
+
+
+def _get_encoding(name: str) -> Any:
+    """Return a loaded encoding, or None while it is loading or if it cannot be loaded."""
+    try:
+        return _encodings[name]
+    except KeyError:
+        pass
+    with _encodings_lock:
+        if name in _encodings or tiktoken is None:
+            return _encodings.get(name)
+        _encodings[name] = None
+    threading.Thread(
+        target=_load_encoding, args=(name,), name=f"load-{name}", daemon=True
+    ).start()
+    return None
+
+
+def _content_digest(text: str) -> Union[str, bytes]:
+    """Return the memo key of a text: short texts themselves, a 128-bit digest otherwise."""
+    if len(text) <= SHORT_TEXT_LENGTH:
+        return text
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class TokenCounter:
+    """A memoized token counter of texts and messages.
+
+    Args:
+        encoding (Optional[str]): The tiktoken encoding to count with, None to only
+            approximate the counts.
+        max_entries (int): The maximum number of memoized counts.
+    """
+
+    def __init__(
+        self, encoding: Optional[str] = DEFAULT_ENCODING, max_entries: int = CACHE_SIZE
+    ) -> None:
+        self.encoding = encoding
+        self.max_entries = max_entries
+        self._counts: OrderedDict[tuple, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.approximated = 0
+        self.budgets = 0
+        self.dropped_messages = 0
+
+    def _count(self, key: Any, text: str) -> int:
+        encoding = _get_encoding(self.encoding) if self.encoding else None
+        # Counts approximated while the encoding was loading are not reused once it is.
+        memo_key = (encoding is not None, key, _content_digest(text))
+        with self._lock:
+            count = self._counts.get(memo_key)
+            if count is not None:
+                self._counts.move_to_end(memo_key)
+                self.hits += 1
+                return count
+            self.misses += 1
+            self.approximated += encoding is None
+
+        if encoding is None:
+            count = approximate_tokens(text)
+        else:
+            count = len(encoding.encode(text, disallowed_special=()))
+
+        with self._lock:
+            self._counts[memo_key] = count
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_text(self, text: str) -> int:
+        """Return the number of tokens of a text."""
+        return self._count(None, text)
+
+    def truncate_text(self, text: str, max_tokens: int) -> str:
+        """Return the longest beginning of a text counting at most `max_tokens` tokens."""
+        encoding = _get_encoding(self.encoding) if self.encoding else None
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            # A token boundary may split a multi-byte character.
+            return encoding.decode_bytes(tokens[: max(0, max_tokens)]).decode(
+                errors="ignore"
+            )
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if approximate_tokens(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def count_message(self, message: AnyMessage) -> int:
+        """Return the number of prompt tokens of a message, its role included."""
+        return (
+            self._count(message.id, get_message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+        )
+
+    def count_messages(self, messages: Sequence[AnyMessage]) -> int:
+        """Return the number of prompt tokens of messages."""
+        return sum(map(self.count_message, messages))
+
+    def budget(self, messages: Sequence[AnyMessage], limit: int) -> list[AnyMessage]:
+        """Keep the last turns of a conversation that fit in a token budget.
+
+        A turn starts at a human message, so that tool calls are never separated from
+        their results. The last turn is always kept, even over the budget.
+
+        Args:
+            messages (Sequence[AnyMessage]): The conversation.
+            limit (int): The token budget, 0 for no budget.
+
+        Returns:
+            list[AnyMessage]: The messages of the last turns fitting in the budget.
+        """
+        if limit <= 0:
+            return list(messages)
+        total = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            total += self.count_message(messages[i])
+            if i == 0 or messages[i].type == "human":
+                if total > limit and start < len(messages):
+                    break
+                start = i
+        with self._lock:
+            self.budgets += 1
+            self.dropped_messages += start
+        return list(messages[start:])
+
+    def stats(self) -> dict[str, int]:
+        """Return a copy of the counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "approximated": self.approximated,
+                "budgets": self.budgets,
+                "dropped_messages": self.dropped_messages,
+                "size": len(self._counts),
+            }
+
+
+_counters: dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str = "") -> TokenCounter:
+    """Return the process-wide token counter of a model.
+
+    Models counted with the same encoding share their counter.
+
+    Args:
+        model (str): The model, in provider/model-name form. Empty for the default
+            encoding.
+    """
+    name = encoding_name(model)
+    counter = _counters.get(name)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.get(name)
+            if counter is None:
+                counter = TokenCounter(name)
+                _counters[name] = counter
+                register_stats(f"token_counter_{name}", counter.stats)
+    return counter
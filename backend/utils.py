@@ -1,16 +1,26 @@
 """Shared utility functions used in the project.
 
 Functions:
+    reduce_docs: Merge documents into the documents of a graph state.
     format_docs: Convert documents to an xml-formatted string.
-    load_chat_model: Load a chat model from a model name.
+    load_chat_model: Load a pooled chat model from a model name.
+    get_message_text: Get the text content of a message.
+    get_last_human_message_text: Get the text of the last message sent by the user.
+    data_path: Get the path of a local data file in the data directory.
 """
 
+import os
+import tempfile
 import uuid
-from typing import Any, Literal, Optional, Union
+from typing import Any, Literal, Optional, Sequence, Union
 
-from langchain.chat_models import init_chat_model
 from langchain_core.documents import Document
 from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage
+
+from backend.model_pool import get_chat_model_pool
+
+DATA_DIR_ENV = "PETOPETA_DATA_DIR"
 
 
 def _format_doc(doc: Document) -> str:
@@ -67,6 +77,9 @@ def format_docs(docs: Optional[list[Document]]) -> str:
 def load_chat_model(fully_specified_name: str) -> BaseChatModel:
     """Load a chat model from a fully specified name.
 
+    Clients are shared through the process-wide chat model pool, so repeated calls with
+    the same name reuse the same client and its keep-alive connections.
+
     Args:
         fully_specified_name (str): String in the format 'provider/model'.
     """
@@ -79,7 +92,174 @@ def load_chat_model(fully_specified_name: str) -> BaseChatModel:
     model_kwargs = {"temperature": 0}
     if provider == "google_genai":
         model_kwargs["convert_system_message_to_human"] = True
-    return init_chat_model(model, model_provider=provider, **model_kwargs)
+    return get_chat_model_pool().get(provider, model, **model_kwargs)
+
+
+def get_message_text(message: AnyMessage) -> str:
+    """Get the text content of a message, joining the text parts of multimodal content.
+
+    Args:
+        message (AnyMessage): The message.
+
+    Returns:
+        str: The text content of the message.
+    """
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        part if isinstance(part, str) else str(part.get("text", "")) for part in content
+    )
+
+
+def get_last_human_message_text(messages: Sequence[AnyMessage]) -> str:
+    """Get the text of the last human message of a conversation.
+
+    Args:
+        messages (Sequence[AnyMessage]): The messages of the conversation.
+
+    Returns:
+        str: The text content of the last human message, or an empty string if there is none.
+    """
+    for message in reversed(messages):
+        if message.type == "human":
+            return get_message_text(message)
+    return ""
+
+
+def data_path(filename: str) -> str:
+    """Get the path of a local data file, such as a cache database, in the data directory.
+
+    The data directory is set with the `PETOPETA_DATA_DIR` environment variable, and
+    defaults to a `petopeta` directory in the temporary directory. It is created if
+    needed.
+
+    Args:
+        filename (str): The name of the file.
+
+    Returns:
+        str: The path of the file in the data directory.
+    """
+    directory = os.environ.get(DATA_DIR_ENV) or os.path.join(
+        tempfile.gettempdir(), "petopeta"
+    )
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+class _DocumentIndex:
+    """Positions of the documents of a collection, by uuid and by content.
+
+    An index is shared by the collections extended from one another: each entry is valid
+    for the collections longer than its position. `length` is the length of the longest
+    of them, the only one the index can be extended from.
+    """
+
+    __slots__ = ("by_content", "by_uuid", "length")
+
+    def __init__(self) -> None:
+        self.by_uuid: dict[str, int] = {}
+        self.by_content: dict[str, int] = {}
+        self.length = 0
+
+    def add(self, doc: Document) -> None:
+        self.by_uuid.setdefault(doc.metadata["uuid"], self.length)
+        self.by_content.setdefault(doc.page_content, self.length)
+        self.length += 1
+
+
+class DocumentCollection(list[Document]):
+    """A list of documents indexed by uuid and by content, for `reduce_docs` merges.
+
+    Merging new documents looks them up in the index instead of scanning the existing
+    documents, and the index is shared with the merged collection instead of being
+    rebuilt. The list itself is still copied on each merge, a single C-level copy: the
+    previous value can be referenced by a checkpoint being saved, so it must not change.
+    """
+
+    __slots__ = ("_index",)
+
+    def __init__(self, documents: Sequence[Document] = ()) -> None:
+        super().__init__()
+        self._index = _DocumentIndex()
+        self._add(documents)
+
+    def _position(self, doc: Document) -> Optional[int]:
+        index = self._index
+        length = len(self)
+        position = index.by_uuid.get(doc.metadata.get("uuid"))
+        if position is not None and position < length:
+            return position
+        position = index.by_content.get(doc.page_content)
+        if position is not None and position < length:
+            return position
+        return None
+
+    def _add(self, documents: Sequence[Document]) -> None:
+        for doc in documents:
+            position = self._position(doc)
+            if position is None:
+                self._append(doc)
+            elif doc.metadata.get("queries"):
+                self._add_queries(position, doc.metadata["queries"])
+
+    def _add_queries(self, position: int, queries: list[str]) -> None:
+        kept = self[position]
+        kept_queries = kept.metadata.get("queries", [])
+        missing = [query for query in queries if query not in kept_queries]
+        if missing:
+            # Replaced by a copy: the kept document is shared with earlier collections.
+            list.__setitem__(
+                self,
+                position,
+                kept.model_copy(
+                    update={
+                        "metadata": {**kept.metadata, "queries": kept_queries + missing}
+                    }
+                ),
+            )
+
+    def _append(self, doc: Document) -> None:
+        if "uuid" not in doc.metadata:
+            doc = doc.model_copy(
+                update={"metadata": {**doc.metadata, "uuid": str(uuid.uuid4())}}
+            )
+        super().append(doc)
+        self._index.add(doc)
+
+    def merged(self, new: Sequence[Document]) -> "DocumentCollection":
+        """Return a collection with the documents of `new` that are not in this one added.
+
+        A document is already in the collection if a document with the same uuid or the
+        same content is, the `queries` it was retrieved with are then added to the ones of
+        that document. Documents without a uuid are added with a new one.
+
+        Args:
+            new (Sequence[Document]): The documents to add, in order.
+
+        Returns:
+            DocumentCollection: A new collection, this one is left unchanged.
+        """
+        merged = DocumentCollection.__new__(DocumentCollection)
+        list.extend(merged, self)
+        if self._index.length == len(self):
+            merged._index = self._index
+        else:
+            # Another collection was extended from a shorter version of this one: its
+            # entries past our length do not describe our documents.
+            merged._index = _DocumentIndex()
+            for doc in self:
+                merged._index.add(doc)
+        merged._add(new)
+        return merged
+
+
+def _to_document(item: Union[Document, dict[str, Any], str]) -> Document:
+    if isinstance(item, Document):
+        return item
+    if isinstance(item, dict):
+        return Document(**{**item, "metadata": dict(item.get("metadata") or {})})
+    return Document(page_content=item)
 
 
 def reduce_docs(
@@ -91,56 +271,31 @@ def reduce_docs(
         str,
         Literal["delete"],
     ],
-) -> list[Document]:
+) -> DocumentCollection:
     """Reduce and process documents based on the input type.
 
     This function handles various input types and converts them into a sequence of Document objects.
-    It also combines existing documents with the new one based on the document ID.
+    It also combines existing documents with the new ones, skipping the new documents with the
+    same uuid or the same content as a document already there. The search `queries` of a
+    skipped document are added to the ones of the document already there.
 
     Args:
         existing (Optional[Sequence[Document]]): The existing docs in the state, if any.
         new (Union[Sequence[Document], Sequence[dict[str, Any]], Sequence[str], str, Literal["delete"]]):
             The new input to process. Can be a sequence of Documents, dictionaries, strings, or a single string.
+            "delete" clears the documents.
+
+    Returns:
+        DocumentCollection: The merged documents.
     """
     if new == "delete":
-        return []
+        return DocumentCollection()
 
-    existing_list = list(existing) if existing else []
+    if isinstance(existing, DocumentCollection):
+        collection = existing
+    else:
+        # Restored from a checkpoint as a plain list, the index is rebuilt once.
+        collection = DocumentCollection(existing or ())
     if isinstance(new, str):
-        return existing_list + [
-            Document(page_content=new, metadata={"uuid": str(uuid.uuid4())})
-        ]
-
-    new_list = []
-    if isinstance(new, list):
-        existing_ids = set(doc.metadata.get("uuid") for doc in existing_list)
-        for item in new:
-            if isinstance(item, str):
-                item_id = str(uuid.uuid4())
-                new_list.append(Document(page_content=item, metadata={"uuid": item_id}))
-                existing_ids.add(item_id)
-
-            elif isinstance(item, dict):
-                metadata = item.get("metadata", {})
-                item_id = metadata.get("uuid", str(uuid.uuid4()))
-
-                if item_id not in existing_ids:
-                    new_list.append(
-                        Document(**item, metadata={**metadata, "uuid": item_id})
-                    )
-                    existing_ids.add(item_id)
-
-            elif isinstance(item, Document):
-                item_id = item.metadata.get("uuid")
-                if item_id is None:
-                    item_id = str(uuid.uuid4())
-                    new_item = item.copy(deep=True)
-                    new_item.metadata["uuid"] = item_id
-                else:
-                    new_item = item
-
-                if item_id not in existing_ids:
-                    new_list.append(new_item)
-                    existing_ids.add(item_id)
-
-    return existing_list + new_list
+        new = [new]
+    return collection.merged([_to_document(item) for item in new])